@@ -1,3 +1,79 @@
-from availability.adapters.dynamodb_repo import *
-from availability.adapters.event_processor import *
-from availability.adapters.restapi import *
+"""
+Adapters import boto3, aioboto3, fastapi or kinesis, each costly to import
+and only some needed by any one process, so the names re-exported here are
+imported from their modules when first accessed.
+"""
+
+from importlib import import_module
+
+
+_EXPORTS = {
+  "availability.adapters.dynamodb_repo": (
+    "DynamoEventStoreRepo",
+    "DynamoAvailabilityRepo",
+    "DynamoOutboxRepo",
+    "instrument_dynamodb",
+    "paginate",
+    "query_items",
+    "scan_items",
+    "batch_write",
+    "batch_get",
+    "time_bucket",
+    "time_buckets",
+    "availability_to_ddb_item",
+    "availability_from_ddb_item",
+    "snapshot_to_ddb_item",
+    "snapshot_from_ddb_item",
+  ),
+  "availability.adapters.aiodynamodb_repo": (
+    "AsyncDynamoResource",
+    "AsyncDynamoEventStoreRepo",
+    "AsyncDynamoAvailabilityRepo",
+    "apaginate",
+  ),
+  "availability.adapters.memory_repo": (
+    "InMemoryEventStoreRepo",
+    "InMemoryAvailabilityRepo",
+    "InMemoryOutboxRepo",
+    "AsyncInMemoryEventStoreRepo",
+    "AsyncInMemoryAvailabilityRepo",
+  ),
+  "availability.adapters.sqlite_repo": (
+    "SqliteDatabase",
+    "SqliteEventStoreRepo",
+    "SqliteAvailabilityRepo",
+    "SqliteOutboxRepo",
+  ),
+  "availability.adapters.cdc_codec": (
+    "CdcCodec",
+    "observe_projection_lag",
+  ),
+  "availability.adapters.event_processor": (
+    "process_availability_events",
+    "cdc_message_to_event",
+  ),
+  "availability.adapters.appointment_consumer": (
+    "process_appointment_events",
+    "appointment_message_to_command",
+  ),
+  "availability.adapters.restapi": (
+    "app",
+  ),
+}
+
+_MODULES = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULES)
+
+
+def __getattr__(name):
+  module = _MODULES.get(name)
+  if module is None:
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+  value = getattr(import_module(module), name)
+  globals()[name] = value
+  return value
+
+
+def __dir__():
+  return sorted(set(globals()) | set(_MODULES))
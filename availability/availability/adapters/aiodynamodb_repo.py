@@ -0,0 +1,248 @@
+import asyncio
+import logging
+
+from time import perf_counter
+from typing import AsyncIterator, Dict, List
+
+import aioboto3
+
+from aiobotocore.config import AioConfig
+from botocore.exceptions import ClientError
+
+from availability.domain.event import Event
+from availability.domain.model import Availability, Snapshot, UserAvailabilityAggregate
+from availability.domain.snapshot import SnapshotPolicy, NeverSnapshotPolicy
+from availability.ports.async_repo import AsyncEventStoreRepo, AsyncAvailabilityRepo
+from availability.ports.repo import AvailabilityChange, APPLIED, version_outcome
+from availability.utils import metrics
+from availability.utils.codec import event_from_item
+from availability.adapters.dynamodb_repo import (
+  BUCKET_FORMATS,
+  PageCursor,
+  append_conflict,
+  append_request,
+  availability_from_ddb_item,
+  availability_key,
+  availability_queries,
+  availability_to_ddb_item,
+  events_key_condition,
+  instrument_dynamodb,
+  project_request,
+  snapshot_from_ddb_item,
+  snapshot_request,
+  snapshot_too_large,
+  stamp_key,
+  stamp_request,
+  stored_version_request,
+)
+
+
+log = logging.getLogger(__name__)
+
+
+class AsyncDynamoResource:
+  """
+  One aioboto3 DynamoDB resource, and with it one pooled HTTP client, kept
+  open for the lifetime of the application so that concurrent requests
+  share up to max_pool_connections connections instead of each opening
+  their own. config_options, such as retries and tcp_keepalive, are passed
+  on to its AioConfig.
+
+  Credentials are resolved by the same default provider chain as the sync
+  session's, by the async session itself, since refreshable credentials of
+  a sync session cannot be refreshed from the event loop.
+  """
+  def __init__(self, region_name: str, max_pool_connections: int = 100, **config_options):
+    self.region_name = region_name
+    self.max_pool_connections = max_pool_connections
+    self.config_options = config_options
+    self._context = None
+    self._resource = None
+
+  async def open(self):
+    if self._resource is not None:
+      return
+    session = aioboto3.Session(region_name=self.region_name)
+    if metrics.REGISTRY.enabled:
+      instrument_dynamodb(session.events)
+    self._context = session.resource(
+      'dynamodb',
+      region_name=self.region_name,
+      config=AioConfig(max_pool_connections=self.max_pool_connections, **self.config_options)
+    )
+    self._resource = await self._context.__aenter__()
+
+  async def close(self):
+    if self._resource is None:
+      return
+    context, self._context, self._resource = self._context, None, None
+    await context.__aexit__(None, None, None)
+
+  async def table(self, name: str):
+    if self._resource is None:
+      raise RuntimeError("dynamodb resource is not open")
+    return await self._resource.Table(name)
+
+
+async def apaginate(request, page_size: int = None, limit: int = None, **request_kwargs) -> AsyncIterator[Dict]:
+  """
+  Asynchronous counterpart of paginate.
+  """
+  pages = PageCursor(page_size, limit, request_kwargs)
+  while not pages.done:
+    for item in pages.items(await request(**pages.request_kwargs)):
+      yield item
+
+
+class AsyncDynamoEventStoreRepo(AsyncEventStoreRepo):
+  def __init__(
+    self,
+    table,
+    snapshot_table=None,
+    snapshot_policy: SnapshotPolicy = None,
+    outbox_table=None,
+    outbox_segments: int = 16
+  ):
+    self.table = table
+    self.snapshot_table = snapshot_table
+    self.snapshot_policy = snapshot_policy or NeverSnapshotPolicy()
+    # appends write their outbox entries here, published by a relay through
+    # a DynamoOutboxRepo of the same table and segments
+    self.outbox_table = outbox_table
+    self.outbox_segments = outbox_segments
+
+  async def fetch(self, user_id) -> UserAvailabilityAggregate:
+    t0 = perf_counter()
+    snapshot = await self.fetch_snapshot(user_id)
+    events = await self.fetch_events(user_id, after_version=snapshot.version if snapshot else 0)
+    t1 = perf_counter()
+    aggregate = UserAvailabilityAggregate(user_id=user_id, events=events, snapshot=snapshot)
+
+    metrics.AGGREGATE_FETCH_SECONDS.observe(t1 - t0)
+    metrics.AGGREGATE_REPLAY_SECONDS.observe(perf_counter() - t1)
+    metrics.AGGREGATE_FETCH_EVENTS.observe(len(events))
+    return aggregate
+
+  async def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    key_cond = events_key_condition(user_id, after_version)
+    return [event_from_item(item) async for item in apaginate(self.table.query, KeyConditionExpression=key_cond)]
+
+  async def fetch_snapshot(self, user_id) -> Snapshot:
+    if self.snapshot_table is None:
+      return None
+
+    response = await self.snapshot_table.get_item(Key={"user_id": user_id})
+    if 'Item' not in response:
+      return None
+    return snapshot_from_ddb_item(response['Item'])
+
+  async def save_snapshot(self, aggregate: UserAvailabilityAggregate):
+    if self.snapshot_table is None or not self.snapshot_policy.should_snapshot(aggregate):
+      return
+
+    snapshot = aggregate.snapshot()
+    request = snapshot_request(snapshot)
+    if request is None:
+      snapshot_too_large(snapshot)
+      aggregate.snapshot_version = snapshot.version
+      return
+
+    try:
+      await self.snapshot_table.put_item(**request)
+    except ClientError as e:
+      if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+        raise
+      log.debug("newer snapshot exists for user_id=%s, skipping version %s", aggregate.user_id, snapshot.version)
+    aggregate.snapshot_version = snapshot.version
+
+  async def append(self, events: List[Event]):
+    if not events:
+      return
+
+    if self.outbox_table is None:
+      operation, request = append_request(self.table.name, events)
+    else:
+      operation, request = append_request(self.table.name, events, self.outbox_table.name, self.outbox_segments)
+    try:
+      await getattr(self.table.meta.client, operation)(**request)
+    except ClientError as e:
+      conflict = append_conflict(events, e)
+      if conflict is None:
+        raise
+      raise conflict from e
+
+
+class AsyncDynamoAvailabilityRepo(AsyncAvailabilityRepo):
+  """
+  Asynchronous counterpart of DynamoAvailabilityRepo for the api, queries of
+  all users fetch up to max_concurrency time buckets at once.
+  """
+  def __init__(
+    self,
+    table,
+    page_size: int = None,
+    bucket_granularity: str = "day",
+    max_concurrency: int = 8,
+    tombstone_ttl: int = 7 * 24 * 60 * 60
+  ):
+    if bucket_granularity not in BUCKET_FORMATS:
+      raise ValueError(f"unsupported bucket granularity {bucket_granularity}")
+    self.table = table
+    self.page_size = page_size
+    self.bucket_granularity = bucket_granularity
+    self.max_concurrency = max_concurrency
+    self.tombstone_ttl = tombstone_ttl
+
+  async def fetch(self, start, end=None, user_id=None, page_size: int = None, limit: int = None) -> List[Availability]:
+    queries = availability_queries(start, end, user_id, self.bucket_granularity)
+    page_kwargs = {"page_size": page_size or self.page_size, "limit": limit}
+
+    if user_id:
+      items = [item async for item in apaginate(self.table.query, **queries[0], **page_kwargs)]
+    else:
+      items = await self._query_buckets(queries, page_kwargs, limit)
+
+    return [availability_from_ddb_item(item) for item in items[:limit]]
+
+  async def _query_buckets(self, queries: List[Dict], page_kwargs: Dict, limit: int = None) -> List[Dict]:
+    async def query_bucket(query):
+      return [item async for item in apaginate(self.table.query, **query, **page_kwargs)]
+
+    items = []
+    for i in range(0, len(queries), self.max_concurrency):
+      for bucket_items in await asyncio.gather(*(query_bucket(q) for q in queries[i:i + self.max_concurrency])):
+        items.extend(bucket_items)
+      if limit and len(items) >= limit:
+        break
+    return items
+
+  async def create(self, availability: Availability):
+    await self.table.put_item(Item=availability_to_ddb_item(availability, self.bucket_granularity))
+
+  async def update(self, availability: Availability):
+    await self.create(availability)
+
+  async def delete(self, availability: Availability):
+    await self.table.delete_item(Key=availability_key(availability))
+
+  async def project(self, change: AvailabilityChange) -> str:
+    request = project_request(change, self.bucket_granularity, self.tombstone_ttl)
+    try:
+      await self.table.put_item(**request)
+      return APPLIED
+    except ClientError as e:
+      if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+        raise
+    response = await self.table.get_item(**stored_version_request(request["Item"]))
+    return version_outcome(change.version, response.get("Item", {}).get("version"))
+
+  async def stamp(self, user_id: str, version: int):
+    try:
+      await self.table.put_item(**stamp_request(user_id, version))
+    except ClientError as e:
+      if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+        raise
+
+  async def fetch_stamp(self, user_id: str) -> int:
+    item = (await self.table.get_item(Key=stamp_key(user_id), ConsistentRead=True)).get("Item")
+    return int(item["version"]) if item else None
@@ -0,0 +1,114 @@
+"""
+Consumer of the appointments channel, on which the appointments bounded
+context publishes bookings and cancellations of walkers' availability.
+
+Records are read with the shard workers of shard_consumer, checkpointed
+only after the commands of the records read are committed. A crash replays
+the records since the last checkpoint, whose commands are then skipped as
+already reflected by the walker's availability. Producers partition records
+by walker id so each walker's records are read in the order published.
+
+Records that cannot be decoded into a command are logged and skipped, as
+reading them again would only fail again and hold back the whole shard.
+"""
+
+import json
+import logging
+import platform
+import multiprocessing
+
+from typing import Dict, List
+
+from availability.config import AppContext, configure
+from availability.domain import AddAppointmentCommand, Command, RemoveAppointmentCommand
+from availability.service import AppointmentBatchHandler
+from availability.utils import from_isodatetime, metrics
+
+from availability.adapters.shard_consumer import ShardWorker, run_supervisor
+
+
+log = logging.getLogger(__name__)
+
+APPOINTMENT_BOOKED = "AppointmentBookedEvent"
+APPOINTMENT_CANCELLED = "AppointmentCancelledEvent"
+
+# outcome counted for records that are not a valid appointment event
+APPOINTMENT_MALFORMED = "malformed"
+
+
+def appointment_message_to_command(message: Dict) -> Command:
+  """
+  Command for a record of the appointments channel whose data is of the form
+
+  {"event_type": "AppointmentBookedEvent", "event_id": "5c0ffd1e-...",
+   "walker_id": "abc123", "available_at": "2022-12-13T18:00:00",
+   "appointment_id": "a1b2c3"}
+
+  or None for event types the availability context does not act on.
+  """
+  data = json.loads(message["Data"])
+  if not isinstance(data, dict):
+    raise ValueError(f"appointments record is not an object: {data!r}")
+  event_type = data.get("event_type")
+  if event_type not in (APPOINTMENT_BOOKED, APPOINTMENT_CANCELLED):
+    return None
+
+  fields = {
+    "correlation_id": data["event_id"],
+    "user_id": data["walker_id"],
+    "available_at": from_isodatetime(data["available_at"]),
+    "appointment_id": data["appointment_id"],
+  }
+  if event_type == APPOINTMENT_BOOKED:
+    return AddAppointmentCommand(**fields)
+  return RemoveAppointmentCommand(**fields)
+
+
+class AppointmentShardWorker(ShardWorker):
+  stream_setting = "appointments_channel"
+
+  def __init__(self, ctx: AppContext, worker_index: int, worker_count: int):
+    super().__init__(ctx, worker_index, worker_count)
+    self.handler = AppointmentBatchHandler(
+      ctx.event_store_repo,
+      aggregate_cache=ctx.aggregate_cache,
+      retries=ctx.command_retries,
+      projector=ctx.commit_projector
+    )
+
+  def process_records(self, records: List[Dict]):
+    commands = []
+    malformed = 0
+    for record in records:
+      try:
+        cmd = appointment_message_to_command(record)
+      except (ValueError, KeyError, TypeError):
+        log.exception(f"skipping malformed appointments record {record['SequenceNumber']}: {record['Data']!r}")
+        malformed += 1
+        continue
+      if cmd is None:
+        log.debug("ignoring appointments record %s", record["SequenceNumber"])
+      else:
+        commands.append(cmd)
+
+    if commands:
+      counts = self.handler.handle_batch(commands)
+      log.debug("handled %d appointment commands %s", len(commands), counts)
+    if malformed:
+      metrics.APPOINTMENT_COMMANDS.inc(malformed, APPOINTMENT_MALFORMED)
+
+
+def process_appointment_events(ctx: AppContext):
+  log.info('initiating appointment event processing')
+  ctx.start_metrics()
+  run_supervisor(ctx, AppointmentShardWorker, worker_count=ctx.appointment_workers)
+
+
+if __name__ == '__main__':
+  ctx = configure()
+
+  # work around required due to Mac OS process management issue, see event_processor
+  if platform.system() == 'Darwin':
+    multiprocessing.set_start_method("fork")
+
+  process_appointment_events(ctx)
@@ -0,0 +1,132 @@
+"""
+Decoding of DynamoDB change data capture records from the availability event
+store, as delivered through Kinesis, into Events.
+
+The JSON backend is pluggable: orjson or msgspec are used when installed and
+the standard library json module otherwise. DynamoDB typed attributes
+({"S": ...}, {"N": ...}, {"M": ...}) are unmarshalled by a function generated
+once per schema instead of walking the nested dicts generically.
+"""
+
+import json
+
+from datetime import datetime
+from functools import lru_cache
+from time import time
+from typing import Callable, Dict, List, Union
+
+from availability.domain import Event
+from availability.utils import metrics
+from availability.utils.codec import (
+  EVENT_SCHEMA,
+  DATETIME,
+  NUMBER,
+  OPTIONAL_STRING,
+  SLOT_DATETIME,
+  STRING,
+)
+
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+try:
+  import msgspec
+except ImportError:
+  msgspec = None
+
+
+# availability slots repeat across many events so their parsed values are
+# shared, datetimes are immutable which makes that safe
+parse_slot_datetime = lru_cache(maxsize=4096)(datetime.fromisoformat)
+
+
+def _loaders() -> Dict[str, Callable[[bytes], object]]:
+  loaders = {"json": json.loads}
+  if orjson is not None:
+    loaders["orjson"] = orjson.loads
+  if msgspec is not None:
+    loaders["msgspec"] = msgspec.json.Decoder().decode
+  return loaders
+
+
+LOADERS = _loaders()
+
+
+def compile_unmarshaller(schema: Dict[str, Union[str, Dict]]) -> Callable[[Dict], Dict]:
+  """
+  Generates a function converting a DynamoDB typed attribute map matching
+  schema into plain python values, e.g. {"version": {"N": "1"}} into
+  {"version": 1}.
+  """
+  lines = ["def unmarshal(image):"]
+  counter = [0]
+
+  def expression(source: str, attr_type) -> str:
+    if isinstance(attr_type, dict):
+      counter[0] += 1
+      name = f"m{counter[0]}"
+      lines.append(f"  {name} = {source}['M']")
+      fields = ", ".join(f"{key!r}: {expression(f'{name}[{key!r}]', t)}" for key, t in attr_type.items())
+      return "{" + fields + "}"
+    if attr_type == STRING:
+      return f"{source}['S']"
+    if attr_type == OPTIONAL_STRING:
+      return f"{source}.get('S')"
+    if attr_type == NUMBER:
+      return f"int({source}['N'])"
+    if attr_type == DATETIME:
+      return f"fromisoformat({source}['S'])"
+    if attr_type == SLOT_DATETIME:
+      return f"parse_slot_datetime({source}['S'])"
+    raise ValueError(f"unsupported attribute type {attr_type}")
+
+  fields = ", ".join(f"{key!r}: {expression(f'image[{key!r}]', t)}" for key, t in schema.items())
+  lines.append(f"  return {{{fields}}}")
+
+  namespace = {"fromisoformat": datetime.fromisoformat, "parse_slot_datetime": parse_slot_datetime}
+  exec("\n".join(lines), namespace)
+  return namespace["unmarshal"]
+
+
+class CdcCodec:
+  def __init__(self, backend: str = "auto", schema: Dict = EVENT_SCHEMA):
+    if backend == "auto":
+      backend = next(name for name in ("orjson", "msgspec", "json") if name in LOADERS)
+    if backend not in LOADERS:
+      raise ValueError(f"cdc decoder backend {backend} is not installed, available: {sorted(LOADERS)}")
+
+    self.backend = backend
+    self._loads = LOADERS[backend]
+    self._unmarshal = compile_unmarshaller(schema)
+
+  def decode(self, message: Dict) -> Event:
+    envelope = self._loads(message['Data'])
+    return Event(**self._unmarshal(envelope['dynamodb']['NewImage']))
+
+  def decode_batch(self, messages: List[Dict]) -> List[Event]:
+    """
+    Decodes the records of one GetRecords response, looking the backend and
+    unmarshaller up once per batch rather than once per record.
+    """
+    # joining the records into one JSON array to parse them in a single call
+    # measured slower than parsing each, the copy outweighs the call overhead
+    loads = self._loads
+    unmarshal = self._unmarshal
+    return [Event(**unmarshal(loads(message['Data'])['dynamodb']['NewImage'])) for message in messages]
+
+
+def observe_projection_lag(messages: List[Dict]):
+  """
+  Records the time from each message's arrival in the stream until now,
+  to be called once the messages' events have been projected.
+  """
+  if not metrics.REGISTRY.enabled:
+    return
+  now = time()
+  for message in messages:
+    arrival = message.get('ApproximateArrivalTimestamp')
+    if arrival is not None:
+      metrics.PROJECTION_LAG_SECONDS.observe(now - arrival.timestamp())
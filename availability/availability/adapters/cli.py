@@ -6,9 +6,14 @@ Examples:
   python -m availability.adapters.cli seed
 
   python -m availability.adapters.cli show-aggregate --user-id abc123
+
+  python -m availability.adapters.cli rebuild-read-model --segments 16 --checkpoint-file rebuild.json
+
+  python -m availability.adapters.cli relay-outbox --relay-segments 0,1,2,3
 """
 
 import json
+import logging
 
 from argparse import ArgumentParser
 from datetime import datetime, timedelta
@@ -22,12 +27,9 @@ from availability.domain import (
   RemoveAppointmentCommand,
   UserAvailabilityAggregate
 )
-from availability.service import AvailabilityCommandHandler
+from availability.service import AvailabilityCommandHandler, OutboxRelay, ReadModelRebuilder, RebuildCheckpoint
 from availability.utils import to_isodatetime, from_isodatetime
 
-from availability.adapters.event_processor import process_availability_events
-from availability.adapters.restapi import app
-
 
 def seed(ctx: AppContext):
   user_id1, user_id2 = "abc456", "qrs789"
@@ -38,11 +40,13 @@ def seed(ctx: AppContext):
 
   handler1 = AvailabilityCommandHandler(
     user_id=user_id1,
-    events_repo=ctx.event_store_repo
+    events_repo=ctx.event_store_repo,
+    projector=ctx.commit_projector
   )
   handler2 = AvailabilityCommandHandler(
     user_id=user_id2,
-    events_repo=ctx.event_store_repo
+    events_repo=ctx.event_store_repo,
+    projector=ctx.commit_projector
   )
 
   for i in range(1, max(user_n1, user_n2)):
@@ -72,7 +76,8 @@ def print_aggregate(aggregate: UserAvailabilityAggregate):
 def show_aggregate(ctx: AppContext, user_id: str):
   handler = AvailabilityCommandHandler(
     user_id=user_id,
-    events_repo=ctx.event_store_repo
+    events_repo=ctx.event_store_repo,
+    projector=ctx.commit_projector
   )
   print_aggregate(handler.aggregate)
 
@@ -80,7 +85,8 @@ def show_aggregate(ctx: AppContext, user_id: str):
 def delete_availability(ctx: AppContext, user_id: str, available_at: str):
   handler = AvailabilityCommandHandler(
     user_id=user_id,
-    events_repo=ctx.event_store_repo
+    events_repo=ctx.event_store_repo,
+    projector=ctx.commit_projector
   )
   with handler:
     handler.delete_availability(DeleteAvailabilityCommand(
@@ -94,7 +100,8 @@ def delete_availability(ctx: AppContext, user_id: str, available_at: str):
 def add_appointment(ctx: AppContext, user_id: str, available_at: str, appointment_id: str):
   handler = AvailabilityCommandHandler(
     user_id=user_id,
-    events_repo=ctx.event_store_repo
+    events_repo=ctx.event_store_repo,
+    projector=ctx.commit_projector
   )
   with handler:
     handler.add_appointment(AddAppointmentCommand(
@@ -106,6 +113,39 @@ def add_appointment(ctx: AppContext, user_id: str, available_at: str, appointmen
     print_aggregate(handler.aggregate)
 
 
+def rebuild_read_model(ctx: AppContext, segments: int, workers: int, checkpoint_file: str, page_size: int):
+  logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+  rebuilder = ReadModelRebuilder(
+    events_repo=ctx.event_store_repo,
+    availability_repo=ctx.availability_repo,
+    segments=segments,
+    workers=workers,
+    checkpoint=RebuildCheckpoint(checkpoint_file, segments),
+    page_size=page_size
+  )
+  print(json.dumps(rebuilder.run(), indent=2))
+
+
+def relay_outbox(ctx: AppContext, segments: str):
+  logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+  if not ctx.outbox_enabled:
+    raise SystemExit("the outbox is disabled, set outbox_enabled")
+  ctx.start_metrics()
+  relay = OutboxRelay(
+    ctx.outbox_repo,
+    ctx.aws_client("kinesis"),
+    ctx.availability_channel,
+    segments=[int(segment) for segment in segments.split(",")] if segments else None,
+    batch_size=ctx.outbox_batch_size
+  )
+  try:
+    relay.run()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    ctx.stop_metrics()
+
+
 if __name__ == '__main__':
   parser = ArgumentParser(
     "python -m availability.adapters.cli",
@@ -119,6 +159,8 @@ if __name__ == '__main__':
   REMOVE_APPOINTMENT = 'remove-appointment'
   SHOW_AGGREGATE = 'show-aggregate'
   PROCESS_AVAILABILITY_EVENTS = 'process-availability-events'
+  REBUILD_READ_MODEL = 'rebuild-read-model'
+  RELAY_OUTBOX = 'relay-outbox'
 
   parser.add_argument('op', choices=[
     SEED,
@@ -127,11 +169,18 @@ if __name__ == '__main__':
     ADD_APPOINTMENT,
     REMOVE_APPOINTMENT,
     SHOW_AGGREGATE,
+    REBUILD_READ_MODEL,
+    RELAY_OUTBOX,
   ])
 
   parser.add_argument('--user-id')
   parser.add_argument('--available-at')
   parser.add_argument('--appointment-id')
+  parser.add_argument('--segments', type=int, default=8, help="number of parallel scan segments of the event store")
+  parser.add_argument('--workers', type=int, help="number of segments scanned concurrently, defaults to --segments")
+  parser.add_argument('--checkpoint-file', help="local file recording rebuild progress so an interrupted rebuild can resume")
+  parser.add_argument('--page-size', type=int, help="number of items requested per scan page")
+  parser.add_argument('--relay-segments', help="comma separated outbox segments this relay publishes, defaults to all")
 
   args = parser.parse_args()
 
@@ -145,3 +194,7 @@ if __name__ == '__main__':
     delete_availability(ctx, args.user_id, args.available_at)
   elif args.op == ADD_APPOINTMENT:
     add_appointment(ctx, args.user_id, args.available_at, args.appointment_id)
+  elif args.op == REBUILD_READ_MODEL:
+    rebuild_read_model(ctx, args.segments, args.workers, args.checkpoint_file, args.page_size)
+  elif args.op == RELAY_OUTBOX:
+    relay_outbox(ctx, args.relay_segments)
@@ -1,35 +1,241 @@
+import logging
+import random
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
+from time import perf_counter, sleep, time
+from typing import Dict, Iterator, List, Tuple
 
-from dataclasses import asdict
-from typing import Dict, List
-
-from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
 
 from availability.domain.event import Event
-from availability.domain.model import Availability, UserAvailabilityAggregate
-from availability.ports.repo import EventStoreRepo, AvailabilityRepo
+from availability.domain.exception import ConcurrencyException
+from availability.domain.model import Availability, Snapshot, UserAvailabilityAggregate
+from availability.domain.snapshot import SnapshotPolicy, NeverSnapshotPolicy
+from availability.ports.repo import (
+  EventStoreRepo,
+  AvailabilityRepo,
+  AvailabilityChange,
+  APPLIED,
+  MAX_APPEND_EVENTS,
+  version_outcome,
+)
+from availability.utils import metrics
+from availability.ports.outbox import OutboxEntry, OutboxRepo, outbox_segment
+from availability.utils.codec import availability_to_item, event_to_item, event_from_item, to_json
 from availability.utils.common import to_isodatetime, from_isodatetime
 
 
-def event_from_ddb_item(item: Dict) -> Event:
-  event_data = {}
-  for k, v in item.items():
-    if k == 'version':
-      event_data[k] = int(v)
-    elif k == "event_payload":
-      event_data[k] = {
-        "user_id": v["user_id"],
-        "available_at": from_isodatetime(v["available_at"]),
-        "appointment_id": v["appointment_id"]
-      }
+log = logging.getLogger(__name__)
+
+CONFLICT_REASONS = {"ConditionalCheckFailed", "TransactionConflict"}
+
+THROTTLE_CODES = {"ProvisionedThroughputExceededException", "ThrottlingException", "RequestLimitExceeded"}
+
+# upper bound on the number of requests a single BatchWriteItem call accepts
+MAX_BATCH_WRITE_ITEMS = 25
+
+# upper bound on the number of keys a single BatchGetItem call accepts
+MAX_BATCH_GET_ITEMS = 100
+
+# upper bound on the number of items a single TransactWriteItems call accepts
+MAX_TRANSACT_ITEMS = 100
+
+# global secondary index of the read model partitioned by time bucket so
+# availability of all users within a time range can be queried without a scan
+TIME_BUCKET_INDEX = "time-bucket-index"
+
+BUCKET_FORMATS = {"day": "%Y-%m-%d", "hour": "%Y-%m-%dT%H"}
+
+# DynamoDB items are limited to 400KB, snapshots whose item is estimated
+# above this size, from its JSON encoding, are not saved and the aggregate
+# is replayed from its events instead
+MAX_SNAPSHOT_ITEM_BYTES = 350 * 1024
+
+# sort key of the item in each user's read model partition holding the
+# version stamp of their rows, it sorts before any ISO 8601 slot time and
+# has no time_bucket so queries of slots never return it
+STAMP_SORT_KEY = "#stamp"
+
+
+def instrument_dynamodb(events):
+  """
+  Registers handlers on a boto3 session's event emitter, before its
+  clients are created, so DynamoDB requests report their consumed capacity
+  and throttled attempts are counted in the metrics registry. Registering
+  on the same emitter again has no effect.
+  """
+  events.register("provide-client-params.dynamodb", request_consumed_capacity, unique_id="availability-request-capacity")
+  events.register("after-call.dynamodb", record_consumed_capacity, unique_id="availability-record-capacity")
+  events.register("needs-retry.dynamodb", record_throttle, unique_id="availability-record-throttle")
+
+
+def request_consumed_capacity(params, model, **kwargs):
+  if "ReturnConsumedCapacity" in model.input_shape.members and "ReturnConsumedCapacity" not in params:
+    params["ReturnConsumedCapacity"] = "TOTAL"
+
+
+def record_consumed_capacity(parsed, model, **kwargs):
+  consumed = parsed.get("ConsumedCapacity")
+  if not consumed:
+    return
+  for capacity in consumed if isinstance(consumed, list) else [consumed]:
+    metrics.DYNAMODB_CONSUMED_CAPACITY.inc(capacity.get("CapacityUnits", 0), model.name, capacity.get("TableName", ""))
+
+
+def record_throttle(response, operation, **kwargs):
+  # returns None so botocore's own retry handler still decides on retrying
+  if response is not None and response[1].get("Error", {}).get("Code") in THROTTLE_CODES:
+    metrics.DYNAMODB_THROTTLES.inc(1, operation.name)
+
+
+def time_bucket(available_at: datetime, granularity: str = "day") -> str:
+  return available_at.strftime(BUCKET_FORMATS[granularity])
+
+
+def time_buckets(start: datetime, end: datetime, granularity: str = "day") -> List[str]:
+  """
+  Lists the buckets overlapping [start, end) in ascending time order.
+  """
+  if granularity == "day":
+    bucket_start, step = datetime(start.year, start.month, start.day), timedelta(days=1)
+  else:
+    bucket_start, step = datetime(start.year, start.month, start.day, start.hour), timedelta(hours=1)
+
+  buckets = []
+  while bucket_start < end:
+    buckets.append(time_bucket(bucket_start, granularity))
+    bucket_start += step
+  return buckets
+
+
+def query_items(table, page_size: int = None, limit: int = None, **query_kwargs) -> Iterator[Dict]:
+  return paginate(table.query, page_size=page_size, limit=limit, **query_kwargs)
+
+
+def scan_items(table, page_size: int = None, limit: int = None, **scan_kwargs) -> Iterator[Dict]:
+  return paginate(table.scan, page_size=page_size, limit=limit, **scan_kwargs)
+
+
+def paginate(request, page_size: int = None, limit: int = None, **request_kwargs) -> Iterator[Dict]:
+  """
+  Lazily yields the items of a query or scan page by page, following
+  LastEvaluatedKey with ExclusiveStartKey, so at most one page is held
+  in memory at a time. Stops after limit items when given.
+
+  DynamoDB applies Limit to the items a page evaluates, before any
+  FilterExpression, so only page_size sets it and pages are requested
+  until limit items have passed the filter.
+  """
+  pages = PageCursor(page_size, limit, request_kwargs)
+  while not pages.done:
+    yield from pages.items(request(**pages.request_kwargs))
+
+
+class PageCursor:
+  """
+  Position of a paginated query or scan, shared by paginate and apaginate:
+  the arguments of the next page's request and whether any page is left.
+  """
+  def __init__(self, page_size: int = None, limit: int = None, request_kwargs: Dict = None):
+    self.request_kwargs = dict(request_kwargs or {})
+    if page_size:
+      self.request_kwargs["Limit"] = page_size
+    self.limit = limit
+    self.yielded = 0
+    self.done = False
+
+  def items(self, response: Dict) -> List[Dict]:
+    """
+    Items of a page's response up to the limit, advancing past the page.
+    """
+    items = response['Items']
+    if self.limit is not None:
+      items = items[:self.limit - self.yielded]
+    self.yielded += len(items)
+
+    if self.yielded == self.limit or 'LastEvaluatedKey' not in response:
+      self.done = True
+    else:
+      self.request_kwargs["ExclusiveStartKey"] = response['LastEvaluatedKey']
+    return items
+
+
+def batch_write(table, requests: List[Dict], max_attempts: int = 8, base_delay: float = 0.05):
+  """
+  Sends PutRequest/DeleteRequest write requests with BatchWriteItem in
+  chunks of 25, resending unprocessed items with jittered exponential
+  backoff until they are written or max_attempts is exhausted.
+  """
+  client = table.meta.client
+  for i in range(0, len(requests), MAX_BATCH_WRITE_ITEMS):
+    pending = {table.name: requests[i:i + MAX_BATCH_WRITE_ITEMS]}
+    for attempt in range(max_attempts):
+      response = client.batch_write_item(RequestItems=pending)
+      pending = response.get("UnprocessedItems")
+      if not pending:
+        break
+      sleep(random.uniform(0, base_delay * 2 ** attempt))
+    else:
+      unprocessed = len(pending.get(table.name, []))
+      raise RuntimeError(f"{unprocessed} items of {table.name} remained unprocessed after {max_attempts} attempts")
+
+
+def batch_get(table, keys: List[Dict], max_attempts: int = 8, base_delay: float = 0.05, **request_kwargs) -> Iterator[Dict]:
+  """
+  Yields the items found for keys with BatchGetItem in chunks of 100,
+  retrying unprocessed keys with jittered exponential backoff.
+  """
+  client = table.meta.client
+  for i in range(0, len(keys), MAX_BATCH_GET_ITEMS):
+    pending = {table.name: {"Keys": keys[i:i + MAX_BATCH_GET_ITEMS], **request_kwargs}}
+    for attempt in range(max_attempts):
+      response = client.batch_get_item(RequestItems=pending)
+      yield from response["Responses"].get(table.name, [])
+      pending = response.get("UnprocessedKeys")
+      if not pending:
+        break
+      sleep(random.uniform(0, base_delay * 2 ** attempt))
     else:
-      event_data[k] = v
-  return Event(**event_data)
+      unprocessed = len(pending[table.name]["Keys"])
+      raise RuntimeError(f"{unprocessed} keys of {table.name} remained unprocessed after {max_attempts} attempts")
+
+
+def snapshot_to_ddb_item(snapshot: Snapshot) -> Dict:
+  return {
+    "user_id": snapshot.user_id,
+    "version": snapshot.version,
+    "start": to_isodatetime(snapshot.start) if snapshot.start else None,
+    "availability": [
+      {"available_at": to_isodatetime(a.available_at), "appointment_id": a.appointment_id}
+      for a in snapshot.availability
+    ]
+  }
+
 
+def snapshot_from_ddb_item(item: Dict) -> Snapshot:
+  user_id = item["user_id"]
+  return Snapshot(
+    user_id=user_id,
+    version=int(item["version"]),
+    start=from_isodatetime(item["start"]) if item.get("start") else None,
+    availability=[
+      Availability(
+        user_id=user_id,
+        available_at=from_isodatetime(a["available_at"]),
+        appointment_id=a["appointment_id"]
+      )
+      for a in item["availability"]
+    ]
+  )
 
-def availability_to_ddb_item(availability: Availability) -> Dict:
-  data = asdict(availability)
-  return to_isodatetime(data)
+
+def availability_to_ddb_item(availability: Availability, granularity: str = "day") -> Dict:
+  item = availability_to_item(availability)
+  item["time_bucket"] = time_bucket(availability.available_at, granularity)
+  return item
 
 
 def availability_from_ddb_item(item: Dict) -> Availability:
@@ -40,73 +246,496 @@ def availability_from_ddb_item(item: Dict) -> Availability:
   )
 
 
+def availability_conditions(start: datetime, end: datetime = None):
+  """
+  Key condition on available_at and filter for read model queries of
+  [start, end), excluding tombstones.
+  """
+  filter_expr = Attr('deleted').not_exists()
+  if end:
+    key_cond = Key('available_at').between(to_isodatetime(start), to_isodatetime(end))
+    # between is inclusive but end is exclusive
+    filter_expr = filter_expr & Attr('available_at').lt(to_isodatetime(end))
+  else:
+    key_cond = Key('available_at').gte(to_isodatetime(start))
+  return key_cond, filter_expr
+
+
+def availability_queries(start: datetime, end: datetime = None, user_id: str = None, granularity: str = "day") -> List[Dict]:
+  """
+  Query arguments for the availability of [start, end): one query of the
+  user's partition, or across users one query of the time bucket index per
+  bucket in time order.
+  """
+  key_cond, filter_expr = availability_conditions(start, end)
+  if user_id:
+    return [{"KeyConditionExpression": Key('user_id').eq(user_id) & key_cond, "FilterExpression": filter_expr}]
+  if not end:
+    raise ValueError("fetching availability of all users requires an end")
+
+  return [
+    {
+      "IndexName": TIME_BUCKET_INDEX,
+      "KeyConditionExpression": Key('time_bucket').eq(bucket) & key_cond,
+      "FilterExpression": filter_expr,
+    }
+    for bucket in time_buckets(start, end, granularity)
+  ]
+
+
+def availability_key(availability: Availability) -> Dict:
+  return {"user_id": availability.user_id, "available_at": to_isodatetime(availability.available_at)}
+
+
+def outbox_entry_id(user_id: str, version: int) -> str:
+  # versions are zero padded so a user's entries sort in version order
+  return f"{user_id}#{version:010d}"
+
+
+def outbox_entry_to_ddb_item(entry: OutboxEntry, segments: int) -> Dict:
+  return {
+    "segment": outbox_segment(entry.user_id, segments),
+    "entry_id": outbox_entry_id(entry.user_id, entry.version),
+    "user_id": entry.user_id,
+    "version": entry.version,
+    "created": entry.created.isoformat(),
+    "events": [event_to_item(event) for event in entry.events],
+  }
+
+
+def outbox_entry_from_ddb_item(item: Dict) -> OutboxEntry:
+  return OutboxEntry(
+    user_id=item["user_id"],
+    version=int(item["version"]),
+    created=from_isodatetime(item["created"]),
+    events=[event_from_item(event) for event in item["events"]]
+  )
+
+
+def events_key_condition(user_id: str, after_version: int = 0):
+  key_cond = Key("user_id").eq(user_id)
+  if after_version:
+    key_cond = key_cond & Key("version").gt(after_version)
+  return key_cond
+
+
+def snapshot_request(snapshot: Snapshot) -> Dict:
+  """
+  put_item arguments saving a snapshot unless a newer one was saved, so a
+  slow writer never replaces a newer snapshot with an older one. None when
+  the item would exceed MAX_SNAPSHOT_ITEM_BYTES.
+  """
+  item = snapshot_to_ddb_item(snapshot)
+  if len(to_json(item).encode("utf-8")) > MAX_SNAPSHOT_ITEM_BYTES:
+    return None
+  return {"Item": item, "ConditionExpression": newer_version_condition(snapshot.version)}
+
+
+def snapshot_too_large(snapshot: Snapshot):
+  metrics.SNAPSHOTS_TOO_LARGE.inc()
+  log.warning(
+    "snapshot of user_id=%s version %s with %d slots exceeds %d bytes, not saved",
+    snapshot.user_id, snapshot.version, len(snapshot.availability), MAX_SNAPSHOT_ITEM_BYTES
+  )
+
+
+def append_request(
+  table_name: str,
+  events: List[Event],
+  outbox_table_name: str = None,
+  outbox_segments: int = 16
+) -> Tuple[str, Dict]:
+  """
+  Name and arguments of the client operation atomically appending events,
+  with the commit's outbox entry when an outbox table is given.
+  """
+  if len(events) > MAX_APPEND_EVENTS:
+    raise ValueError(f"cannot append {len(events)} events atomically, the limit is {MAX_APPEND_EVENTS}")
+
+  items = [event_to_item(event) for event in events]
+  if outbox_table_name is None:
+    if len(items) == 1:
+      # a conditional put is half the write cost of a single item transaction
+      return "put_item", {"TableName": table_name, "Item": items[0], "ConditionExpression": "attribute_not_exists(version)"}
+    return "transact_write_items", {"TransactItems": append_transact_items(table_name, items)}
+
+  outbox_item = outbox_entry_to_ddb_item(OutboxEntry.of_commit(events), outbox_segments)
+  return "transact_write_items", {"TransactItems": append_transact_items(table_name, items, outbox_table_name, outbox_item)}
+
+
+def append_conflict(events: List[Event], error: ClientError) -> ConcurrencyException:
+  """
+  ConcurrencyException to raise from an append's error, None unless the
+  error is a conflict with another writer.
+  """
+  if not is_conflict(error):
+    return None
+  return ConcurrencyException(
+    f"versions {events[0].version}-{events[-1].version} for user {events[0].user_id} were written concurrently"
+  )
+
+
+def append_transact_items(table_name: str, items: List[Dict], outbox_table_name: str = None, outbox_item: Dict = None) -> List[Dict]:
+  """
+  TransactWriteItems requests appending the event items, each conditional
+  on its version not having been written, and the commit's outbox entry.
+  """
+  transact_items = [
+    {
+      "Put": {
+        "TableName": table_name,
+        "Item": item,
+        "ConditionExpression": "attribute_not_exists(version)"
+      }
+    }
+    for item in items
+  ]
+  if outbox_item is not None:
+    transact_items.append({"Put": {"TableName": outbox_table_name, "Item": outbox_item}})
+  return transact_items
+
+
+class DynamoOutboxRepo(OutboxRepo):
+  """
+  Outbox table partitioned by segment and sorted by entry_id, the user id
+  and zero padded version of an entry.
+  """
+  def __init__(self, table, segments: int = 16):
+    self.table = table
+    self.segments = segments
+
+  def fetch_pending(self, segment: int, limit: int, after=None) -> List[OutboxEntry]:
+    query_kwargs = {"KeyConditionExpression": Key("segment").eq(segment)}
+    if after:
+      query_kwargs["ExclusiveStartKey"] = {"segment": segment, "entry_id": outbox_entry_id(*after)}
+
+    return [outbox_entry_from_ddb_item(item) for item in query_items(self.table, limit=limit, **query_kwargs)]
+
+  def delete(self, entries: List[OutboxEntry]):
+    batch_write(self.table, [
+      {
+        "DeleteRequest": {
+          "Key": {
+            "segment": outbox_segment(entry.user_id, self.segments),
+            "entry_id": outbox_entry_id(entry.user_id, entry.version),
+          }
+        }
+      }
+      for entry in entries
+    ])
+
+
 class DynamoEventStoreRepo(EventStoreRepo):
-  def __init__(self, table):
+  def __init__(self, table, snapshot_table=None, snapshot_policy: SnapshotPolicy = None, outbox: DynamoOutboxRepo = None):
     self.table = table
+    self.snapshot_table = snapshot_table
+    self.snapshot_policy = snapshot_policy or NeverSnapshotPolicy()
+    self.outbox = outbox
 
   def fetch(self, user_id) -> UserAvailabilityAggregate:
-    response = self.table.query(KeyConditionExpression=Key("user_id").eq(user_id))
+    t0 = perf_counter()
+    snapshot = self.fetch_snapshot(user_id)
+    t1 = perf_counter()
+    events = self.fetch_events(user_id, after_version=snapshot.version if snapshot else 0)
+    t2 = perf_counter()
+    aggregate = UserAvailabilityAggregate(user_id=user_id, events=events, snapshot=snapshot)
+    t3 = perf_counter()
 
-    events = []
-    for item in response['Items']:
-      events.append(event_from_ddb_item(item))
+    metrics.AGGREGATE_FETCH_SECONDS.observe(t2 - t0)
+    metrics.AGGREGATE_REPLAY_SECONDS.observe(t3 - t2)
+    metrics.AGGREGATE_FETCH_EVENTS.observe(len(events))
+    log.debug(
+      "fetched aggregate user_id=%s snapshot_version=%s snapshot_ms=%.2f events=%d query_ms=%.2f replay_ms=%.2f",
+      user_id, aggregate.snapshot_version, (t1 - t0) * 1000, len(events), (t2 - t1) * 1000, (t3 - t2) * 1000
+    )
+    return aggregate
 
-    while 'LastEvaluatedKey' in response:
-      last_key = response['LastEvaluatedKey']
-      key_cond = (
-        Key("user_id").eq(last_key['user_id']) &
-        Key('version').gt(last_key['version'])
-      )
-      response = self.table.query(KeyConditionExpression=key_cond)
-      for item in response['Items']:
-        events.append(event_from_ddb_item(item))
+  def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    return list(self.iter_events(user_id, after_version=after_version))
 
-    return UserAvailabilityAggregate(user_id=user_id, events=events)
+  def iter_events(self, user_id, after_version: int = 0, page_size: int = None) -> Iterator[Event]:
+    key_cond = events_key_condition(user_id, after_version)
+    for item in query_items(self.table, page_size=page_size, KeyConditionExpression=key_cond):
+      yield event_from_item(item)
 
-  def save(self, event: Event):
-    event_data = asdict(event)
-    item = to_isodatetime(event_data)
-    self.table.put_item(Item=item)
+  def scan_events(self, segment: int, total_segments: int, after: Dict = None, page_size: int = None) -> Iterator[Event]:
+    scan_kwargs = {"Segment": segment, "TotalSegments": total_segments}
+    if after:
+      scan_kwargs["ExclusiveStartKey"] = {"user_id": after["user_id"], "version": after["version"]}
+
+    for item in scan_items(self.table, page_size=page_size, **scan_kwargs):
+      yield event_from_item(item)
+
+  def fetch_snapshot(self, user_id) -> Snapshot:
+    if self.snapshot_table is None:
+      return None
+
+    response = self.snapshot_table.get_item(Key={"user_id": user_id})
+    if 'Item' not in response:
+      return None
+    return snapshot_from_ddb_item(response['Item'])
+
+  def save_snapshot(self, aggregate: UserAvailabilityAggregate):
+    if self.snapshot_table is None or not self.snapshot_policy.should_snapshot(aggregate):
+      return
+
+    t0 = perf_counter()
+    snapshot = aggregate.snapshot()
+    request = snapshot_request(snapshot)
+    if request is None:
+      # not tried again until the policy asks for the next snapshot
+      snapshot_too_large(snapshot)
+      aggregate.snapshot_version = snapshot.version
+      return
+
+    try:
+      self.snapshot_table.put_item(**request)
+    except self.snapshot_table.meta.client.exceptions.ConditionalCheckFailedException:
+      log.debug("newer snapshot exists for user_id=%s, skipping version %s", aggregate.user_id, snapshot.version)
+    aggregate.snapshot_version = snapshot.version
+
+    log.debug(
+      "saved snapshot user_id=%s version=%s slots=%d snapshot_ms=%.2f",
+      aggregate.user_id, snapshot.version, len(snapshot.availability), (perf_counter() - t0) * 1000
+    )
+
+  def append(self, events: List[Event]):
+    if not events:
+      return
+
+    if self.outbox is None:
+      operation, request = append_request(self.table.name, events)
+    else:
+      operation, request = append_request(self.table.name, events, self.outbox.table.name, self.outbox.segments)
+    try:
+      getattr(self.table.meta.client, operation)(**request)
+    except ClientError as e:
+      conflict = append_conflict(events, e)
+      if conflict is None:
+        raise
+      raise conflict from e
+
+
+def is_conflict(error: ClientError) -> bool:
+  code = error.response["Error"]["Code"]
+  if code == "ConditionalCheckFailedException":
+    return True
+  if code == "TransactionCanceledException":
+    reasons = error.response.get("CancellationReasons", [])
+    return any(reason.get("Code") in CONFLICT_REASONS for reason in reasons)
+  return False
 
 
 class DynamoAvailabilityRepo(AvailabilityRepo):
-  def __init__(self, table):
+  """
+  Read model rows carry the aggregate version of the last event projected
+  onto them and projection writes are conditional on it, so redelivered or
+  out of order events are skipped. Deleted slots are kept as tombstones
+  holding their version until tombstone_ttl seconds have passed so a late
+  event cannot bring them back, and are filtered out of query results.
+  """
+  def __init__(
+    self,
+    table,
+    page_size: int = None,
+    bucket_granularity: str = "day",
+    max_workers: int = 8,
+    tombstone_ttl: int = 7 * 24 * 60 * 60
+  ):
+    if bucket_granularity not in BUCKET_FORMATS:
+      raise ValueError(f"unsupported bucket granularity {bucket_granularity}")
     self.table = table
+    self.page_size = page_size
+    self.bucket_granularity = bucket_granularity
+    self.max_workers = max_workers
+    self.tombstone_ttl = tombstone_ttl
 
-  def fetch(self, start, end=None, user_id=None) -> List[Availability]:
-    key_cond = Key('available_at').gte(to_isodatetime(start))
-    if end:
-      key_cond = key_cond & Key('available_at').lt(to_isodatetime(end))
+  def fetch(self, start, end=None, user_id=None, page_size: int = None, limit: int = None) -> Iterator[Availability]:
+    queries = availability_queries(start, end, user_id, self.bucket_granularity)
+    page_kwargs = {"page_size": page_size or self.page_size, "limit": limit}
 
     if user_id:
-      key_cond = key_cond & Key('user_id').eq(user_id)
-
-    response = self.table.query(KeyConditionExpression=key_cond)
-    availability = []
-    for item in response['Items']:
-      availability.append(availability_from_ddb_item(item))
-
-    while 'LastEvaluatedKey' in response:
-      last_key = response['LastEvaluatedKey']
-      key_cond = (
-        Key("user_id").eq(last_key['user_id']) &
-        Key('available_at').gt(last_key['version'])
-      )
-      response = self.table.query(KeyConditionExpression=key_cond)
-      for item in response['Items']:
-        availability.append(availability_from_ddb_item(item))
+      items = query_items(self.table, **queries[0], **page_kwargs)
+    else:
+      items = self._query_buckets(queries, page_kwargs)
 
-    return availability
+    for item in islice(items, limit):
+      yield availability_from_ddb_item(item)
+
+  def _query_buckets(self, queries: List[Dict], page_kwargs: Dict) -> Iterator[Dict]:
+    """
+    Queries the time bucket index for each bucket in parallel. Buckets
+    cover disjoint, ascending time ranges and each is sorted by available_at
+    so yielding them in bucket order keeps the results in time order. At most
+    max_workers buckets are fetched ahead of the one being yielded.
+    """
+    def query_bucket(query):
+      return list(query_items(self.table, **query, **page_kwargs))
+
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      pending = [pool.submit(query_bucket, query) for query in queries[:self.max_workers]]
+      for query in queries[self.max_workers:] + [None] * len(pending):
+        items = pending.pop(0).result()
+        if query is not None:
+          pending.append(pool.submit(query_bucket, query))
+        yield from items
 
   def create(self, availability: Availability):
-    item = availability_to_ddb_item(availability)
+    item = availability_to_ddb_item(availability, self.bucket_granularity)
     self.table.put_item(Item=item)
 
   def update(self, availability: Availability):
     self.create(availability)
 
   def delete(self, availability: Availability):
-    self.table.delete_item(Key={
-      "user_id": availability.user_id,
-      "available_at": to_isodatetime(availability.available_at)
-    })
+    self.table.delete_item(Key=availability_key(availability))
+
+  def project(self, change: AvailabilityChange) -> str:
+    request = project_request(change, self.bucket_granularity, self.tombstone_ttl)
+    try:
+      self.table.put_item(**request)
+      return APPLIED
+    except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+      response = self.table.get_item(**stored_version_request(request["Item"]))
+      return version_outcome(change.version, response.get("Item", {}).get("version"))
+
+  def project_batch(self, changes: List[AvailabilityChange], conditional: bool = True) -> List[str]:
+    """
+    When conditional, the stored versions are read first with BatchGetItem
+    and only newer changes written, each conditional on its version with
+    TransactWriteItems since BatchWriteItem takes no conditions. Another
+    writer projecting the same rows, such as the previous owner of a shard
+    until it notices the hand-over, can therefore never regress them.
+    Unconditional batches, for rebuilding an emptied read model, are sent
+    with BatchWriteItem. Changes must be for distinct rows.
+    """
+    items = [self._change_to_ddb_item(change) for change in changes]
+    outcomes = [APPLIED] * len(changes)
+
+    if conditional:
+      stored = {
+        (item["user_id"], item["available_at"]): item["version"]
+        for item in batch_get(
+          self.table,
+          [{"user_id": item["user_id"], "available_at": item["available_at"]} for item in items],
+          ProjectionExpression="#u, #a, #v",
+          ExpressionAttributeNames={"#u": "user_id", "#a": "available_at", "#v": "version"},
+          ConsistentRead=True
+        )
+      }
+      for i, item in enumerate(items):
+        outcomes[i] = version_outcome(item["version"], stored.get((item["user_id"], item["available_at"])))
+      self._put_newer(items, outcomes)
+      return outcomes
+
+    batch_write(self.table, [
+      {"PutRequest": {"Item": item}}
+      for item, outcome in zip(items, outcomes)
+      if outcome == APPLIED
+    ])
+    return outcomes
+
+  def _put_newer(self, items: List[Dict], outcomes: List[str], max_attempts: int = 8, base_delay: float = 0.05):
+    """
+    Writes the items whose outcome is APPLIED in transactions of up to 100,
+    each put conditional on the row's stored version being older. Items
+    failing their condition were written by another writer in the meantime
+    and have their outcome replaced, the rest of their transaction is sent
+    again, as is a transaction conflicting with another.
+    """
+    pending = [i for i, outcome in enumerate(outcomes) if outcome == APPLIED]
+    for start in range(0, len(pending), MAX_TRANSACT_ITEMS):
+      chunk = pending[start:start + MAX_TRANSACT_ITEMS]
+      attempt = 0
+      while chunk:
+        try:
+          self.table.meta.client.transact_write_items(TransactItems=[
+            {
+              "Put": {
+                "TableName": self.table.name,
+                "Item": items[i],
+                # condition objects are only built into expressions at the top
+                # level of a request, not within TransactItems
+                "ConditionExpression": "attribute_not_exists(#v) OR #v < :v",
+                "ExpressionAttributeNames": {"#v": "version"},
+                "ExpressionAttributeValues": {":v": items[i]["version"]},
+              }
+            }
+            for i in chunk
+          ])
+          break
+        except ClientError as e:
+          if e.response["Error"]["Code"] != "TransactionCanceledException":
+            raise
+          reasons = e.response.get("CancellationReasons", [])
+          failed = {i for i, reason in zip(chunk, reasons) if reason.get("Code") == "ConditionalCheckFailed"}
+          for i in failed:
+            response = self.table.get_item(**stored_version_request(items[i]))
+            outcomes[i] = version_outcome(items[i]["version"], response.get("Item", {}).get("version"))
+          chunk = [i for i in chunk if i not in failed]
+          if not failed:
+            attempt += 1
+            if attempt >= max_attempts:
+              raise RuntimeError(f"{len(chunk)} items of {self.table.name} remained unwritten after {max_attempts} attempts") from e
+            sleep(random.uniform(0, base_delay * 2 ** attempt))
+
+  def stamp(self, user_id: str, version: int):
+    try:
+      self.table.put_item(**stamp_request(user_id, version))
+    except self.table.meta.client.exceptions.ConditionalCheckFailedException:
+      pass
+
+  def fetch_stamp(self, user_id: str) -> int:
+    item = self.table.get_item(Key=stamp_key(user_id), ConsistentRead=True).get("Item")
+    return int(item["version"]) if item else None
+
+  def _change_to_ddb_item(self, change: AvailabilityChange) -> Dict:
+    return change_to_ddb_item(change, self.bucket_granularity, self.tombstone_ttl)
+
+
+def change_to_ddb_item(change: AvailabilityChange, granularity: str, tombstone_ttl: int) -> Dict:
+  item = availability_to_ddb_item(change.availability, granularity)
+  item["version"] = change.version
+  if change.deleted:
+    item["deleted"] = True
+    item["expires_at"] = int(time()) + tombstone_ttl
+  return item
+
+
+def project_request(change: AvailabilityChange, granularity: str, tombstone_ttl: int) -> Dict:
+  """
+  put_item arguments writing a change unless its row already reflects the
+  same or a later version.
+  """
+  return {
+    "Item": change_to_ddb_item(change, granularity, tombstone_ttl),
+    "ConditionExpression": newer_version_condition(change.version),
+  }
+
+
+def stamp_key(user_id: str) -> Dict:
+  return {"user_id": user_id, "available_at": STAMP_SORT_KEY}
+
+
+def stamp_request(user_id: str, version: int) -> Dict:
+  """
+  put_item arguments raising the user's version stamp, failing the condition
+  when it is already at or above version.
+  """
+  return {"Item": {**stamp_key(user_id), "version": version}, "ConditionExpression": newer_version_condition(version)}
+
+
+def newer_version_condition(version: int):
+  return Attr("version").not_exists() | Attr("version").lt(version)
+
+
+def stored_version_request(item: Dict) -> Dict:
+  """
+  get_item arguments reading the version of the read model row of item.
+  """
+  return {
+    "Key": {"user_id": item["user_id"], "available_at": item["available_at"]},
+    "ProjectionExpression": "#v",
+    "ExpressionAttributeNames": {"#v": "version"},
+    "ConsistentRead": True,
+  }
@@ -1,4 +1,3 @@
-import json
 import platform
 import logging
 import multiprocessing
@@ -9,7 +8,8 @@ from kinesis.state import DynamoDB
 from availability.config import AppContext, configure
 from availability.domain import Event
 from availability.service import AvailabilityEventHandler
-from availability.utils import from_isodatetime
+
+from availability.adapters.cdc_codec import CdcCodec, observe_projection_lag
 
 
 log = logging.getLogger(__name__)
@@ -18,7 +18,23 @@ log = logging.getLogger(__name__)
 
 def process_availability_events(ctx: AppContext):
   log.info('initiating availability event processing')
+  ctx.start_metrics()
+  if ctx.projection_mode == "shards":
+    from availability.adapters.shard_consumer import run_supervisor
+    run_supervisor(ctx)
+    return
+  if ctx.projection_batch_size > 1 or ctx.projection_mode == "async":
+    # KinesisConsumer checkpoints a record as soon as the next one is pulled,
+    # so every record of a batch but the last, or every record buffered for
+    # concurrent writes, would be checkpointed before it is written. These are
+    # read with a shard worker instead, which checkpoints records only once
+    # they are projected.
+    from availability.adapters.shard_consumer import CdcShardWorker
+    CdcShardWorker(ctx, 0, 1).run()
+    return
+
   handler = AvailabilityEventHandler(ctx.availability_repo)
+  codec = CdcCodec(ctx.cdc_decoder)
 
   consumer = KinesisConsumer(
     stream_name=ctx.availability_cdc_channel,
@@ -26,9 +42,10 @@ def process_availability_events(ctx: AppContext):
   )
 
   for message in consumer:
-    log.info(f"received message {message}")
-    event = cdc_message_to_event(message)
+    log.debug("received message %s", message)
+    event = codec.decode(message)
     handler.handle(event)
+    observe_projection_lag([message])
 
 
 def cdc_message_to_event(message) -> Event:
@@ -41,25 +58,17 @@ def cdc_message_to_event(message) -> Event:
    'PartitionKey': '03E27A99AD41451219A4D9629E53091C',
    'EncryptionType': 'KMS'}
   """
-  event_data = json.loads(message['Data'].decode('utf-8'))\
-    .get('dynamodb')\
-    .get('NewImage')
-
-  event_payload = event_data['event_payload']['M']
-
-  return Event(
-    event_id=event_data['event_id']['S'],
-    user_id=event_data['user_id']['S'],
-    created=from_isodatetime(event_data['created']['S']),
-    event_type=event_data['event_type']['S'],
-    event_payload={
-      'user_id': event_payload['user_id']['S'],
-      'appointment_id': event_payload['appointment_id'].get('S'),
-      'available_at': from_isodatetime(event_payload['available_at']['S'])
-    },
-    correlation_id=event_data['correlation_id']['S'],
-    version=int(event_data['version']['N'])
-  )
+  return default_codec().decode(message)
+
+
+_default_codec = None
+
+
+def default_codec() -> CdcCodec:
+  global _default_codec
+  if _default_codec is None:
+    _default_codec = CdcCodec()
+  return _default_codec
 
 
 if __name__ == '__main__':
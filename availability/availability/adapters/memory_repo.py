@@ -0,0 +1,208 @@
+"""
+Repositories keeping the event store and read model in process memory, for
+load testing the api without DynamoDB and for local development. State is
+lost when the process exits and is not shared between processes.
+"""
+
+import zlib
+
+from datetime import datetime
+from itertools import islice
+from threading import Lock
+from typing import Dict, Iterator, List, Tuple
+
+from availability.domain.event import Event
+from availability.domain.exception import ConcurrencyException
+from availability.domain.model import Availability, Snapshot, UserAvailabilityAggregate
+from availability.domain.snapshot import SnapshotPolicy, NeverSnapshotPolicy
+from availability.ports.async_repo import AsyncEventStoreRepo, AsyncAvailabilityRepo
+from availability.ports.outbox import OutboxEntry, OutboxRepo, outbox_segment
+from availability.ports.repo import (
+  EventStoreRepo,
+  AvailabilityRepo,
+  AvailabilityChange,
+  APPLIED,
+  version_outcome,
+)
+
+
+class InMemoryOutboxRepo(OutboxRepo):
+  def __init__(self, segments: int = 1):
+    self.segments = segments
+    self._entries: Dict[int, Dict[Tuple[str, int], OutboxEntry]] = {}
+    self._lock = Lock()
+
+  def add(self, entry: OutboxEntry):
+    with self._lock:
+      self._entries.setdefault(outbox_segment(entry.user_id, self.segments), {})[entry.key] = entry
+
+  def fetch_pending(self, segment: int, limit: int, after: Tuple[str, int] = None) -> List[OutboxEntry]:
+    with self._lock:
+      keys = sorted(self._entries.get(segment, {}))
+      entries = self._entries.get(segment, {})
+      return [entries[key] for key in keys if after is None or key > after][:limit]
+
+  def delete(self, entries: List[OutboxEntry]):
+    with self._lock:
+      for entry in entries:
+        self._entries.get(outbox_segment(entry.user_id, self.segments), {}).pop(entry.key, None)
+
+
+class InMemoryEventStoreRepo(EventStoreRepo):
+  def __init__(self, snapshot_policy: SnapshotPolicy = None, outbox: InMemoryOutboxRepo = None):
+    self.snapshot_policy = snapshot_policy or NeverSnapshotPolicy()
+    self.outbox = outbox
+    self._events: Dict[str, List[Event]] = {}
+    self._snapshots: Dict[str, Snapshot] = {}
+    self._lock = Lock()
+
+  def fetch(self, user_id) -> UserAvailabilityAggregate:
+    snapshot = self._snapshots.get(user_id)
+    events = self.fetch_events(user_id, after_version=snapshot.version if snapshot else 0)
+    return UserAvailabilityAggregate(user_id=user_id, events=events, snapshot=snapshot)
+
+  def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    # versions are stored contiguously from one so a version is its position
+    return self._events.get(user_id, [])[after_version:]
+
+  def append(self, events: List[Event]):
+    if not events:
+      return
+
+    with self._lock:
+      stored = self._events.setdefault(events[0].user_id, [])
+      expected = range(len(stored) + 1, len(stored) + 1 + len(events))
+      if [e.version for e in events] != list(expected):
+        raise ConcurrencyException(
+          f"versions {events[0].version}-{events[-1].version} for user {events[0].user_id} were written concurrently"
+        )
+      # replace rather than extend so readers holding the old list are unaffected
+      self._events[events[0].user_id] = stored + events
+      if self.outbox is not None:
+        self.outbox.add(OutboxEntry.of_commit(events))
+
+  def scan_events(self, segment: int, total_segments: int, after: Dict = None, page_size: int = None) -> Iterator[Event]:
+    user_ids = sorted(
+      user_id for user_id in list(self._events)
+      if zlib.crc32(user_id.encode("utf-8")) % total_segments == segment
+    )
+    for user_id in user_ids:
+      after_version = 0
+      if after:
+        if user_id < after["user_id"]:
+          continue
+        if user_id == after["user_id"]:
+          after_version = after["version"]
+      yield from self.fetch_events(user_id, after_version=after_version)
+
+  def save_snapshot(self, aggregate: UserAvailabilityAggregate):
+    if not self.snapshot_policy.should_snapshot(aggregate):
+      return
+
+    snapshot = aggregate.snapshot()
+    with self._lock:
+      current = self._snapshots.get(aggregate.user_id)
+      if current is None or current.version < snapshot.version:
+        self._snapshots[aggregate.user_id] = snapshot
+    aggregate.snapshot_version = snapshot.version
+
+
+class InMemoryAvailabilityRepo(AvailabilityRepo):
+  """
+  Rows are kept per user with the version of the last change projected onto
+  them, deleted rows are kept as tombstones and filtered out of fetches.
+  """
+  def __init__(self):
+    self._rows: Dict[str, Dict[datetime, Tuple[Availability, int, bool]]] = {}
+    self._stamps: Dict[str, int] = {}
+    self._lock = Lock()
+
+  def fetch(self, start, end=None, user_id=None, page_size: int = None, limit: int = None) -> Iterator[Availability]:
+    if user_id:
+      users = [self._rows.get(user_id, {})]
+    elif end:
+      users = list(self._rows.values())
+    else:
+      raise ValueError("fetching availability of all users requires an end")
+
+    availability = [
+      a
+      for rows in users
+      for a, _, deleted in list(rows.values())
+      if not deleted and start <= a.available_at and (end is None or a.available_at < end)
+    ]
+    availability.sort(key=lambda a: (a.available_at, a.user_id))
+    return islice(availability, limit)
+
+  def create(self, availability: Availability):
+    self._write(availability, 0, False)
+
+  def update(self, availability: Availability):
+    self._write(availability, 0, False)
+
+  def delete(self, availability: Availability):
+    with self._lock:
+      self._rows.get(availability.user_id, {}).pop(availability.available_at, None)
+
+  def project(self, change: AvailabilityChange) -> str:
+    a = change.availability
+    with self._lock:
+      row = self._rows.get(a.user_id, {}).get(a.available_at)
+      outcome = version_outcome(change.version, row[1] if row else None)
+      if outcome == APPLIED:
+        self._rows.setdefault(a.user_id, {})[a.available_at] = (a, change.version, change.deleted)
+    return outcome
+
+  def stamp(self, user_id: str, version: int):
+    with self._lock:
+      self._stamps[user_id] = max(version, self._stamps.get(user_id, 0))
+
+  def fetch_stamp(self, user_id: str) -> int:
+    return self._stamps.get(user_id)
+
+  def _write(self, availability: Availability, version: int, deleted: bool):
+    with self._lock:
+      self._rows.setdefault(availability.user_id, {})[availability.available_at] = (availability, version, deleted)
+
+
+class AsyncInMemoryEventStoreRepo(AsyncEventStoreRepo):
+  def __init__(self, repo: InMemoryEventStoreRepo = None):
+    self.repo = repo or InMemoryEventStoreRepo()
+
+  async def fetch(self, user_id) -> UserAvailabilityAggregate:
+    return self.repo.fetch(user_id)
+
+  async def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    return self.repo.fetch_events(user_id, after_version=after_version)
+
+  async def append(self, events: List[Event]):
+    self.repo.append(events)
+
+  async def save_snapshot(self, aggregate: UserAvailabilityAggregate):
+    self.repo.save_snapshot(aggregate)
+
+
+class AsyncInMemoryAvailabilityRepo(AsyncAvailabilityRepo):
+  def __init__(self, repo: InMemoryAvailabilityRepo = None):
+    self.repo = repo or InMemoryAvailabilityRepo()
+
+  async def fetch(self, start, end=None, user_id=None, page_size: int = None, limit: int = None) -> List[Availability]:
+    return list(self.repo.fetch(start, end=end, user_id=user_id, page_size=page_size, limit=limit))
+
+  async def create(self, availability: Availability):
+    self.repo.create(availability)
+
+  async def update(self, availability: Availability):
+    self.repo.update(availability)
+
+  async def delete(self, availability: Availability):
+    self.repo.delete(availability)
+
+  async def project(self, change: AvailabilityChange) -> str:
+    return self.repo.project(change)
+
+  async def stamp(self, user_id: str, version: int):
+    self.repo.stamp(user_id, version)
+
+  async def fetch_stamp(self, user_id: str) -> int:
+    return self.repo.fetch_stamp(user_id)
@@ -0,0 +1,61 @@
+import asyncio
+
+from datetime import datetime, timezone
+from itertools import count
+from typing import Dict, List
+
+
+class InMemoryStream:
+  """
+  Stand-in for a Kinesis stream delivering messages shaped like the records
+  yielded by KinesisConsumer. Iterating it asynchronously yields messages
+  in the order they were put until the stream is closed.
+  """
+  def __init__(self, maxsize: int = 0):
+    self.maxsize = maxsize
+    self._queue = None
+    self._closed = object()
+    self._sequence = count(1)
+
+  @property
+  def queue(self) -> asyncio.Queue:
+    # created on first use so it belongs to the event loop that uses it
+    if self._queue is None:
+      self._queue = asyncio.Queue(maxsize=self.maxsize)
+    return self._queue
+
+  async def put(self, message: Dict):
+    await self.queue.put(message)
+
+  def put_nowait(self, message: Dict):
+    self.queue.put_nowait(message)
+
+  def put_records(self, StreamName: str, Records: List[Dict]) -> Dict:
+    """
+    Accepts a Kinesis PutRecords request, returning its response shape.
+    Must not be called from a thread other than that of the event loop
+    consuming the stream once it is being iterated.
+    """
+    results = []
+    for record in Records:
+      sequence_number = str(next(self._sequence))
+      self.put_nowait({
+        "Data": record["Data"],
+        "PartitionKey": record["PartitionKey"],
+        "SequenceNumber": sequence_number,
+        "ApproximateArrivalTimestamp": datetime.now(timezone.utc),
+      })
+      results.append({"SequenceNumber": sequence_number, "ShardId": "shardId-000000000000"})
+    return {"FailedRecordCount": 0, "Records": results}
+
+  async def close(self):
+    await self.queue.put(self._closed)
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self) -> Dict:
+    message = await self.queue.get()
+    if message is self._closed:
+      raise StopAsyncIteration
+    return message
@@ -1,36 +1,115 @@
 
 from datetime import datetime
-from typing import List, Union
+from typing import List, Literal, Union
 from uuid import uuid4
 
 import uvicorn
 from fastapi import FastAPI, Header, Request, Response
-from pydantic import BaseModel
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, conlist, validator
 
 from availability.config import configure
-from availability.domain import Availability, CreateAvailabilityCommand, DeleteAvailabilityCommand, AddAppointmentCommand, RemoveAppointmentCommand
-from availability.service import AvailabilityCommandHandler, AvailabilityQueryService
+from availability.domain import (
+  AvailabilityExistsException,
+  AvailabilityNotExistsException,
+  ConcurrencyException,
+  TooManyEventsException,
+  Command,
+  CreateAvailabilityCommand,
+  DeleteAvailabilityCommand,
+  AddAppointmentCommand,
+  RemoveAppointmentCommand,
+)
+from availability.ports import MAX_APPEND_EVENTS
+from availability.service import AsyncAvailabilityCommandHandler, AsyncAvailabilityQueryService
+from availability.utils import metrics
 
 
 ctx = configure()
 app = FastAPI()
 
 
+class AvailabilityDto(BaseModel):
+  user_id: str
+  available_at: datetime
+  appointment_id: str = None
+
+  class Config:
+    # read from the slotted domain Availability, which pydantic cannot
+    # wrap as a dataclass of its own
+    orm_mode = True
+
+
 class AvailabilityResponse(BaseModel):
   start: datetime
   end: datetime
-  availability: List[Availability]
+  availability: List[AvailabilityDto]
+
+
+class AvailabilityRequest(BaseModel):
+  available_at: datetime
+  appointment_id: str = None
 
 
-class AvailabilityRequest:
+class BulkOperation(BaseModel):
+  op: Literal['create', 'delete', 'add_appointment', 'remove_appointment']
   available_at: datetime
   appointment_id: str = None
 
+  @validator('appointment_id', always=True)
+  def appointment_id_for_add_appointment(cls, appointment_id, values):
+    if values.get('op') == 'add_appointment' and not appointment_id:
+      raise ValueError('add_appointment requires an appointment_id')
+    return appointment_id
+
+
+class BulkAvailabilityRequest(BaseModel):
+  operations: conlist(BulkOperation, min_items=1, max_items=MAX_APPEND_EVENTS)
+
+
+class BulkAvailabilityResponse(BaseModel):
+  version: int
+  events: int
+
 
 @app.middleware('http')
-def ensure_correlation_id(request: Request, call_next):
-  request.headers['x-correlation-id'] = request.headers.get('x-correlation-id', str(uuid4()))
-  return call_next(request)
+async def ensure_correlation_id(request: Request, call_next):
+  # request headers are immutable, add the header to the scope handlers are called with
+  if 'x-correlation-id' not in request.headers:
+    request.scope['headers'].append((b'x-correlation-id', str(uuid4()).encode('latin-1')))
+  return await call_next(request)
+
+
+@app.on_event('startup')
+async def open_repos():
+  ctx.start_metrics()
+  await ctx.open_async_repos()
+
+
+@app.on_event('shutdown')
+async def close_repos():
+  await ctx.close_async_repos()
+  ctx.stop_metrics()
+
+
+@app.exception_handler(ConcurrencyException)
+def handle_concurrency_exception(request: Request, exc: ConcurrencyException):
+  return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+
+@app.exception_handler(AvailabilityExistsException)
+def handle_availability_exists_exception(request: Request, exc: AvailabilityExistsException):
+  return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+
+@app.exception_handler(AvailabilityNotExistsException)
+def handle_availability_not_exists_exception(request: Request, exc: AvailabilityNotExistsException):
+  return JSONResponse(status_code=404, content={"detail": str(exc)})
+
+
+@app.exception_handler(TooManyEventsException)
+def handle_too_many_events_exception(request: Request, exc: TooManyEventsException):
+  return JSONResponse(status_code=413, content={"detail": str(exc)})
 
 
 @app.get(f"{ctx.base_uri}/health")
@@ -38,78 +117,155 @@ async def health():
   return {"status": "up"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+  return PlainTextResponse(metrics.REGISTRY.prometheus_text(), media_type='text/plain; version=0.0.4')
+
+
 @app.get(f"{ctx.base_uri}/availability", response_model=AvailabilityResponse)
-def get_availability(
+async def get_availability(
+  response: Response,
   start: Union[datetime, None] = None,
   end: Union[datetime, None] = None,
-  user_id: Union[str, None] = None
+  user_id: Union[str, None] = None,
+  if_none_match: Union[str, None] = Header(default=None, alias='if-none-match')
 ):
-  svc = AvailabilityQueryService(ctx.availability_repo)
-  availability = svc.fetch(user_id=user_id, start=start, end=end)
+  if start and end and end <= start:
+    return JSONResponse(status_code=400, content={"detail": "end must be after start"})
 
-  return AvailabilityResponse(
-    start=start or min(availability, key=lambda a: a.available_at),
-    end=end or max(availability, key=lambda a: a.available_at),
-    availability=availability
-  )
+  svc = AsyncAvailabilityQueryService(ctx.async_availability_repo, ctx.query_cache)
+  result = await svc.query(user_id=user_id, start=start, end=end)
+
+  if etag_matches(result.etag, if_none_match):
+    return Response(status_code=304, headers={'ETag': result.etag})
 
+  response.headers['ETag'] = result.etag
+  return AvailabilityResponse(start=result.start, end=result.end, availability=result.availability)
 
-@app.post(f"{ctx.base_uri}/walker/<user_id>/availability", status_code=201)
-def create_availability(
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+  if not if_none_match:
+    return False
+  tags = {tag.strip() for tag in if_none_match.split(',')}
+  # If-None-Match uses weak comparison
+  return '*' in tags or etag in tags or f'W/{etag}' in tags
+
+
+@app.post(f"{ctx.base_uri}/walker/{{user_id}}/availability", status_code=201)
+async def create_availability(
   user_id: str,
   request: AvailabilityRequest,
   correlation_id: str = Header(alias='x-correlation-id')
 ):
-  handler = AvailabilityCommandHandler(user_id, ctx.event_store_repo)
-  handler.add_availability(CreateAvailabilityCommand(
-    correlation_id=correlation_id,
-    user_id=user_id,
-    available_at=request.available_at,
-    appointment_id=request.appointment_id
-  ))
+  handler = AsyncAvailabilityCommandHandler(
+    user_id,
+    ctx.async_event_store_repo,
+    ctx.aggregate_cache,
+    ctx.command_retries,
+    ctx.async_commit_projector
+  )
+  async with handler:
+    handler.add_availability(CreateAvailabilityCommand(
+      correlation_id=correlation_id,
+      user_id=user_id,
+      available_at=request.available_at,
+      appointment_id=request.appointment_id
+    ))
 
 
-@app.put(f"{ctx.base_uri}/walker/<user_id>/availability")
-def update_availability(
+@app.put(f"{ctx.base_uri}/walker/{{user_id}}/availability")
+async def update_availability(
   user_id: str,
   request: AvailabilityRequest,
   response: Response,
   correlation_id: str = Header(alias='x-correlation-id'),
 ):
-  handler = AvailabilityCommandHandler(user_id, ctx.event_store_repo)
+  handler = AsyncAvailabilityCommandHandler(
+    user_id,
+    ctx.async_event_store_repo,
+    ctx.aggregate_cache,
+    ctx.command_retries,
+    ctx.async_commit_projector
+  )
 
-  availability = handler.aggregate.find_availability(available_at=request.available_at)
-  if not availability.appointment_id and request.appointment_id is not None:
-    handler.add_appointment(AddAppointmentCommand(
-      correlation_id=correlation_id,
-      user_id=user_id,
-      available_at=request.available_at,
-      appointment_id=request.appointment_id
-    ))
-  elif availability.appointment_id is not None and not request.appointment_id:
-    handler.remove_appointment(RemoveAppointmentCommand(
+  async with handler:
+    availability = handler.aggregate.find_availability(available_at=request.available_at, raise_error=True)
+    if not availability.appointment_id and request.appointment_id is not None:
+      handler.add_appointment(AddAppointmentCommand(
+        correlation_id=correlation_id,
+        user_id=user_id,
+        available_at=request.available_at,
+        appointment_id=request.appointment_id
+      ))
+    elif availability.appointment_id is not None and not request.appointment_id:
+      handler.remove_appointment(RemoveAppointmentCommand(
+        correlation_id=correlation_id,
+        user_id=user_id,
+        available_at=request.available_at,
+      ))
+    else:
+      # unsupported operation (bad request)
+      response.status_code = 400
+
+
+@app.delete(f"{ctx.base_uri}/walker/{{user_id}}/availability/{{available_at}}", status_code=204)
+async def delete_availability(
+  user_id: str,
+  available_at: datetime,
+  correlation_id: str = Header(alias='x-correlation-id')
+):
+  handler = AsyncAvailabilityCommandHandler(
+    user_id,
+    ctx.async_event_store_repo,
+    ctx.aggregate_cache,
+    ctx.command_retries,
+    ctx.async_commit_projector
+  )
+  async with handler:
+    handler.delete_availability(DeleteAvailabilityCommand(
       correlation_id=correlation_id,
       user_id=user_id,
-      available_at=request.available_at,
-      appointment_id=request.appointment_id
+      available_at=available_at
     ))
-  else:
-    # unsupported operation (bad request)
-    response.status_code = 400
 
 
-@app.delete(f"{ctx.base_uri}/walker/<user_id>/availability/<available_at>", status_code=204)
-def delete_availability(
+BULK_COMMANDS = {
+  'create': CreateAvailabilityCommand,
+  'delete': DeleteAvailabilityCommand,
+  'add_appointment': AddAppointmentCommand,
+  'remove_appointment': RemoveAppointmentCommand,
+}
+
+
+def bulk_command(operation: BulkOperation, user_id: str, correlation_id: str) -> Command:
+  kwargs = dict(correlation_id=correlation_id, user_id=user_id, available_at=operation.available_at)
+  if operation.op in ('create', 'add_appointment'):
+    kwargs['appointment_id'] = operation.appointment_id
+  return BULK_COMMANDS[operation.op](**kwargs)
+
+
+@app.post(f"{ctx.base_uri}/walker/{{user_id}}/availability/bulk", response_model=BulkAvailabilityResponse)
+async def bulk_availability(
   user_id: str,
-  available_at: datetime,
+  request: BulkAvailabilityRequest,
   correlation_id: str = Header(alias='x-correlation-id')
 ):
-  handler = AvailabilityCommandHandler(user_id, ctx.event_store_repo)
-  handler.delete_availability(DeleteAvailabilityCommand(
-    correlation_id=correlation_id,
-    user_id=user_id,
-    available_at=available_at
-  ))
+  """
+  Applies the operations in order and commits all of their events in one
+  atomic append, or none of them if any operation is rejected.
+  """
+  handler = AsyncAvailabilityCommandHandler(
+    user_id,
+    ctx.async_event_store_repo,
+    ctx.aggregate_cache,
+    ctx.command_retries,
+    ctx.async_commit_projector
+  )
+  async with handler:
+    handler.handle_all([bulk_command(op, user_id, correlation_id) for op in request.operations])
+    events = len(handler.aggregate.uncommitted_events)
+
+  return BulkAvailabilityResponse(version=handler.aggregate.version, events=events)
 
 
 if __name__ == '__main__':
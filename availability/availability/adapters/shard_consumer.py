@@ -0,0 +1,317 @@
+"""
+Multi-process Kinesis consumer, of the availability cdc channel unless a
+worker class for another stream is given.
+
+A supervisor starts one worker process per CPU (or shard_workers), capped
+at the stream's open shard count, and keeps them running. Every worker
+lists the stream's shards and deals them out round robin in shard id order,
+open and closed shards separately, so workers independently agree on who
+owns which shard and each owns about as many as the others. Each worker
+polls its shards round robin, projects the records of each GetRecords
+response and checkpoints a shard only after checkpoint_every_records
+records or checkpoint_every_seconds seconds, so a crash replays at most
+that many records, which version gated projection skips cheaply.
+
+When a shard is closed by resharding its final position is checkpointed as
+finished and its child shards are only read once all their parents have
+finished, keeping each user's events in order across the handoff.
+
+Workers only recompute ownership every shard_check_interval seconds, so
+after resharding or a change in worker count a shard can be read by its old
+and new owner until the old one notices. Every projection write is
+conditional on the row's version, so the overlap only repeats work.
+
+Checkpoints are kept in the consumer table under "<stream>:<shard id>"
+rather than kinesis-python's "<stream>_<shard id>" items, so switching a
+consumer between these workers and KinesisConsumer reads the stream again
+from TRIM_HORIZON.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+
+from abc import ABC, abstractmethod
+from time import monotonic, sleep
+from typing import AsyncIterator, Dict, Iterable, List, Type
+
+from botocore.exceptions import ClientError
+
+from availability.config import AppContext
+from availability.domain import Event
+from availability.service import AsyncProjector, AvailabilityEventHandler
+
+from availability.adapters.cdc_codec import CdcCodec, observe_projection_lag
+
+
+log = logging.getLogger(__name__)
+
+
+class ShardCheckpointer:
+  def __init__(self, table, stream_name: str):
+    self.table = table
+    self.stream_name = stream_name
+
+  def _key(self, shard_id: str) -> Dict:
+    return {"shard": f"{self.stream_name}:{shard_id}"}
+
+  def get(self, shard_id: str) -> Dict:
+    return self.table.get_item(Key=self._key(shard_id), ConsistentRead=True).get("Item", {})
+
+  def checkpoint(self, shard_id: str, sequence_number: str, finished: bool = False):
+    self.table.put_item(Item={**self._key(shard_id), "seq": sequence_number, "finished": finished})
+
+  def is_finished(self, shard_id: str) -> bool:
+    return self.get(shard_id).get("finished", False)
+
+
+class ShardReader:
+  def __init__(self, kinesis, stream_name: str, shard_id: str, checkpointer: ShardCheckpointer):
+    self.kinesis = kinesis
+    self.stream_name = stream_name
+    self.shard_id = shard_id
+    self.checkpointer = checkpointer
+
+    self.sequence_number = checkpointer.get(shard_id).get("seq")
+    self.uncheckpointed = 0
+    self.last_checkpoint = monotonic()
+    self.next_poll = 0.0
+    self.closed = False
+    self.iterator = self._new_iterator()
+
+  def _new_iterator(self) -> str:
+    kwargs = {"StreamName": self.stream_name, "ShardId": self.shard_id}
+    if self.sequence_number:
+      kwargs.update(ShardIteratorType="AFTER_SEQUENCE_NUMBER", StartingSequenceNumber=self.sequence_number)
+    else:
+      kwargs.update(ShardIteratorType="TRIM_HORIZON")
+    return self.kinesis.get_shard_iterator(**kwargs)["ShardIterator"]
+
+  def read(self, limit: int) -> List[Dict]:
+    try:
+      response = self.kinesis.get_records(ShardIterator=self.iterator, Limit=limit)
+    except ClientError as e:
+      if e.response["Error"]["Code"] == "ExpiredIteratorException":
+        self.iterator = self._new_iterator()
+        return []
+      raise
+
+    self.iterator = response.get("NextShardIterator")
+    self.closed = self.iterator is None
+    return response["Records"]
+
+  def advance(self, records: List[Dict]):
+    if records:
+      self.sequence_number = records[-1]["SequenceNumber"]
+      self.uncheckpointed += len(records)
+
+  def checkpoint(self, finished: bool = False):
+    if self.uncheckpointed or finished:
+      self.checkpointer.checkpoint(self.shard_id, self.sequence_number, finished=finished)
+    self.uncheckpointed = 0
+    self.last_checkpoint = monotonic()
+
+
+def list_shards(kinesis, stream_name: str) -> List[Dict]:
+  shards = []
+  kwargs = {"StreamName": stream_name}
+  while True:
+    response = kinesis.list_shards(**kwargs)
+    shards.extend(response["Shards"])
+    if "NextToken" not in response:
+      return shards
+    kwargs = {"NextToken": response["NextToken"]}
+
+
+def is_open(shard: Dict) -> bool:
+  return "EndingSequenceNumber" not in shard["SequenceNumberRange"]
+
+
+def owned_shards(shards: List[Dict], worker_index: int, worker_count: int) -> List[Dict]:
+  """
+  The shards of worker_index out of worker_count, dealt round robin in shard
+  id order. Open shards are dealt separately from closed ones so the shards
+  being read stay balanced across workers while closed ones drain.
+  """
+  owned = []
+  for group in ([s for s in shards if is_open(s)], [s for s in shards if not is_open(s)]):
+    group = sorted(group, key=lambda s: s["ShardId"])
+    owned.extend(group[worker_index::worker_count])
+  return owned
+
+
+class ShardWorker(ABC):
+  """
+  Polls the shards it owns of the stream named by the context setting
+  stream_setting, handing the records of each GetRecords response to
+  process_records before advancing past them.
+  """
+  stream_setting = "availability_cdc_channel"
+
+  def __init__(self, ctx: AppContext, worker_index: int, worker_count: int):
+    self.ctx = ctx
+    self.worker_index = worker_index
+    self.worker_count = worker_count
+    self.stream_name = getattr(ctx, self.stream_setting)
+
+    self.kinesis = ctx.aws_client("kinesis")
+    self.checkpointer = ShardCheckpointer(ctx.dynamodb.Table(ctx.availability_consumer_table), self.stream_name)
+
+    self.readers: Dict[str, ShardReader] = {}
+    self.finished = set()
+    self.last_shard_check = None
+
+  def run(self):
+    log.info(f"shard worker {self.worker_index + 1}/{self.worker_count} started")
+    while True:
+      now = monotonic()
+      if self.last_shard_check is None or now - self.last_shard_check >= self.ctx.shard_check_interval:
+        self._assign_shards()
+        self.last_shard_check = now
+
+      polled = False
+      for reader in list(self.readers.values()):
+        if reader.next_poll <= monotonic():
+          self._poll(reader)
+          polled = True
+
+      if not polled:
+        sleep(0.05)
+
+  def _assign_shards(self):
+    shards = list_shards(self.kinesis, self.stream_name)
+    owned = owned_shards(shards, self.worker_index, self.worker_count)
+
+    # resharding deals shards out again, hand over those now dealt to another worker
+    owned_ids = {shard["ShardId"] for shard in owned}
+    for shard_id in [s for s in self.readers if s not in owned_ids]:
+      log.info(f"worker {self.worker_index} handing over shard {shard_id}")
+      self.readers.pop(shard_id).checkpoint()
+
+    listed = {shard["ShardId"] for shard in shards}
+    for shard in owned:
+      shard_id = shard["ShardId"]
+      if shard_id in self.readers or shard_id in self.finished:
+        continue
+      if self.checkpointer.is_finished(shard_id):
+        self.finished.add(shard_id)
+        continue
+
+      # parents that are no longer listed have been trimmed from the stream
+      parents = [shard.get("ParentShardId"), shard.get("AdjacentParentShardId")]
+      if any(p in listed and not self._is_finished(p) for p in parents if p):
+        continue
+
+      log.info(f"worker {self.worker_index} taking shard {shard_id}")
+      self.readers[shard_id] = ShardReader(self.kinesis, self.stream_name, shard_id, self.checkpointer)
+
+  def _is_finished(self, shard_id: str) -> bool:
+    return shard_id in self.finished or self.checkpointer.is_finished(shard_id)
+
+  def _poll(self, reader: ShardReader):
+    try:
+      records = reader.read(self.ctx.shard_read_limit)
+    except ClientError as e:
+      if e.response["Error"]["Code"] != "ProvisionedThroughputExceededException":
+        raise
+      reader.next_poll = monotonic() + 1.0
+      return
+
+    if records:
+      self.process_records(records)
+      reader.advance(records)
+
+    if reader.closed:
+      reader.checkpoint(finished=True)
+      del self.readers[reader.shard_id]
+      self.finished.add(reader.shard_id)
+      log.info(f"shard {reader.shard_id} closed, handing off to its children")
+      # pick up the children straight away rather than at the next shard check
+      self.last_shard_check = None
+      return
+
+    if reader.uncheckpointed >= self.ctx.checkpoint_every_records or \
+        monotonic() - reader.last_checkpoint >= self.ctx.checkpoint_every_seconds:
+      reader.checkpoint()
+
+    # GetRecords allows five calls per second per shard, poll less when caught up
+    reader.next_poll = monotonic() + (0.2 if records else self.ctx.shard_idle_poll_seconds)
+
+  @abstractmethod
+  def process_records(self, records: List[Dict]):
+    pass
+
+
+async def _iterate(events: Iterable[Event]) -> AsyncIterator[Event]:
+  for event in events:
+    yield event
+
+
+class CdcShardWorker(ShardWorker):
+  """
+  Projects cdc records to the read model. With the "async" projection mode
+  the records of each GetRecords response are projected concurrently across
+  users by an AsyncProjector, whose writes are the blocking handler's run on
+  a thread pool, and the shard only advances once every one has completed.
+  """
+  def __init__(self, ctx: AppContext, worker_index: int, worker_count: int):
+    super().__init__(ctx, worker_index, worker_count)
+    self.handler = AvailabilityEventHandler(ctx.availability_repo)
+    self.codec = CdcCodec(ctx.cdc_decoder)
+    self.projector = None
+    if ctx.projection_mode == "async":
+      self.projector = AsyncProjector(self.handler, max_in_flight=ctx.projection_max_in_flight)
+      self.loop = asyncio.new_event_loop()
+
+  def process_records(self, records: List[Dict]):
+    events = self.codec.decode_batch(records)
+    batch_size = self.ctx.projection_batch_size
+    if self.projector is not None:
+      # raises the first failed write, ending the worker before the records are checkpointed
+      self.loop.run_until_complete(self.projector.run(_iterate(events)))
+    elif batch_size > 1:
+      for i in range(0, len(events), batch_size):
+        self.handler.handle_batch(events[i:i + batch_size])
+    else:
+      for event in events:
+        self.handler.handle(event)
+    observe_projection_lag(records)
+
+
+def run_worker(settings: Dict, worker_index: int, worker_count: int, worker_cls: Type[ShardWorker] = CdcShardWorker):
+  logging.basicConfig(level=logging.INFO)
+  ctx = AppContext(**settings)
+  ctx.start_metrics(dimensions={"worker": str(worker_index)})
+  worker_cls(ctx, worker_index, worker_count).run()
+
+
+def run_supervisor(ctx: AppContext, worker_cls: Type[ShardWorker] = CdcShardWorker, worker_count: int = None):
+  """
+  Starts the shard workers in their own processes and restarts any that exit.
+  """
+  worker_count = worker_count or ctx.shard_workers or os.cpu_count() or 1
+  # workers beyond the open shard count would own no shard to read
+  stream_name = getattr(ctx, worker_cls.stream_setting)
+  open_shards = sum(1 for shard in list_shards(ctx.aws_client("kinesis"), stream_name) if is_open(shard))
+  worker_count = max(1, min(worker_count, open_shards))
+  settings = ctx.dict(exclude={"cache"})
+  log.info(f"starting {worker_count} shard workers for {stream_name}")
+
+  def start(worker_index: int) -> multiprocessing.Process:
+    process = multiprocessing.Process(
+      target=run_worker,
+      args=(settings, worker_index, worker_count, worker_cls),
+      name=f"shard-worker-{worker_index}",
+      daemon=True
+    )
+    process.start()
+    return process
+
+  workers = [start(i) for i in range(worker_count)]
+  while True:
+    sleep(1.0)
+    for i, process in enumerate(workers):
+      if not process.is_alive():
+        log.warning(f"shard worker {i} exited with {process.exitcode}, restarting")
+        workers[i] = start(i)
@@ -0,0 +1,393 @@
+"""
+Repositories storing the event store and read model in a SQLite database
+file, for local runs and embedded deployments without DynamoDB.
+
+Each thread uses its own connection to the database which is opened in WAL
+mode so reads proceed while another connection writes.
+"""
+
+import json
+import sqlite3
+import threading
+import zlib
+
+from typing import Dict, Iterator, List, Tuple
+
+from availability.domain.event import Event
+from availability.domain.exception import ConcurrencyException
+from availability.domain.model import Availability, Snapshot, UserAvailabilityAggregate
+from availability.domain.snapshot import SnapshotPolicy, NeverSnapshotPolicy
+from availability.ports.outbox import OutboxEntry, OutboxRepo, outbox_segment
+from availability.ports.repo import (
+  EventStoreRepo,
+  AvailabilityRepo,
+  AvailabilityChange,
+  APPLIED,
+  version_outcome,
+)
+from availability.utils.codec import event_to_item, event_from_item, to_json
+from availability.utils.common import from_isodatetime
+
+
+# events are keyed, and so indexed, by (user_id, version) and read model rows
+# by (user_id, available_at), queries across users use available_at alone
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+  user_id TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  event_id TEXT NOT NULL,
+  event_type TEXT NOT NULL,
+  created TEXT NOT NULL,
+  correlation_id TEXT,
+  event_payload TEXT NOT NULL,
+  PRIMARY KEY (user_id, version)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS snapshots (
+  user_id TEXT PRIMARY KEY,
+  version INTEGER NOT NULL,
+  snapshot TEXT NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS availability (
+  user_id TEXT NOT NULL,
+  available_at TEXT NOT NULL,
+  appointment_id TEXT,
+  version INTEGER NOT NULL DEFAULT 0,
+  deleted INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (user_id, available_at)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS availability_stamps (
+  user_id TEXT PRIMARY KEY,
+  version INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS availability_available_at ON availability (available_at, user_id) WHERE deleted = 0;
+
+CREATE TABLE IF NOT EXISTS outbox (
+  segment INTEGER NOT NULL,
+  user_id TEXT NOT NULL,
+  version INTEGER NOT NULL,
+  created TEXT NOT NULL,
+  events TEXT NOT NULL,
+  PRIMARY KEY (segment, user_id, version)
+) WITHOUT ROWID;
+"""
+
+EVENT_COLUMNS = "user_id, version, event_id, event_type, created, correlation_id, event_payload"
+
+
+class SqliteDatabase:
+  """
+  Hands out one connection per thread to the database at path, creating
+  the schema on first use. Datetimes are stored as naive ISO 8601 strings
+  which sort in time order.
+  """
+  def __init__(self, path: str, busy_timeout_ms: int = 5000):
+    if path == ":memory:":
+      raise ValueError("each connection to :memory: is a separate database, use a file or InMemory repos")
+    self.path = path
+    self.busy_timeout_ms = busy_timeout_ms
+    self._local = threading.local()
+    with self.connection() as conn:
+      conn.executescript(SCHEMA)
+
+  def connection(self) -> sqlite3.Connection:
+    conn = getattr(self._local, "conn", None)
+    if conn is None:
+      conn = self._local.conn = self.connect()
+    return conn
+
+  def connect(self) -> sqlite3.Connection:
+    conn = sqlite3.connect(self.path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # in WAL mode NORMAL syncs at checkpoints only, a power loss may roll
+    # back the last transactions but cannot corrupt the database
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+    # hash of a user id deciding its scan segment, as in the other event stores
+    conn.create_function("crc32", 1, lambda value: zlib.crc32(value.encode("utf-8")), deterministic=True)
+    return conn
+
+
+def event_to_row(event: Event) -> tuple:
+  item = event_to_item(event)
+  return (
+    item["user_id"],
+    item["version"],
+    item["event_id"],
+    item["event_type"],
+    item["created"],
+    item["correlation_id"],
+    to_json(item["event_payload"])
+  )
+
+
+def event_from_row(row: tuple) -> Event:
+  user_id, version, event_id, event_type, created, correlation_id, event_payload = row
+  payload = json.loads(event_payload)
+  payload["available_at"] = from_isodatetime(payload["available_at"])
+  return Event(
+    event_id=event_id,
+    user_id=user_id,
+    created=from_isodatetime(created),
+    event_type=event_type,
+    event_payload=payload,
+    correlation_id=correlation_id,
+    version=version
+  )
+
+
+def snapshot_to_json(snapshot: Snapshot) -> str:
+  return to_json({
+    "start": snapshot.start.isoformat() if snapshot.start else None,
+    "availability": [[a.available_at.isoformat(), a.appointment_id] for a in snapshot.availability],
+  })
+
+
+def snapshot_from_row(user_id: str, version: int, data: str) -> Snapshot:
+  data = json.loads(data)
+  return Snapshot(
+    user_id=user_id,
+    version=version,
+    start=from_isodatetime(data["start"]) if data["start"] else None,
+    availability=[
+      Availability(user_id=user_id, available_at=from_isodatetime(available_at), appointment_id=appointment_id)
+      for available_at, appointment_id in data["availability"]
+    ]
+  )
+
+
+class SqliteOutboxRepo(OutboxRepo):
+  def __init__(self, db: SqliteDatabase, segments: int = 1):
+    self.db = db
+    self.segments = segments
+
+  def entry_to_row(self, entry: OutboxEntry) -> tuple:
+    return (
+      outbox_segment(entry.user_id, self.segments),
+      entry.user_id,
+      entry.version,
+      entry.created.isoformat(),
+      to_json([event_to_item(event) for event in entry.events])
+    )
+
+  def fetch_pending(self, segment: int, limit: int, after: Tuple[str, int] = None) -> List[OutboxEntry]:
+    rows = self.db.connection().execute(
+      "SELECT user_id, version, created, events FROM outbox WHERE segment = ? AND (user_id, version) > (?, ?) "
+      "ORDER BY user_id, version LIMIT ?",
+      (segment, *(after or ("", 0)), limit)
+    )
+    return [
+      OutboxEntry(
+        user_id=user_id,
+        version=version,
+        created=from_isodatetime(created),
+        events=[event_from_item(item) for item in json.loads(events)]
+      )
+      for user_id, version, created, events in rows
+    ]
+
+  def delete(self, entries: List[OutboxEntry]):
+    conn = self.db.connection()
+    with conn:
+      conn.executemany(
+        "DELETE FROM outbox WHERE segment = ? AND user_id = ? AND version = ?",
+        [(outbox_segment(e.user_id, self.segments), e.user_id, e.version) for e in entries]
+      )
+
+
+class SqliteEventStoreRepo(EventStoreRepo):
+  def __init__(self, db: SqliteDatabase, snapshot_policy: SnapshotPolicy = None, outbox: SqliteOutboxRepo = None):
+    self.db = db
+    self.snapshot_policy = snapshot_policy or NeverSnapshotPolicy()
+    # entries are written through this repo's connection, the outbox must
+    # share its database
+    self.outbox = outbox
+
+  def fetch(self, user_id) -> UserAvailabilityAggregate:
+    snapshot = self.fetch_snapshot(user_id)
+    events = self.fetch_events(user_id, after_version=snapshot.version if snapshot else 0)
+    return UserAvailabilityAggregate(user_id=user_id, events=events, snapshot=snapshot)
+
+  def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    rows = self.db.connection().execute(
+      f"SELECT {EVENT_COLUMNS} FROM events WHERE user_id = ? AND version > ? ORDER BY version",
+      (user_id, after_version)
+    )
+    return [event_from_row(row) for row in rows]
+
+  def append(self, events: List[Event]):
+    if not events:
+      return
+
+    conn = self.db.connection()
+    try:
+      with conn:
+        conn.executemany(f"INSERT INTO events ({EVENT_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", map(event_to_row, events))
+        if self.outbox is not None:
+          conn.execute("INSERT INTO outbox VALUES (?, ?, ?, ?, ?)", self.outbox.entry_to_row(OutboxEntry.of_commit(events)))
+    except sqlite3.IntegrityError as e:
+      raise ConcurrencyException(
+        f"versions {events[0].version}-{events[-1].version} for user {events[0].user_id} were written concurrently"
+      ) from e
+
+  def scan_events(self, segment: int, total_segments: int, after: Dict = None, page_size: int = None) -> Iterator[Event]:
+    after_key = (after["user_id"], after["version"]) if after else ("", 0)
+    # a scan holds its read transaction open for its whole duration which,
+    # on the thread's connection, would keep that thread from writing
+    conn = self.db.connect()
+    try:
+      cursor = conn.execute(
+        f"SELECT {EVENT_COLUMNS} FROM events WHERE (user_id, version) > (?, ?) AND crc32(user_id) % ? = ? "
+        "ORDER BY user_id, version",
+        (*after_key, total_segments, segment)
+      )
+      while True:
+        rows = cursor.fetchmany(page_size or 1000)
+        if not rows:
+          return
+        for row in rows:
+          yield event_from_row(row)
+    finally:
+      conn.close()
+
+  def fetch_snapshot(self, user_id) -> Snapshot:
+    row = self.db.connection().execute(
+      "SELECT version, snapshot FROM snapshots WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    return snapshot_from_row(user_id, *row) if row else None
+
+  def save_snapshot(self, aggregate: UserAvailabilityAggregate):
+    if not self.snapshot_policy.should_snapshot(aggregate):
+      return
+
+    snapshot = aggregate.snapshot()
+    conn = self.db.connection()
+    with conn:
+      # never let a slow writer replace a newer snapshot with an older one
+      conn.execute(
+        """
+        INSERT INTO snapshots (user_id, version, snapshot) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET version = excluded.version, snapshot = excluded.snapshot
+        WHERE excluded.version > snapshots.version
+        """,
+        (snapshot.user_id, snapshot.version, snapshot_to_json(snapshot))
+      )
+    aggregate.snapshot_version = snapshot.version
+
+
+class SqliteAvailabilityRepo(AvailabilityRepo):
+  """
+  Rows carry the version of the last change projected onto them like the
+  DynamoDB read model. Deleted rows are kept as tombstones, which SQLite
+  does not expire.
+  """
+  def __init__(self, db: SqliteDatabase, page_size: int = None):
+    self.db = db
+    self.page_size = page_size
+
+  def fetch(self, start, end=None, user_id=None, page_size: int = None, limit: int = None) -> Iterator[Availability]:
+    where, params = ["deleted = 0", "available_at >= ?"], [start.isoformat()]
+    if end:
+      where.append("available_at < ?")
+      params.append(end.isoformat())
+    if user_id:
+      where.append("user_id = ?")
+      params.append(user_id)
+    elif not end:
+      raise ValueError("fetching availability of all users requires an end")
+
+    sql = f"SELECT user_id, available_at, appointment_id FROM availability WHERE {' AND '.join(where)} ORDER BY available_at, user_id"
+    if limit:
+      sql += f" LIMIT {int(limit)}"
+
+    cursor = self.db.connection().execute(sql, params)
+    page_size = page_size or self.page_size or 1000
+    while True:
+      rows = cursor.fetchmany(page_size)
+      if not rows:
+        return
+      for user_id, available_at, appointment_id in rows:
+        yield Availability(user_id=user_id, available_at=from_isodatetime(available_at), appointment_id=appointment_id)
+
+  def create(self, availability: Availability):
+    conn = self.db.connection()
+    with conn:
+      conn.execute(
+        "INSERT OR REPLACE INTO availability (user_id, available_at, appointment_id) VALUES (?, ?, ?)",
+        (availability.user_id, availability.available_at.isoformat(), availability.appointment_id)
+      )
+
+  def update(self, availability: Availability):
+    self.create(availability)
+
+  def delete(self, availability: Availability):
+    conn = self.db.connection()
+    with conn:
+      conn.execute(
+        "DELETE FROM availability WHERE user_id = ? AND available_at = ?",
+        (availability.user_id, availability.available_at.isoformat())
+      )
+
+  def project(self, change: AvailabilityChange) -> str:
+    conn = self.db.connection()
+    with conn:
+      return self._project(conn, change)
+
+  def project_batch(self, changes: List[AvailabilityChange], conditional: bool = True) -> List[str]:
+    """
+    Writes all changes in one transaction, which is what makes bulk
+    projection fast in SQLite.
+    """
+    conn = self.db.connection()
+    with conn:
+      if conditional:
+        return [self._project(conn, change) for change in changes]
+
+      conn.executemany(
+        "INSERT OR REPLACE INTO availability (user_id, available_at, appointment_id, version, deleted) VALUES (?, ?, ?, ?, ?)",
+        [change_to_row(change) for change in changes]
+      )
+      return [APPLIED] * len(changes)
+
+  def stamp(self, user_id: str, version: int):
+    conn = self.db.connection()
+    with conn:
+      conn.execute(
+        """
+        INSERT INTO availability_stamps (user_id, version) VALUES (?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET version = excluded.version
+        WHERE excluded.version > availability_stamps.version
+        """,
+        (user_id, version)
+      )
+
+  def fetch_stamp(self, user_id: str) -> int:
+    row = self.db.connection().execute("SELECT version FROM availability_stamps WHERE user_id = ?", (user_id,)).fetchone()
+    return row[0] if row else None
+
+  def _project(self, conn: sqlite3.Connection, change: AvailabilityChange) -> str:
+    row = change_to_row(change)
+    cursor = conn.execute(
+      """
+      INSERT INTO availability (user_id, available_at, appointment_id, version, deleted) VALUES (?, ?, ?, ?, ?)
+      ON CONFLICT (user_id, available_at) DO UPDATE SET
+        appointment_id = excluded.appointment_id, version = excluded.version, deleted = excluded.deleted
+      WHERE excluded.version > availability.version
+      """,
+      row
+    )
+    if cursor.rowcount:
+      return APPLIED
+
+    stored = conn.execute(
+      "SELECT version FROM availability WHERE user_id = ? AND available_at = ?", row[:2]
+    ).fetchone()
+    return version_outcome(change.version, stored[0] if stored else None)
+
+
+def change_to_row(change: AvailabilityChange) -> tuple:
+  a = change.availability
+  return (a.user_id, a.available_at.isoformat(), a.appointment_id, change.version, int(change.deleted))
@@ -1 +1,2 @@
 from availability.config.context import *
+from availability.config.ssm import *
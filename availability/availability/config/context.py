@@ -1,11 +1,17 @@
 import os
 
-import boto3
+from typing import Dict
 
 from pydantic import BaseSettings
 
-from availability.ports import AvailabilityRepo, EventStoreRepo
-from availability.adapters import DynamoAvailabilityRepo, DynamoEventStoreRepo
+from availability.config.ssm import fetch_ssm_parameters
+from availability.domain import EveryNEventsSnapshotPolicy
+from availability.ports import AsyncAvailabilityRepo, AsyncEventStoreRepo, AvailabilityRepo, EventStoreRepo
+from availability.service import AggregateCache, AsyncAvailabilityEventHandler, AvailabilityEventHandler, QueryCache
+from availability.utils import metrics
+
+# adapters, and boto3 with them, are imported where a backend is selected so
+# that processes only pay the import time of the backends they use
 
 
 class AppContext(BaseSettings):
@@ -16,6 +22,14 @@ class AppContext(BaseSettings):
   availability_event_store_table: str = "availability-event-store"
   availability_read_model_table: str = "availability-read-model"
 
+  # holds the latest snapshot of each UserAvailabilityAggregate so fetching
+  # only needs to replay events committed after it
+  availability_snapshot_table: str = "availability-snapshot"
+
+  # number of events committed on top of the last snapshot before a new one
+  # is written, zero disables snapshotting
+  snapshot_interval: int = 100
+
   # This channel would be for events published and available for
   # consumption by other bounded contexts
   availability_channel: str = "availability"
@@ -32,36 +46,402 @@ class AppContext(BaseSettings):
   # used to track progress of kinesis consumer via checkpoints saved to DynamoDB
   availability_consumer_table: str = "availability-consumer"
 
+  # number of cdc records projected to the read model in one bulk write, a
+  # size of one projects each record as it arrives. Batches are cut from the
+  # records of each GetRecords call by a shard worker, which checkpoints them
+  # only after they are written, since the kinesis consumer checkpoints a
+  # record as soon as the next one is pulled.
+  projection_batch_size: int = 1
+
+  # json parser used to decode cdc records: "auto" picks orjson or msgspec
+  # when installed and falls back to "json" from the standard library
+  cdc_decoder: str = "auto"
+
+  # "sync" projects cdc records one at a time (or in batches, see above) while
+  # "async" projects records of different users concurrently, keeping each
+  # user's records in order, with at most projection_max_in_flight pending.
+  # Concurrent writes go through the blocking repo on a thread pool and are
+  # read by a shard worker that checkpoints a GetRecords response only once
+  # all of its writes have completed
+  projection_mode: str = "sync"
+  projection_max_in_flight: int = 64
+
+  # "shards" runs a supervisor spreading the cdc channel's shards over
+  # shard_workers processes (zero uses one per cpu, never more than the open
+  # shards), each checkpointing a shard after checkpoint_every_records records
+  # or checkpoint_every_seconds seconds. Shard workers, which also read the
+  # channel for batched and "async" projection, do not share checkpoints with
+  # the kinesis consumer projecting one record at a time, so switching between
+  # them reads the channel again from TRIM_HORIZON
+  shard_workers: int = 0
+  shard_read_limit: int = 1000
+  shard_check_interval: float = 10.0
+  shard_idle_poll_seconds: float = 1.0
+  checkpoint_every_records: int = 500
+  checkpoint_every_seconds: float = 10.0
+
   # This would be for subscribing to state change events in another bounded context
   # responsible for the management of appointments
   appointments_channel: str = "appointments"
 
+  # worker processes applying the bookings and cancellations read from
+  # appointments_channel, each owning a share of its shards
+  appointment_workers: int = 1
+
   base_uri: str = "/api/v1"
 
+  # number of items requested per read model query page
+  read_model_page_size: int = 100
+
+  # size of the time buckets ("day" or "hour") the read model is indexed by for
+  # availability queries across all users, and how many buckets are queried at once
+  read_model_bucket_granularity: str = "day"
+  read_model_query_workers: int = 8
+
+  # seconds deleted read model rows are kept as tombstones so that late,
+  # stale events for them are recognised and skipped
+  read_model_tombstone_ttl: int = 7 * 24 * 60 * 60
+
+  # bounds for the in-process cache of recently used aggregates, a size
+  # of zero disables caching
+  aggregate_cache_size: int = 1024
+  aggregate_cache_ttl: float = 300.0
+
+  # bounds for the in-process cache of availability query results, a size of
+  # zero disables caching. A user's results are checked against the version
+  # stamp the read model keeps for them before being served, ttl bounds the
+  # staleness of results across users.
+  query_cache_size: int = 4096
+  query_cache_ttl: float = 5.0
+
+  # projects the events of each command to the read model before the command
+  # returns, so a writer's next query sees its own writes instead of waiting
+  # for them to come through cdc, whose later delivery is then skipped
+  read_your_writes: bool = False
+
+  # writes the events of each commit to an outbox in the same transaction,
+  # from which a relay publishes them to availability_channel in the public
+  # integration event form. The outbox is spread over outbox_segments which
+  # relays can divide among themselves, each sending up to
+  # outbox_batch_size records per PutRecords call
+  outbox_enabled: bool = False
+  availability_outbox_table: str = "availability-outbox"
+  outbox_segments: int = 16
+  outbox_batch_size: int = 500
+
+  # times a command is re-applied to a freshly loaded aggregate when another
+  # writer appended to the same aggregate first
+  command_retries: int = 2
+
+  # store behind event_store_repo and availability_repo: "dynamodb", "sqlite"
+  # with the database file at sqlite_path, or "memory" which keeps all state
+  # in the process
+  repo_backend: str = "dynamodb"
+  sqlite_path: str = "availability.db"
+
+  # backend of the async repositories used by the api, "dynamodb" or "memory"
+  # which keeps all state in the process for load testing
+  api_repo_backend: str = "dynamodb"
+
+  # connections each shared DynamoDB client, the sync one of the context and
+  # the api's async one, keeps open
+  dynamodb_max_pool_connections: int = 100
+
+  # retry behaviour and tcp keep-alive of every boto3 client created from the
+  # context's shared session
+  aws_max_attempts: int = 5
+  aws_retry_mode: str = "standard"
+  aws_tcp_keepalive: bool = True
+
+  # records hot path metrics, served by the api at /metrics and, when
+  # metrics_emf_interval is positive, written to stdout every that many
+  # seconds in CloudWatch embedded metric format under metrics_namespace
+  metrics_enabled: bool = False
+  metrics_emf_interval: float = 0.0
+  metrics_namespace: str = "Availability"
+
   cache: dict = {}
 
+  def start_metrics(self, dimensions: Dict[str, str] = None):
+    """
+    Enables the metrics registry when metrics_enabled. DynamoDB clients
+    created from the shared boto3 session afterwards report consumed
+    capacity and throttles, so this is called before any repo is used.
+    """
+    if not self.metrics_enabled or metrics.REGISTRY.enabled:
+      return
+
+    metrics.REGISTRY.enabled = True
+    if self.repo_backend == "dynamodb":
+      from availability.adapters.dynamodb_repo import instrument_dynamodb
+      instrument_dynamodb(self.boto3_session.events)
+
+    if self.metrics_emf_interval > 0:
+      exporter = metrics.EmfExporter(
+        metrics.REGISTRY,
+        namespace=self.metrics_namespace,
+        interval=self.metrics_emf_interval,
+        dimensions={"env": self.env, **(dimensions or {})}
+      )
+      exporter.start()
+      self.cache["emf_exporter"] = exporter
+
+  def stop_metrics(self):
+    exporter = self.cache.pop("emf_exporter", None)
+    if exporter is not None:
+      exporter.stop()
+
+  @property
+  def boto3_session(self):
+    """
+    The boto3 session all sync clients of the process are created from,
+    sessions are expensive to create and hold the credentials cache.
+    """
+    if "boto3_session" not in self.cache:
+      import boto3
+      self.cache["boto3_session"] = boto3.session.Session(region_name=self.aws_region)
+    return self.cache["boto3_session"]
+
+  @property
+  def client_config_options(self) -> dict:
+    """
+    Options of the botocore Config of every sync client and of the AioConfig
+    of the api's async DynamoDB client.
+    """
+    return {
+      "max_pool_connections": self.dynamodb_max_pool_connections,
+      "tcp_keepalive": self.aws_tcp_keepalive,
+      "retries": {"max_attempts": self.aws_max_attempts, "mode": self.aws_retry_mode},
+    }
+
+  @property
+  def boto3_config(self):
+    if "boto3_config" not in self.cache:
+      from botocore.config import Config
+      self.cache["boto3_config"] = Config(**self.client_config_options)
+    return self.cache["boto3_config"]
+
+  @property
+  def dynamodb(self):
+    """
+    DynamoDB resource shared by every repo and checkpointer of the process,
+    so their requests reuse one pool of connections.
+    """
+    if "dynamodb" not in self.cache:
+      self.cache["dynamodb"] = self.boto3_session.resource('dynamodb', config=self.boto3_config)
+    return self.cache["dynamodb"]
+
+  def aws_client(self, service_name: str):
+    key = f"{service_name}_client"
+    if key not in self.cache:
+      self.cache[key] = self.boto3_session.client(service_name, config=self.boto3_config)
+    return self.cache[key]
+
   @property
   def event_store_repo(self) -> EventStoreRepo:
     if "event_store_repo" in self.cache:
       return self.cache["event_store_repo"]
 
-    ddb = boto3.resource('dynamodb', region_name=self.aws_region)
+    snapshot_policy = EveryNEventsSnapshotPolicy(self.snapshot_interval) if self.snapshot_interval > 0 else None
+    if self.repo_backend == "memory":
+      from availability.adapters.memory_repo import InMemoryEventStoreRepo
+      self.cache["event_store_repo"] = InMemoryEventStoreRepo(snapshot_policy, outbox=self.outbox_repo)
+      return self.cache["event_store_repo"]
+    if self.repo_backend == "sqlite":
+      from availability.adapters.sqlite_repo import SqliteEventStoreRepo
+      self.cache["event_store_repo"] = SqliteEventStoreRepo(self.sqlite_db, snapshot_policy, outbox=self.outbox_repo)
+      return self.cache["event_store_repo"]
+    self._check_repo_backend()
+
+    from availability.adapters.dynamodb_repo import DynamoEventStoreRepo
+    ddb = self.dynamodb
+    snapshot_table = ddb.Table(self.availability_snapshot_table) if snapshot_policy else None
+
     self.cache["event_store_repo"] = DynamoEventStoreRepo(
-      ddb.Table(self.availability_event_store_table)
+      ddb.Table(self.availability_event_store_table),
+      snapshot_table=snapshot_table,
+      snapshot_policy=snapshot_policy,
+      outbox=self.outbox_repo
     )
     return self.cache["event_store_repo"]
 
+  @property
+  def outbox_repo(self):
+    if not self.outbox_enabled:
+      return None
+    if "outbox_repo" in self.cache:
+      return self.cache["outbox_repo"]
+
+    if self.repo_backend == "memory":
+      from availability.adapters.memory_repo import InMemoryOutboxRepo
+      self.cache["outbox_repo"] = InMemoryOutboxRepo(self.outbox_segments)
+      return self.cache["outbox_repo"]
+    if self.repo_backend == "sqlite":
+      from availability.adapters.sqlite_repo import SqliteOutboxRepo
+      self.cache["outbox_repo"] = SqliteOutboxRepo(self.sqlite_db, self.outbox_segments)
+      return self.cache["outbox_repo"]
+    self._check_repo_backend()
+
+    from availability.adapters.dynamodb_repo import DynamoOutboxRepo
+    self.cache["outbox_repo"] = DynamoOutboxRepo(
+      self.dynamodb.Table(self.availability_outbox_table),
+      segments=self.outbox_segments
+    )
+    return self.cache["outbox_repo"]
+
   @property
   def availability_repo(self) -> AvailabilityRepo:
     if "availability_repo" in self.cache:
       return self.cache["availability_repo"]
 
-    ddb = boto3.resource('dynamodb', region_name=self.aws_region)
+    if self.repo_backend == "memory":
+      from availability.adapters.memory_repo import InMemoryAvailabilityRepo
+      self.cache["availability_repo"] = InMemoryAvailabilityRepo()
+      return self.cache["availability_repo"]
+    if self.repo_backend == "sqlite":
+      from availability.adapters.sqlite_repo import SqliteAvailabilityRepo
+      self.cache["availability_repo"] = SqliteAvailabilityRepo(self.sqlite_db, page_size=self.read_model_page_size)
+      return self.cache["availability_repo"]
+    self._check_repo_backend()
+
+    from availability.adapters.dynamodb_repo import DynamoAvailabilityRepo
     self.cache["availability_repo"] = DynamoAvailabilityRepo(
-      ddb.Table(self.availability_read_model_table)
+      self.dynamodb.Table(self.availability_read_model_table),
+      page_size=self.read_model_page_size,
+      bucket_granularity=self.read_model_bucket_granularity,
+      max_workers=self.read_model_query_workers,
+      tombstone_ttl=self.read_model_tombstone_ttl
     )
     return self.cache["availability_repo"]
 
+  @property
+  def sqlite_db(self):
+    if "sqlite_db" not in self.cache:
+      from availability.adapters.sqlite_repo import SqliteDatabase
+      self.cache["sqlite_db"] = SqliteDatabase(self.sqlite_path)
+    return self.cache["sqlite_db"]
+
+  def _check_repo_backend(self):
+    if self.repo_backend != "dynamodb":
+      raise ValueError(f"unsupported repo backend {self.repo_backend}")
+
+  async def open_async_repos(self):
+    """
+    Creates the async repositories, opening the pooled DynamoDB client they
+    share, to be called once on startup of the event loop that uses them.
+    """
+    if "async_event_store_repo" in self.cache:
+      return
+
+    snapshot_policy = EveryNEventsSnapshotPolicy(self.snapshot_interval) if self.snapshot_interval > 0 else None
+    if self.api_repo_backend == "memory":
+      from availability.adapters.memory_repo import (
+        AsyncInMemoryAvailabilityRepo,
+        AsyncInMemoryEventStoreRepo,
+        InMemoryAvailabilityRepo,
+        InMemoryEventStoreRepo,
+        InMemoryOutboxRepo,
+      )
+      if self.repo_backend == "memory":
+        # the sync repos of the process, so commits reach the outbox its relay
+        # publishes from and the read model its projections write
+        event_store_repo, availability_repo = self.event_store_repo, self.availability_repo
+      else:
+        outbox = InMemoryOutboxRepo(self.outbox_segments) if self.outbox_enabled else None
+        event_store_repo = InMemoryEventStoreRepo(snapshot_policy, outbox=outbox)
+        availability_repo = InMemoryAvailabilityRepo()
+      self.cache["async_event_store_repo"] = AsyncInMemoryEventStoreRepo(event_store_repo)
+      self.cache["async_availability_repo"] = AsyncInMemoryAvailabilityRepo(availability_repo)
+      return
+    if self.api_repo_backend != "dynamodb":
+      raise ValueError(f"unsupported api repo backend {self.api_repo_backend}")
+
+    from availability.adapters.aiodynamodb_repo import (
+      AsyncDynamoAvailabilityRepo,
+      AsyncDynamoEventStoreRepo,
+      AsyncDynamoResource,
+    )
+    dynamodb = AsyncDynamoResource(self.aws_region, **self.client_config_options)
+    await dynamodb.open()
+    self.cache["async_dynamodb"] = dynamodb
+    self.cache["async_event_store_repo"] = AsyncDynamoEventStoreRepo(
+      await dynamodb.table(self.availability_event_store_table),
+      snapshot_table=await dynamodb.table(self.availability_snapshot_table) if snapshot_policy else None,
+      snapshot_policy=snapshot_policy,
+      outbox_table=await dynamodb.table(self.availability_outbox_table) if self.outbox_enabled else None,
+      outbox_segments=self.outbox_segments
+    )
+    self.cache["async_availability_repo"] = AsyncDynamoAvailabilityRepo(
+      await dynamodb.table(self.availability_read_model_table),
+      page_size=self.read_model_page_size,
+      bucket_granularity=self.read_model_bucket_granularity,
+      max_concurrency=self.read_model_query_workers,
+      tombstone_ttl=self.read_model_tombstone_ttl
+    )
+
+  async def close_async_repos(self):
+    self.cache.pop("async_commit_projector", None)
+    self.cache.pop("async_event_store_repo", None)
+    self.cache.pop("async_availability_repo", None)
+    dynamodb = self.cache.pop("async_dynamodb", None)
+    if dynamodb is not None:
+      await dynamodb.close()
+
+  @property
+  def async_event_store_repo(self) -> AsyncEventStoreRepo:
+    if "async_event_store_repo" not in self.cache:
+      raise RuntimeError("async repositories are not open, call open_async_repos on startup")
+    return self.cache["async_event_store_repo"]
+
+  @property
+  def async_availability_repo(self) -> AsyncAvailabilityRepo:
+    if "async_availability_repo" not in self.cache:
+      raise RuntimeError("async repositories are not open, call open_async_repos on startup")
+    return self.cache["async_availability_repo"]
+
+  @property
+  def commit_projector(self) -> AvailabilityEventHandler:
+    """
+    Handler command handlers pass their committed events to when
+    read_your_writes, None otherwise.
+    """
+    if not self.read_your_writes:
+      return None
+
+    if "commit_projector" not in self.cache:
+      self.cache["commit_projector"] = AvailabilityEventHandler(self.availability_repo, self.query_cache)
+    return self.cache["commit_projector"]
+
+  @property
+  def async_commit_projector(self) -> AsyncAvailabilityEventHandler:
+    if not self.read_your_writes:
+      return None
+
+    if "async_commit_projector" not in self.cache:
+      self.cache["async_commit_projector"] = AsyncAvailabilityEventHandler(self.async_availability_repo, self.query_cache)
+    return self.cache["async_commit_projector"]
+
+  @property
+  def aggregate_cache(self) -> AggregateCache:
+    if self.aggregate_cache_size <= 0:
+      return None
+
+    if "aggregate_cache" not in self.cache:
+      self.cache["aggregate_cache"] = AggregateCache(
+        max_size=self.aggregate_cache_size,
+        ttl=self.aggregate_cache_ttl
+      )
+    return self.cache["aggregate_cache"]
+
+  @property
+  def query_cache(self) -> QueryCache:
+    if self.query_cache_size <= 0:
+      return None
+
+    if "query_cache" not in self.cache:
+      self.cache["query_cache"] = QueryCache(max_size=self.query_cache_size, ttl=self.query_cache_ttl)
+    return self.cache["query_cache"]
+
 
 def configure(**kwargs):
   """
@@ -78,7 +458,7 @@ def configure(**kwargs):
             if k.lower().startswith(ssm_prefix) }
 
   # add any aws overrides from **kwargs
-  for key in kwargs.keys():
+  for key in list(kwargs.keys()):
     if key.lower().startswith(ssm_prefix):
       ssm_key = key.lower()[ssm_prefix_n:]
       awsenv[ssm_key] = kwargs.pop(key)
@@ -88,14 +468,17 @@ def configure(**kwargs):
   if not aws_ssm_fields:
       return AppContext(**kwargs)
 
-  ssm = boto3.client('ssm')
-  overrides = {}
-  for field in aws_ssm_fields:
-      response = ssm.get_parameter(Name=awsenv[field])
-      overrides[normalized_fields[field]] = response['Parameter']['Value']
+  # parameters are fetched with a client of the boto3 session the configured
+  # context goes on to create every other client from
+  ctx = AppContext(**kwargs)
+  parameters = fetch_ssm_parameters((awsenv[field] for field in aws_ssm_fields), ctx.aws_client('ssm'))
+  overrides = {normalized_fields[field]: parameters[awsenv[field]] for field in aws_ssm_fields}
 
   # add any remaining overrides from **kwargs
   for key, value in kwargs.items():
     overrides[key] = value
 
-  return AppContext(**overrides)
+  configured = AppContext(**overrides)
+  if configured.aws_region == ctx.aws_region:
+    configured.cache.update(ctx.cache)
+  return configured
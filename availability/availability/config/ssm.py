@@ -0,0 +1,54 @@
+from time import monotonic
+from typing import Dict, Iterable, Tuple
+
+
+# most parameters a single get_parameters call accepts
+SSM_BATCH_SIZE = 10
+
+# seconds fetched parameter values are reused by later calls in the same
+# process, e.g. warm Lambda invocations or shard workers configuring again
+SSM_CACHE_TTL = 300.0
+
+_cache: Dict[str, Tuple[str, float]] = {}
+
+
+def fetch_ssm_parameters(names: Iterable[str], ssm, clock=monotonic) -> Dict[str, str]:
+  """
+  Values of the SSM parameters names, keyed by name. Parameters not cached
+  are fetched SSM_BATCH_SIZE at a time with one get_parameters call each
+  made with the ssm client.
+  """
+  now = clock()
+  values = {}
+  missing = []
+  for name in dict.fromkeys(names):
+    cached = _cache.get(name)
+    if cached is not None and cached[1] > now:
+      values[name] = cached[0]
+    else:
+      missing.append(name)
+
+  if not missing:
+    return values
+
+  for i in range(0, len(missing), SSM_BATCH_SIZE):
+    batch = missing[i:i + SSM_BATCH_SIZE]
+    response = ssm.get_parameters(Names=batch)
+    if response.get('InvalidParameters'):
+      raise ValueError(f"ssm parameters not found: {', '.join(response['InvalidParameters'])}")
+
+    for parameter in response['Parameters']:
+      # parameters requested by version or label are returned by bare name
+      # with the selector alongside
+      name = parameter['Name'] + parameter.get('Selector', '')
+      values[name] = parameter['Value']
+      _cache[name] = (parameter['Value'], now + SSM_CACHE_TTL)
+
+  not_returned = [name for name in missing if name not in values]
+  if not_returned:
+    raise ValueError(f"ssm parameters not returned: {', '.join(not_returned)}")
+  return values
+
+
+def clear_ssm_cache():
+  _cache.clear()
@@ -2,3 +2,4 @@ from availability.domain.command import *
 from availability.domain.event import *
 from availability.domain.exception import *
 from availability.domain.model import *
+from availability.domain.snapshot import *
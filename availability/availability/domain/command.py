@@ -3,28 +3,30 @@ from dataclasses import dataclass
 from datetime import datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class Command:
   correlation_id: str
   user_id: str
   available_at: datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class CreateAvailabilityCommand(Command):
   appointment_id: str = None
 
 
-@dataclass
+@dataclass(slots=True)
 class AddAppointmentCommand(Command):
   appointment_id: str
 
 
-@dataclass
+@dataclass(slots=True)
 class RemoveAppointmentCommand(Command):
-  pass
+  # appointment the sender expects the slot to hold, lets consumers of
+  # cancellations recognise ones the slot has moved on from
+  appointment_id: str = None
 
 
-@dataclass
+@dataclass(slots=True)
 class DeleteAvailabilityCommand(Command):
   pass
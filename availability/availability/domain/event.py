@@ -2,7 +2,7 @@ from dataclasses import dataclass
 from datetime import datetime
 
 
-@dataclass
+@dataclass(slots=True)
 class Event:
   event_id: str
   user_id: str
@@ -12,22 +12,37 @@ class Event:
   correlation_id: str
   version: int = 0
 
-
-@dataclass
+  def to_dict(self) -> dict:
+    """
+    Shallow counterpart of dataclasses.asdict, the payload only holds scalars
+    so copying it is enough.
+    """
+    return {
+      "event_id": self.event_id,
+      "user_id": self.user_id,
+      "created": self.created,
+      "event_type": self.event_type,
+      "event_payload": dict(self.event_payload),
+      "correlation_id": self.correlation_id,
+      "version": self.version,
+    }
+
+
+@dataclass(slots=True)
 class AvailabilityCreatedEvent(Event):
   pass
 
 
-@dataclass
+@dataclass(slots=True)
 class AvailabilityDeletedEvent(Event):
   pass
 
 
-@dataclass
+@dataclass(slots=True)
 class AppointmentAddedEvent(Event):
   pass
 
 
-@dataclass
+@dataclass(slots=True)
 class AppointmentRemovedEvent(Event):
   pass
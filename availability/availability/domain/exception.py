@@ -9,3 +9,15 @@ class AvailabilityExistsException(RuntimeError):
 
 class AvailabilityNotExistsException(RuntimeError):
   pass
+
+
+class ConcurrencyException(RuntimeError):
+  pass
+
+
+class EventVersionGapException(RuntimeError):
+  pass
+
+
+class TooManyEventsException(RuntimeError):
+  pass
@@ -1,134 +1,183 @@
-from dataclasses import asdict, dataclass
+from bisect import bisect_left, insort
+from dataclasses import dataclass
 from datetime import datetime
-from typing import List
+from typing import Dict, List
 
 from uuid import uuid4
 
 from availability.domain.command import CreateAvailabilityCommand, DeleteAvailabilityCommand, AddAppointmentCommand, RemoveAppointmentCommand
-from availability.domain.exception import AvailabilityExistsException, AvailabilityNotExistsException
+from availability.domain.exception import (
+  AvailabilityExistsException,
+  AvailabilityNotExistsException,
+  EventVersionGapException,
+)
 from availability.domain.event import Event, AvailabilityCreatedEvent, AvailabilityDeletedEvent, AppointmentAddedEvent, AppointmentRemovedEvent
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Availability:
   user_id: str
   available_at: datetime
   appointment_id: str
 
+  def to_dict(self) -> dict:
+    return {"user_id": self.user_id, "available_at": self.available_at, "appointment_id": self.appointment_id}
+
+
+@dataclass(slots=True)
+class Snapshot:
+  user_id: str
+  version: int
+  start: datetime
+  availability: List[Availability]
+
 
 class UserAvailabilityAggregate:
-  def __init__(self, user_id: str, start: datetime = None, events: List[Event] = None, version: int = 0):
+  def __init__(self, user_id: str, start: datetime = None, events: List[Event] = None, version: int = 0, snapshot: Snapshot = None):
     self.user_id = user_id
     self.start = start
     self.events = sorted(events or [], key=lambda e: e.created)
     self.uncommitted_events: List[Event] = []
     self.version = version
+    self.snapshot_version = 0
+
+    # slots keyed by available_at plus their keys in ascending order so
+    # lookups are constant time and ordered iteration never has to sort
+    self._availability: Dict[datetime, Availability] = {}
+    self._available_ats: List[datetime] = []
+    if snapshot is not None:
+      self.start = snapshot.start
+      self.version = self.snapshot_version = snapshot.version
+      self._availability = {a.available_at: a for a in snapshot.availability}
+      self._available_ats = sorted(self._availability)
 
-    self._availability: List[Availability] = []
     self.replay_events()
 
   def dict(self):
     return {
       "user_id": self.user_id,
       "start": self.start,
-      "events": [asdict(e) for e in self.events],
-      "uncommitted_events": [asdict(e) for e in self.uncommitted_events],
+      "events": [e.to_dict() for e in self.events],
+      "uncommitted_events": [e.to_dict() for e in self.uncommitted_events],
       "version": self.version,
-      "availability": [asdict(a) for a in self.availability]
+      "availability": [a.to_dict() for a in self.availability]
     }
 
+  def snapshot(self) -> Snapshot:
+    return Snapshot(
+      user_id=self.user_id,
+      version=self.version,
+      start=self.start,
+      availability=self.availability
+    )
+
   @property
   def availability(self) -> List[Availability]:
-    return sorted(self._availability, key=lambda a:a.available_at)
+    return [self._availability[available_at] for available_at in self._available_ats]
 
   def replay_events(self):
-    for event in self.events:
-      self.user_id = event.user_id
+    self._replay(self.events)
+
+  def apply_events(self, events: List[Event]):
+    """
+    Catches the aggregate up with events committed after its current version,
+    applied in version order. Raises EventVersionGapException, leaving the
+    aggregate unchanged, unless their versions follow on from it without gaps.
+    """
+    events = sorted(events, key=lambda e: e.version)
+    versions = [e.version for e in events]
+    if versions != list(range(self.version + 1, self.version + 1 + len(events))):
+      raise EventVersionGapException(f"events {versions} of {self.user_id} do not follow on from version {self.version}")
+    self.events.extend(events)
+    self._replay(events)
+
+  def _replay(self, events: List[Event]):
+    # applies stored events directly to state, they were validated when the
+    # commands that raised them were handled so nothing is re-checked here
+    appliers = self._appliers
+    for event in events:
+      apply = appliers.get(event.event_type)
+      if apply is not None:
+        apply(self, event.event_payload)
       self.version = event.version
-      data = event.event_payload
-      common = {"correlation_id": event.correlation_id, "user_id": event.user_id, "available_at": data["available_at"]}
-      if event.event_type == AvailabilityCreatedEvent.__name__:
-        self.add_availability(CreateAvailabilityCommand(appointment_id=data["appointment_id"], **common))
-      elif event.event_type == AvailabilityDeletedEvent.__name__:
-        self.delete_availability(DeleteAvailabilityCommand(**common))
-      elif event.event_type == AppointmentAddedEvent.__name__:
-        self.add_appointment(AddAppointmentCommand(appointment_id=data["appointment_id"], **common))
-      elif event.event_type == AppointmentRemovedEvent.__name__:
-        self.remove_appointment(RemoveAppointmentCommand(**common))
+
+    if events:
+      self.user_id = events[-1].user_id
     self.uncommitted_events.clear()
 
+  def _apply_availability_created(self, payload: dict):
+    availability = Availability(**payload)
+    self._insert(availability)
+    if self.start is None or self.start > availability.available_at:
+      self.start = availability.available_at
+
+  def _apply_availability_deleted(self, payload: dict):
+    available_at = payload["available_at"]
+    self.find_availability(available_at, raise_error=True)
+    del self._availability[available_at]
+    del self._available_ats[bisect_left(self._available_ats, available_at)]
+
+  def _apply_appointment_changed(self, payload: dict):
+    availability = Availability(**payload)
+    self.find_availability(availability.available_at, raise_error=True)
+    self._availability[availability.available_at] = availability
+
+  _appliers = {
+    AvailabilityCreatedEvent.__name__: _apply_availability_created,
+    AvailabilityDeletedEvent.__name__: _apply_availability_deleted,
+    AppointmentAddedEvent.__name__: _apply_appointment_changed,
+    AppointmentRemovedEvent.__name__: _apply_appointment_changed,
+  }
+
+  def _raise_event(self, event_cls, availability: Availability, correlation_id: str):
+    event = event_cls(
+      event_id=str(uuid4()),
+      user_id=self.user_id,
+      created=datetime.now(),
+      event_type=event_cls.__name__,
+      event_payload=availability.to_dict(),
+      correlation_id=correlation_id
+    )
+    self._appliers[event.event_type](self, event.event_payload)
+    self.uncommitted_events.append(event)
+
   def find_availability(self, available_at: datetime, raise_error=False):
-    availability = None
-    for a in self._availability:
-      if a.available_at == available_at:
-        availability = a
-        break
+    availability = self._availability.get(available_at)
     if not availability and raise_error:
       raise AvailabilityNotExistsException(f"Availability {available_at} does not exist for user {self.user_id}")
 
     return availability
 
+  def _insert(self, availability: Availability):
+    available_at = availability.available_at
+    self._availability[available_at] = availability
+    # slots are usually published in chronological order so appending is the common case
+    if not self._available_ats or self._available_ats[-1] < available_at:
+      self._available_ats.append(available_at)
+    else:
+      insort(self._available_ats, available_at)
+
   def add_availability(self, cmd: CreateAvailabilityCommand):
     availability = self.find_availability(cmd.available_at)
     if availability:
       raise AvailabilityExistsException(f"Availability {cmd.available_at} for user {self.user_id} exists already")
 
     availability = Availability(available_at=cmd.available_at, appointment_id=cmd.appointment_id, user_id=cmd.user_id)
-    self._availability.append(availability)
-    self.uncommitted_events.append(AvailabilityCreatedEvent(
-      event_id=str(uuid4()),
-      user_id=self.user_id,
-      created=datetime.now(),
-      event_type=AvailabilityCreatedEvent.__name__,
-      event_payload=asdict(availability),
-      correlation_id=cmd.correlation_id
-    ))
-
-    if self.start is None or self.start > cmd.available_at:
-      self.start = cmd.available_at
+    self._raise_event(AvailabilityCreatedEvent, availability, cmd.correlation_id)
 
     if availability.appointment_id:
       self.add_appointment(cmd)
 
   def delete_availability(self, cmd: DeleteAvailabilityCommand):
     availability = self.find_availability(cmd.available_at, raise_error=True)
-
-    self._availability.remove(availability)
-    self.uncommitted_events.append(AvailabilityDeletedEvent(
-      event_id=str(uuid4()),
-      user_id=self.user_id,
-      created=datetime.now(),
-      event_type=AvailabilityDeletedEvent.__name__,
-      event_payload=asdict(availability),
-      correlation_id=cmd.correlation_id
-    ))
+    self._raise_event(AvailabilityDeletedEvent, availability, cmd.correlation_id)
 
   def add_appointment(self, cmd: AddAppointmentCommand):
-    orig_availability = self.find_availability(cmd.available_at, raise_error=True)
-    i = self._availability.index(orig_availability)
+    self.find_availability(cmd.available_at, raise_error=True)
     availability = Availability(available_at=cmd.available_at, appointment_id=cmd.appointment_id, user_id=cmd.user_id)
-    self._availability[i] = availability
-
-    self.uncommitted_events.append(AppointmentAddedEvent(
-      event_id=str(uuid4()),
-      user_id=self.user_id,
-      created=datetime.now(),
-      event_type=AppointmentAddedEvent.__name__,
-      event_payload=asdict(availability),
-      correlation_id=cmd.correlation_id
-    ))
+    self._raise_event(AppointmentAddedEvent, availability, cmd.correlation_id)
 
   def remove_appointment(self, cmd: RemoveAppointmentCommand):
-    orig_availability = self.find_availability(cmd.available_at, raise_error=True)
-    i = self._availability.index(orig_availability)
+    self.find_availability(cmd.available_at, raise_error=True)
     availability = Availability(available_at=cmd.available_at, appointment_id=None, user_id=cmd.user_id)
-    self._availability[i] = availability
-
-    self.uncommitted_events.append(AppointmentRemovedEvent(
-      event_id=str(uuid4()),
-      user_id=self.user_id,
-      created=datetime.now(),
-      event_type=AppointmentRemovedEvent.__name__,
-      event_payload=asdict(availability),
-      correlation_id=cmd.correlation_id
-    ))
+    self._raise_event(AppointmentRemovedEvent, availability, cmd.correlation_id)
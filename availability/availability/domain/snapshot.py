@@ -0,0 +1,28 @@
+from abc import ABC, abstractmethod
+
+from availability.domain.model import UserAvailabilityAggregate
+
+
+class SnapshotPolicy(ABC):
+  @abstractmethod
+  def should_snapshot(self, aggregate: UserAvailabilityAggregate) -> bool:
+    pass
+
+
+class NeverSnapshotPolicy(SnapshotPolicy):
+  def should_snapshot(self, aggregate: UserAvailabilityAggregate) -> bool:
+    return False
+
+
+class EveryNEventsSnapshotPolicy(SnapshotPolicy):
+  """
+  Requests a new snapshot once at least n events have been committed
+  on top of the snapshot the aggregate was loaded from.
+  """
+  def __init__(self, n: int):
+    if n < 1:
+      raise ValueError(f"snapshot interval must be positive, got {n}")
+    self.n = n
+
+  def should_snapshot(self, aggregate: UserAvailabilityAggregate) -> bool:
+    return aggregate.version - aggregate.snapshot_version >= self.n
@@ -1 +1,3 @@
 from availability.ports.repo import *
+from availability.ports.async_repo import *
+from availability.ports.outbox import *
@@ -0,0 +1,71 @@
+from abc import ABC, abstractmethod
+from typing import List
+
+from availability.domain.event import Event
+from availability.domain.model import Availability, UserAvailabilityAggregate
+from availability.ports.repo import AvailabilityChange, APPLIED
+
+
+class AsyncEventStoreRepo(ABC):
+  """
+  Non-blocking counterpart of EventStoreRepo for use from the event loop.
+  """
+  @abstractmethod
+  async def fetch(self, user_id) -> UserAvailabilityAggregate:
+    pass
+
+  @abstractmethod
+  async def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    pass
+
+  @abstractmethod
+  async def append(self, events: List[Event]):
+    """
+    Atomically appends events to the store, raising ConcurrencyException if
+    any of their versions has already been written by another writer.
+    """
+    pass
+
+  async def save(self, event: Event):
+    await self.append([event])
+
+  async def save_snapshot(self, aggregate: UserAvailabilityAggregate):
+    pass
+
+
+class AsyncAvailabilityRepo(ABC):
+  """
+  Non-blocking counterpart of AvailabilityRepo for use from the event loop.
+  """
+  @abstractmethod
+  async def fetch(self, start, end=None, user_id=None, page_size: int = None, limit: int = None) -> List[Availability]:
+    pass
+
+  @abstractmethod
+  async def create(self, availability: Availability):
+    pass
+
+  @abstractmethod
+  async def update(self, availability: Availability):
+    pass
+
+  @abstractmethod
+  async def delete(self, availability: Availability):
+    pass
+
+  async def project(self, change: AvailabilityChange) -> str:
+    """
+    Writes a change unless the row already reflects the same or a later
+    version, returning APPLIED, SKIPPED_DUPLICATE or SKIPPED_STALE.
+    """
+    if change.deleted:
+      await self.delete(change.availability)
+    else:
+      await self.update(change.availability)
+    return APPLIED
+
+  async def stamp(self, user_id: str, version: int):
+    pass
+
+  async def fetch_stamp(self, user_id: str) -> int:
+    return None
@@ -0,0 +1,56 @@
+import zlib
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Tuple
+
+
+@dataclass
+class OutboxEntry:
+  """
+  The events of one commit awaiting publication to the integration channel,
+  written atomically with them and keyed by user and the version of the
+  commit's first event.
+  """
+  user_id: str
+  version: int
+  created: datetime
+  events: list
+
+  @property
+  def key(self) -> Tuple[str, int]:
+    return (self.user_id, self.version)
+
+  @classmethod
+  def of_commit(cls, events: list) -> "OutboxEntry":
+    return cls(user_id=events[0].user_id, version=events[0].version, created=datetime.now(), events=list(events))
+
+
+def outbox_segment(user_id: str, segments: int) -> int:
+  """
+  Segment holding the outbox entries of user_id. All of a user's entries
+  share one so that a single relay publishes them, in order.
+  """
+  return zlib.crc32(user_id.encode("utf-8")) % segments
+
+
+class OutboxRepo(ABC):
+  """
+  Entries are written by an EventStoreRepo in the same atomic write as the
+  events they hold and are removed once published. They are spread over
+  segments which relays can divide among themselves.
+  """
+  segments: int = 1
+
+  @abstractmethod
+  def fetch_pending(self, segment: int, limit: int, after: Tuple[str, int] = None) -> List[OutboxEntry]:
+    """
+    Up to limit entries of segment ordered by key, starting after the key
+    given in after.
+    """
+    pass
+
+  @abstractmethod
+  def delete(self, entries: List[OutboxEntry]):
+    pass
@@ -1,24 +1,81 @@
 
 from abc import ABC, abstractmethod
-from typing import List
+from dataclasses import dataclass
+from typing import Dict, Iterator, List
 
 from availability.domain.event import Event
 from availability.domain.model import Availability, UserAvailabilityAggregate
 
 
+# most events an EventStoreRepo must accept in one atomic append, the limit
+# of a DynamoDB transaction less the item taken by the commit's outbox entry
+MAX_APPEND_EVENTS = 99
+
+# outcomes of projecting a change to the read model
+APPLIED = "applied"
+SKIPPED_DUPLICATE = "skipped_duplicate"
+SKIPPED_STALE = "skipped_stale"
+
+
+def version_outcome(version: int, stored_version) -> str:
+  """
+  Outcome of projecting a change of the given version onto a row last
+  written at stored_version, None when there is no row.
+  """
+  if stored_version is None or int(stored_version) < version:
+    return APPLIED
+  if int(stored_version) == version:
+    return SKIPPED_DUPLICATE
+  return SKIPPED_STALE
+
+
+@dataclass
+class AvailabilityChange:
+  """
+  State of a read model row after the event with the given aggregate version.
+  """
+  availability: Availability
+  version: int
+  deleted: bool = False
+
+
 class EventStoreRepo(ABC):
   @abstractmethod
   def fetch(self, user_id) -> UserAvailabilityAggregate:
     pass
 
   @abstractmethod
+  def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    pass
+
+  @abstractmethod
+  def append(self, events: List[Event]):
+    """
+    Atomically appends events to the store, raising ConcurrencyException if
+    any of their versions has already been written by another writer.
+    """
+    pass
+
   def save(self, event: Event):
+    self.append([event])
+
+  @abstractmethod
+  def scan_events(self, segment: int, total_segments: int, after: Dict = None, page_size: int = None) -> Iterator[Event]:
+    """
+    Yields every stored event in one of total_segments disjoint segments of
+    the store. All events of a user fall in the same segment and are yielded
+    contiguously in version order. Scanning resumes after the event whose
+    user_id and version are given in after.
+    """
+    pass
+
+  def save_snapshot(self, aggregate: UserAvailabilityAggregate):
     pass
 
 
 class AvailabilityRepo(ABC):
   @abstractmethod
-  def fetch(self, start, end=None, user_id=None) -> List[Availability]:
+  def fetch(self, start, end=None, user_id=None, page_size: int = None, limit: int = None) -> Iterator[Availability]:
     pass
 
   @abstractmethod
@@ -32,3 +89,32 @@ class AvailabilityRepo(ABC):
   @abstractmethod
   def delete(self, availability: Availability):
     pass
+
+  def project(self, change: AvailabilityChange) -> str:
+    """
+    Writes a change unless the row already reflects the same or a later
+    version, returning APPLIED, SKIPPED_DUPLICATE or SKIPPED_STALE.
+    """
+    if change.deleted:
+      self.delete(change.availability)
+    else:
+      self.update(change.availability)
+    return APPLIED
+
+  def project_batch(self, changes: List[AvailabilityChange], conditional: bool = True) -> List[str]:
+    return [self.project(change) for change in changes]
+
+  def stamp(self, user_id: str, version: int):
+    """
+    Raises the version stamp of the user's rows to version unless it is
+    already higher.
+    """
+    pass
+
+  def fetch_stamp(self, user_id: str) -> int:
+    """
+    Highest version projected onto the user's rows, kept in the read model
+    itself so every process reads the same stamp. None when the repo keeps
+    no stamps.
+    """
+    return None
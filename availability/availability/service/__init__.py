@@ -1,3 +1,9 @@
-from availability.service.command_handlers import AvailabilityCommandHandler
-from availability.service.event_handlers import AvailabilityEventHandler
-from availability.service.query_service import AvailabilityQueryService
+from availability.service.aggregate_cache import AggregateCache
+from availability.service.query_cache import QueryCache, QueryResult
+from availability.service.command_handlers import AvailabilityCommandHandler, AsyncAvailabilityCommandHandler
+from availability.service.event_handlers import AvailabilityEventHandler, AsyncAvailabilityEventHandler
+from availability.service.query_service import AvailabilityQueryService, AsyncAvailabilityQueryService
+from availability.service.read_model_rebuilder import ReadModelRebuilder, RebuildCheckpoint
+from availability.service.async_projector import AsyncProjector
+from availability.service.outbox_relay import OutboxRelay, integration_event
+from availability.service.appointment_handlers import AppointmentBatchHandler
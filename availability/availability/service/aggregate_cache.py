@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Dict
+
+from availability.domain import EventVersionGapException, UserAvailabilityAggregate
+from availability.ports import AsyncEventStoreRepo, EventStoreRepo
+
+
+class AggregateCache:
+  """
+  Bounded LRU cache of UserAvailabilityAggregate instances keyed by user_id.
+
+  Aggregates are checked out of the cache for the duration of a command
+  so two handlers never mutate the same instance, and are checked back in
+  once their events are committed. A cached aggregate is brought up to date
+  by fetching and applying only the events committed after its version, or
+  is loaded again in full when those events leave a gap in its versions.
+  Cached aggregates keep their state but not their history, their committed
+  events are dropped on checkin so a long lived entry does not grow with
+  every command.
+  """
+  def __init__(self, max_size: int = 1024, ttl: float = 300.0, clock=monotonic):
+    if max_size < 1:
+      raise ValueError(f"cache size must be positive, got {max_size}")
+    self.max_size = max_size
+    self.ttl = ttl
+    self.clock = clock
+
+    self._entries = OrderedDict()
+    self._lock = Lock()
+
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.expirations = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def checkout(self, user_id: str, events_repo: EventStoreRepo) -> UserAvailabilityAggregate:
+    aggregate = self._take(user_id)
+    if aggregate is None:
+      return events_repo.fetch(user_id)
+
+    try:
+      aggregate.apply_events(events_repo.fetch_events(user_id, after_version=aggregate.version))
+    except EventVersionGapException:
+      return events_repo.fetch(user_id)
+    return aggregate
+
+  async def acheckout(self, user_id: str, events_repo: AsyncEventStoreRepo) -> UserAvailabilityAggregate:
+    aggregate = self._take(user_id)
+    if aggregate is None:
+      return await events_repo.fetch(user_id)
+
+    try:
+      aggregate.apply_events(await events_repo.fetch_events(user_id, after_version=aggregate.version))
+    except EventVersionGapException:
+      return await events_repo.fetch(user_id)
+    return aggregate
+
+  def _take(self, user_id: str) -> UserAvailabilityAggregate:
+    with self._lock:
+      aggregate, expires_at = self._entries.pop(user_id, (None, None))
+      if aggregate is not None and expires_at <= self.clock():
+        aggregate = None
+        self.expirations += 1
+
+      if aggregate is None:
+        self.misses += 1
+      else:
+        self.hits += 1
+    return aggregate
+
+  def checkin(self, aggregate: UserAvailabilityAggregate):
+    if aggregate.uncommitted_events:
+      return
+
+    aggregate.events = []
+    with self._lock:
+      self._entries[aggregate.user_id] = (aggregate, self.clock() + self.ttl)
+      self._entries.move_to_end(aggregate.user_id)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+        self.evictions += 1
+
+  def invalidate(self, user_id: str):
+    with self._lock:
+      self._entries.pop(user_id, None)
+
+  def stats(self) -> Dict[str, int]:
+    with self._lock:
+      return {
+        "size": len(self._entries),
+        "max_size": self.max_size,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "expirations": self.expirations,
+      }
@@ -0,0 +1,116 @@
+import logging
+
+from typing import Dict, List
+
+from availability.domain import (
+  AddAppointmentCommand,
+  Command,
+  ConcurrencyException,
+  RemoveAppointmentCommand,
+)
+from availability.ports import EventStoreRepo, MAX_APPEND_EVENTS
+from availability.service.aggregate_cache import AggregateCache
+from availability.service.command_handlers import AvailabilityCommandHandler
+from availability.service.event_handlers import AvailabilityEventHandler
+from availability.utils import metrics
+
+
+log = logging.getLogger(__name__)
+
+# outcomes of an appointment command
+APPOINTMENT_APPLIED = "applied"
+APPOINTMENT_SKIPPED = "skipped"
+APPOINTMENT_REJECTED = "rejected"
+APPOINTMENT_FAILED = "failed"
+
+
+class AppointmentBatchHandler:
+  """
+  Applies appointment commands received in bulk, e.g. from the appointments
+  channel. Commands are grouped by walker so each walker's aggregate is
+  loaded once per batch and all of their events are appended together.
+
+  Commands already reflected by the slot, as redelivered ones are, are
+  skipped. Commands for slots that do not exist or are booked by another
+  appointment are rejected and logged without holding back the walker's
+  other commands. A walker's commands that still conflict with concurrent
+  writes once the retries are used up fail and are logged, rather than
+  holding back the rest of the batch and every batch after it.
+  """
+  def __init__(
+    self,
+    events_repo: EventStoreRepo,
+    aggregate_cache: AggregateCache = None,
+    retries: int = 2,
+    projector: AvailabilityEventHandler = None
+  ):
+    self.events_repo = events_repo
+    self.aggregate_cache = aggregate_cache
+    self.retries = retries
+    self.projector = projector
+
+  def handle_batch(self, commands: List[Command]) -> Dict[str, int]:
+    by_user: Dict[str, List[Command]] = {}
+    for cmd in commands:
+      by_user.setdefault(cmd.user_id, []).append(cmd)
+
+    counts = {APPOINTMENT_APPLIED: 0, APPOINTMENT_SKIPPED: 0, APPOINTMENT_REJECTED: 0, APPOINTMENT_FAILED: 0}
+    for user_id, user_commands in by_user.items():
+      # each appointment command raises one event
+      for i in range(0, len(user_commands), MAX_APPEND_EVENTS):
+        for outcome in self._handle_user(user_id, user_commands[i:i + MAX_APPEND_EVENTS]):
+          counts[outcome] += 1
+
+    for outcome, count in counts.items():
+      if count:
+        metrics.APPOINTMENT_COMMANDS.inc(count, outcome)
+    return counts
+
+  def _handle_user(self, user_id: str, commands: List[Command]) -> List[str]:
+    attempt = 0
+    while True:
+      handler = AvailabilityCommandHandler(
+        user_id=user_id,
+        events_repo=self.events_repo,
+        aggregate_cache=self.aggregate_cache,
+        projector=self.projector
+      )
+      try:
+        # outcomes are decided against the aggregate so after a conflict all
+        # of them are decided again against the reloaded one
+        with handler:
+          outcomes = [self._apply(handler, cmd) for cmd in commands]
+        return outcomes
+      except ConcurrencyException:
+        if attempt >= self.retries:
+          log.error(
+            f"failed {len(commands)} appointment commands of {user_id} after {attempt + 1} conflicting attempts: "
+            + ", ".join(cmd.correlation_id for cmd in commands)
+          )
+          return [APPOINTMENT_FAILED] * len(commands)
+        attempt += 1
+        log.info(f"concurrent write to aggregate {user_id}, reloading for attempt {attempt + 1}")
+
+  def _apply(self, handler: AvailabilityCommandHandler, cmd: Command) -> str:
+    slot = handler.aggregate.find_availability(cmd.available_at)
+    if slot is None:
+      log.warning(f"rejected {type(cmd).__name__} {cmd.correlation_id}, {cmd.user_id} has no availability {cmd.available_at}")
+      return APPOINTMENT_REJECTED
+
+    if isinstance(cmd, AddAppointmentCommand):
+      if slot.appointment_id == cmd.appointment_id:
+        return APPOINTMENT_SKIPPED
+      if slot.appointment_id is not None:
+        log.warning(
+          f"rejected {type(cmd).__name__} {cmd.correlation_id}, "
+          f"{cmd.user_id} {cmd.available_at} is booked by {slot.appointment_id}"
+        )
+        return APPOINTMENT_REJECTED
+      handler.add_appointment(cmd)
+    elif isinstance(cmd, RemoveAppointmentCommand):
+      if slot.appointment_id is None or cmd.appointment_id not in (None, slot.appointment_id):
+        return APPOINTMENT_SKIPPED
+      handler.remove_appointment(cmd)
+    else:
+      raise TypeError(f"unsupported command {type(cmd).__name__}")
+    return APPOINTMENT_APPLIED
@@ -0,0 +1,73 @@
+import asyncio
+import logging
+
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import AsyncIterable, Dict
+
+from availability.domain import Event
+from availability.service.event_handlers import AvailabilityEventHandler
+
+
+log = logging.getLogger(__name__)
+
+
+class AsyncProjector:
+  """
+  Projects events with many users' writes in flight at once while each
+  user's events are still applied one after another in arrival order.
+
+  No more than max_in_flight events are pending at a time. Once the limit
+  is reached the projector stops pulling from its source, which in turn
+  stops reading the stream. Writes go through the synchronous event handler
+  on a thread pool of the same size.
+  """
+  def __init__(self, handler: AvailabilityEventHandler, max_in_flight: int = 64, executor: Executor = None):
+    if max_in_flight < 1:
+      raise ValueError(f"max_in_flight must be positive, got {max_in_flight}")
+    self.handler = handler
+    self.max_in_flight = max_in_flight
+    self.executor = executor or ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="projector")
+
+    self._tails: Dict[str, asyncio.Future] = {}
+    self._error: BaseException = None
+
+  async def run(self, events: AsyncIterable[Event]):
+    semaphore = asyncio.Semaphore(self.max_in_flight)
+    pending = set()
+
+    async for event in events:
+      await semaphore.acquire()
+      if self._error is not None:
+        semaphore.release()
+        break
+
+      previous = self._tails.get(event.user_id)
+      task = asyncio.ensure_future(self._project(event, previous, semaphore))
+      self._tails[event.user_id] = task
+      pending.add(task)
+      task.add_done_callback(lambda t, user_id=event.user_id: self._done(t, user_id, pending))
+
+    if pending:
+      await asyncio.wait(pending)
+
+    if self._error is not None:
+      raise self._error
+
+  async def _project(self, event: Event, previous: asyncio.Future, semaphore: asyncio.Semaphore):
+    try:
+      if previous is not None:
+        await asyncio.wait([previous])
+      if self._error is None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.handler.handle, event)
+    except Exception as e:
+      log.exception(f"failed projecting event {event.event_id} of user {event.user_id}")
+      if self._error is None:
+        self._error = e
+    finally:
+      semaphore.release()
+
+  def _done(self, task: asyncio.Future, user_id: str, pending: set):
+    pending.discard(task)
+    if self._tails.get(user_id) is task:
+      del self._tails[user_id]
@@ -1,38 +1,229 @@
+import logging
 
-from availability.domain.command import CreateAvailabilityCommand, DeleteAvailabilityCommand, AddAppointmentCommand, RemoveAppointmentCommand
-from availability.ports import EventStoreRepo
+from time import perf_counter
+from typing import List
+
+from availability.domain.command import Command, CreateAvailabilityCommand, DeleteAvailabilityCommand, AddAppointmentCommand, RemoveAppointmentCommand
+from availability.domain.event import Event
+from availability.domain.exception import ConcurrencyException, TooManyEventsException
+from availability.domain.model import UserAvailabilityAggregate
+from availability.ports import AsyncEventStoreRepo, EventStoreRepo, MAX_APPEND_EVENTS
+from availability.service.aggregate_cache import AggregateCache
+from availability.service.event_handlers import AvailabilityEventHandler, AsyncAvailabilityEventHandler
+from availability.utils import metrics
+
+
+log = logging.getLogger(__name__)
 
 
 class AvailabilityCommandHandler:
-  def __init__(self, user_id: str, events_repo: EventStoreRepo):
+  """
+  Applies commands to a user's aggregate and, on leaving the context,
+  appends the resulting events to the event store in one atomic batch.
+
+  When another writer commits to the same aggregate first the append is
+  rejected with a ConcurrencyException. With retries > 0 the aggregate is
+  reloaded and the commands issued in the context are re-applied before
+  trying again.
+
+  Given a projector the committed events are projected to the read model
+  before leaving the context. Projection failures are logged rather than
+  raised since the events are committed and still reach the read model
+  through cdc. Snapshot failures are logged and counted for the same reason,
+  the aggregate is replayed from its events until a later save succeeds.
+  """
+  def __init__(
+    self,
+    user_id: str,
+    events_repo: EventStoreRepo,
+    aggregate_cache: AggregateCache = None,
+    retries: int = 0,
+    projector: AvailabilityEventHandler = None
+  ):
     self.user_id = user_id
     self.events_repo = events_repo
-    self.aggregate = events_repo.fetch(user_id)
+    self.aggregate_cache = aggregate_cache
+    self.retries = retries
+    self.projector = projector
+    self._commands = []
+    if aggregate_cache is not None:
+      self.aggregate = aggregate_cache.checkout(user_id, events_repo)
+    else:
+      self.aggregate = events_repo.fetch(user_id)
 
   def __enter__(self):
     return self
 
   def __exit__(self, exc_type, exc_value, exc_tb):
-    if exc_value is None:
-      curr_version = self.aggregate.version + 1
-      for event in self.aggregate.uncommitted_events:
-        event.version = curr_version
-        self.events_repo.save(event)
-        self.aggregate.events.append(event)
-        self.aggregate.version = curr_version
-        curr_version += 1
+    commands, self._commands = self._commands, []
+    if exc_value is not None:
+      return
+
+    attempt = 0
+    while True:
+      try:
+        events = self._commit()
+        break
+      except ConcurrencyException:
+        metrics.COMMAND_CONFLICTS.inc()
+        if attempt >= self.retries:
+          raise
+        attempt += 1
+        log.info(f"concurrent write to aggregate {self.user_id}, reloading for attempt {attempt + 1}")
+        self.aggregate = self.events_repo.fetch(self.user_id)
+        for apply, cmd in commands:
+          apply(self.aggregate, cmd)
+
+    try:
+      self.events_repo.save_snapshot(self.aggregate)
+    except Exception:
+      self._snapshot_failed()
+
+    if self.aggregate_cache is not None:
+      self.aggregate_cache.checkin(self.aggregate)
 
-      self.aggregate.uncommitted_events.clear()
+    if self.projector is not None and events:
+      try:
+        self.projector.handle_committed(events)
+      except Exception:
+        log.exception(f"failed projecting versions {events[0].version}-{events[-1].version} of {self.user_id}, left to cdc")
 
+  def _commit(self) -> List[Event]:
+    events = self._versioned_uncommitted_events()
+    t0 = perf_counter()
+    self.events_repo.append(events)
+    metrics.COMMAND_COMMIT_SECONDS.observe(perf_counter() - t0)
+    self._mark_committed(events)
+    return events
+
+  def _snapshot_failed(self):
+    metrics.SNAPSHOT_FAILURES.inc()
+    log.exception(f"failed saving snapshot of {self.user_id} at version {self.aggregate.version}")
+
+  def _versioned_uncommitted_events(self) -> List[Event]:
+    events = list(self.aggregate.uncommitted_events)
+    for version, event in enumerate(events, start=self.aggregate.version + 1):
+      event.version = version
+    return events
+
+  def _mark_committed(self, events: List[Event]):
+    self.aggregate.events.extend(events)
+    self.aggregate.version += len(events)
+    self.aggregate.uncommitted_events.clear()
+
+  def _handle(self, apply, cmd: Command):
+    apply(self.aggregate, cmd)
+    self._commands.append((apply, cmd))
+
+  def handle_all(self, commands: List[Command]):
+    """
+    Applies commands in order to the one loaded aggregate so that their
+    events are appended together, atomically, on leaving the context. When
+    a command is rejected the exception leaves the context and none of the
+    commands' events are appended.
+    """
+    for cmd in commands:
+      apply = COMMAND_APPLIERS.get(type(cmd))
+      if apply is None:
+        raise TypeError(f"unsupported command {type(cmd).__name__}")
+      self._handle(apply, cmd)
+
+    if len(self.aggregate.uncommitted_events) > MAX_APPEND_EVENTS:
+      raise TooManyEventsException(
+        f"{len(self.aggregate.uncommitted_events)} events exceed the {MAX_APPEND_EVENTS} that can be appended atomically"
+      )
 
   def add_availability(self, cmd: CreateAvailabilityCommand):
-    self.aggregate.add_availability(cmd)
+    self._handle(UserAvailabilityAggregate.add_availability, cmd)
 
   def delete_availability(self, cmd: DeleteAvailabilityCommand):
-    self.aggregate.delete_availability(cmd)
+    self._handle(UserAvailabilityAggregate.delete_availability, cmd)
 
   def add_appointment(self, cmd: AddAppointmentCommand):
-    self.aggregate.add_appointment(cmd)
+    self._handle(UserAvailabilityAggregate.add_appointment, cmd)
 
   def remove_appointment(self, cmd: RemoveAppointmentCommand):
-    self.aggregate.remove_appointment(cmd)
+    self._handle(UserAvailabilityAggregate.remove_appointment, cmd)
+
+
+COMMAND_APPLIERS = {
+  CreateAvailabilityCommand: UserAvailabilityAggregate.add_availability,
+  DeleteAvailabilityCommand: UserAvailabilityAggregate.delete_availability,
+  AddAppointmentCommand: UserAvailabilityAggregate.add_appointment,
+  RemoveAppointmentCommand: UserAvailabilityAggregate.remove_appointment,
+}
+
+
+class AsyncAvailabilityCommandHandler(AvailabilityCommandHandler):
+  """
+  AvailabilityCommandHandler over an AsyncEventStoreRepo, used with
+  async with. The aggregate is loaded on entering the context rather than
+  on construction.
+  """
+  def __init__(
+    self,
+    user_id: str,
+    events_repo: AsyncEventStoreRepo,
+    aggregate_cache: AggregateCache = None,
+    retries: int = 0,
+    projector: AsyncAvailabilityEventHandler = None
+  ):
+    self.user_id = user_id
+    self.events_repo = events_repo
+    self.aggregate_cache = aggregate_cache
+    self.retries = retries
+    self.projector = projector
+    self._commands = []
+    self.aggregate = None
+
+  def __enter__(self):
+    raise TypeError(f"{type(self).__name__} must be used with async with")
+
+  async def __aenter__(self):
+    if self.aggregate_cache is not None:
+      self.aggregate = await self.aggregate_cache.acheckout(self.user_id, self.events_repo)
+    else:
+      self.aggregate = await self.events_repo.fetch(self.user_id)
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, exc_tb):
+    commands, self._commands = self._commands, []
+    if exc_value is not None:
+      return
+
+    attempt = 0
+    while True:
+      try:
+        events = await self._commit()
+        break
+      except ConcurrencyException:
+        metrics.COMMAND_CONFLICTS.inc()
+        if attempt >= self.retries:
+          raise
+        attempt += 1
+        log.info(f"concurrent write to aggregate {self.user_id}, reloading for attempt {attempt + 1}")
+        self.aggregate = await self.events_repo.fetch(self.user_id)
+        for apply, cmd in commands:
+          apply(self.aggregate, cmd)
+
+    try:
+      await self.events_repo.save_snapshot(self.aggregate)
+    except Exception:
+      self._snapshot_failed()
+
+    if self.aggregate_cache is not None:
+      self.aggregate_cache.checkin(self.aggregate)
+
+    if self.projector is not None and events:
+      try:
+        await self.projector.handle_committed(events)
+      except Exception:
+        log.exception(f"failed projecting versions {events[0].version}-{events[-1].version} of {self.user_id}, left to cdc")
+
+  async def _commit(self) -> List[Event]:
+    events = self._versioned_uncommitted_events()
+    t0 = perf_counter()
+    await self.events_repo.append(events)
+    metrics.COMMAND_COMMIT_SECONDS.observe(perf_counter() - t0)
+    self._mark_committed(events)
+    return events
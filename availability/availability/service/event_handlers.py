@@ -1,7 +1,8 @@
 import logging
 
-from dataclasses import asdict
 from datetime import datetime
+from threading import Lock
+from typing import Dict, List, Tuple
 
 from availability.domain import (
   Availability,
@@ -12,30 +13,176 @@ from availability.domain import (
   AppointmentRemovedEvent,
 )
 
-from availability.ports import AvailabilityRepo
+from availability.ports import (
+  AsyncAvailabilityRepo,
+  AvailabilityRepo,
+  AvailabilityChange,
+  APPLIED,
+  SKIPPED_DUPLICATE,
+  SKIPPED_STALE,
+)
+from availability.service.query_cache import QueryCache
+from availability.utils import metrics
 
 
 log = logging.getLogger(__name__)
 
+UPSERT_EVENT_TYPES = {
+  AvailabilityCreatedEvent.__name__,
+  AppointmentAddedEvent.__name__,
+  AppointmentRemovedEvent.__name__,
+}
+
+
+def event_to_change(event: Event) -> AvailabilityChange:
+  if event.event_type in UPSERT_EVENT_TYPES:
+    deleted = False
+  elif event.event_type == AvailabilityDeletedEvent.__name__:
+    deleted = True
+  else:
+    log.warning(f"unknown event type {event.event_type}")
+    return None
+
+  return AvailabilityChange(
+    availability=Availability(**event.event_payload),
+    version=event.version,
+    deleted=deleted
+  )
+
+
+def latest_events(events: List[Event]) -> List[Event]:
+  """
+  The event with the highest version of each (user_id, available_at) slot.
+  """
+  latest = {}
+  for event in events:
+    key = (event.user_id, event.event_payload["available_at"])
+    if key not in latest or latest[key].version < event.version:
+      latest[key] = event
+  return list(latest.values())
+
+
+def event_changes(events: List[Event]) -> List[Tuple[Event, AvailabilityChange]]:
+  changes = []
+  for event in events:
+    change = event_to_change(event)
+    if change is not None:
+      changes.append((event, change))
+  return changes
+
+
+def applied_versions(changes: List[Tuple[Event, AvailabilityChange]], outcomes: List[str]) -> Dict[str, int]:
+  """
+  Highest version applied to the read model of each user.
+  """
+  versions = {}
+  for (event, change), outcome in zip(changes, outcomes):
+    if outcome == APPLIED and change.version > versions.get(event.user_id, 0):
+      versions[event.user_id] = change.version
+  return versions
+
+
+# paths by which events reach the read model, label values of the
+# visibility metric
+CDC = "cdc"
+COMMIT = "commit"
+
 
 class AvailabilityEventHandler:
-  def __init__(self, availability_repo: AvailabilityRepo):
+  """
+  Projects events onto the availability read model. Writes are gated on
+  the aggregate version so redelivered and out of order events are skipped
+  rather than regressing the read model, and skips are counted, not raised.
+
+  Once an event of a user changed the read model their version stamp is
+  raised, which invalidates their query results cached by any process, and
+  those cached by this process are dropped straight away.
+  """
+  def __init__(self, availability_repo: AvailabilityRepo, query_cache: QueryCache = None):
     self.availability_repo = availability_repo
+    self.query_cache = query_cache
+    self.counts = {APPLIED: 0, SKIPPED_DUPLICATE: 0, SKIPPED_STALE: 0, "coalesced": 0}
+    self._lock = Lock()
 
   def handle(self, event: Event):
-    log.info(f'handling event {asdict(event)}')
+    log.debug("handling event %s", event)
+
+    change = event_to_change(event)
+    if change is not None:
+      changes = [(event, change)]
+      self._record(changes, self._stamp(changes, [self.availability_repo.project(change)]), CDC)
+
+  def handle_batch(self, events: List[Event]):
+    """
+    Projects a batch of events with a single bulk write. Events are
+    coalesced per (user_id, available_at) so only the slot state after the
+    highest version in the batch is written.
+    """
+    latest = latest_events(events)
+    changes = event_changes(latest)
+    self._count("coalesced", len(events) - len(latest))
+    outcomes = self.availability_repo.project_batch([change for _, change in changes])
+    self._record(changes, self._stamp(changes, outcomes), CDC)
+    log.debug("projected %d events as %d changes %s", len(events), len(changes), self.counts)
+
+  def handle_committed(self, events: List[Event]):
+    """
+    Projects the events of one commit as soon as they are appended, so a
+    writer reads its own writes without waiting for them to come through
+    cdc. Each change is written conditionally on its own rather than in
+    bulk, which keeps this safe alongside the cdc consumer projecting the
+    same rows, and makes their later cdc delivery a skipped duplicate.
+    """
+    changes = event_changes(latest_events(events))
+    outcomes = [self.availability_repo.project(change) for _, change in changes]
+    self._record(changes, self._stamp(changes, outcomes), COMMIT)
+
+  def _stamp(self, changes: List[Tuple[Event, AvailabilityChange]], outcomes: List[str]) -> List[str]:
+    for user_id, version in applied_versions(changes, outcomes).items():
+      self.availability_repo.stamp(user_id, version)
+    return outcomes
+
+  def _record(self, changes: List[Tuple[Event, AvailabilityChange]], outcomes: List[str], path: str):
+    applied = [event for (event, _), outcome in zip(changes, outcomes) if outcome == APPLIED]
+    for outcome in outcomes:
+      self._count(outcome)
 
-    availability = Availability(**event.event_payload)
-    if event.event_type == AvailabilityCreatedEvent.__name__:
-      self.availability_repo.create(availability)
+    if self.query_cache is not None:
+      for user_id in {event.user_id for event in applied}:
+        self.query_cache.invalidate(user_id)
 
-    elif event.event_type == AvailabilityDeletedEvent.__name__:
-      self.availability_repo.delete(availability)
+    if applied and metrics.REGISTRY.enabled:
+      now = datetime.now()
+      for event in applied:
+        metrics.READ_MODEL_VISIBILITY_SECONDS.observe((now - event.created).total_seconds(), path)
+
+  def _count(self, outcome: str, n: int = 1):
+    with self._lock:
+      self.counts[outcome] += n
+
+  def stats(self):
+    with self._lock:
+      return dict(self.counts)
+
+
+class AsyncAvailabilityEventHandler(AvailabilityEventHandler):
+  """
+  AvailabilityEventHandler over an AsyncAvailabilityRepo which projects
+  the events of commits made from the event loop.
+  """
+  def __init__(self, availability_repo: AsyncAvailabilityRepo, query_cache: QueryCache = None):
+    super().__init__(availability_repo, query_cache)
+
+  def handle(self, event: Event):
+    raise TypeError(f"{type(self).__name__} only projects committed events, use handle_committed")
 
-    elif event.event_type == AppointmentAddedEvent.__name__ or \
-        event.event_type == AppointmentRemovedEvent.__name__:
+  def handle_batch(self, events: List[Event]):
+    raise TypeError(f"{type(self).__name__} only projects committed events, use handle_committed")
 
-      self.availability_repo.update(availability)
+  async def handle_committed(self, events: List[Event]):
+    changes = event_changes(latest_events(events))
+    outcomes = [await self.availability_repo.project(change) for _, change in changes]
+    for user_id, version in applied_versions(changes, outcomes).items():
+      await self.availability_repo.stamp(user_id, version)
+    self._record(changes, outcomes, COMMIT)
 
-    else:
-      log.warn(f"unknown event type {event.event_type}")
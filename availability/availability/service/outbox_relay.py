@@ -0,0 +1,209 @@
+import logging
+import random
+
+from datetime import datetime
+from threading import Event as StopEvent
+from typing import Dict, List, Sequence, Set, Tuple
+
+from availability.domain import Event
+from availability.ports import OutboxEntry, OutboxRepo
+from availability.utils import metrics
+from availability.utils.codec import to_json
+
+
+log = logging.getLogger(__name__)
+
+# limits of a single Kinesis PutRecords call and of each record in it
+MAX_PUT_RECORDS = 500
+MAX_PUT_RECORDS_BYTES = 5 * 1024 * 1024
+MAX_RECORD_BYTES = 1024 * 1024
+
+
+def integration_event(event: Event) -> Dict:
+  """
+  Public form of an event on the integration channel. Consumers dedupe by
+  user_id and version as a record may be delivered more than once.
+  """
+  payload = event.event_payload
+  return {
+    "event_id": event.event_id,
+    "event_type": event.event_type,
+    "user_id": event.user_id,
+    "version": event.version,
+    "available_at": payload["available_at"].isoformat(),
+    "appointment_id": payload.get("appointment_id"),
+    "occurred_at": event.created.isoformat(),
+    "correlation_id": event.correlation_id,
+  }
+
+
+class OutboxRelay:
+  """
+  Publishes pending outbox entries to a Kinesis stream, or anything with its
+  put_records method, and deletes them once the stream accepted them.
+
+  All of a user's pending entries are sent as one record partitioned by
+  user id so consumers receive each user's events in commit order, up to
+  MAX_PUT_RECORDS users per PutRecords call. A user whose record was
+  rejected is passed over until the relay next starts over at the head of
+  their segment, so their later entries never overtake the rejected ones.
+  """
+  def __init__(
+    self,
+    outbox: OutboxRepo,
+    stream,
+    stream_name: str,
+    segments: Sequence[int] = None,
+    batch_size: int = MAX_PUT_RECORDS,
+    base_delay: float = 0.05,
+    max_delay: float = 5.0,
+    idle_wait: float = 0.5,
+  ):
+    if not 0 < batch_size <= MAX_PUT_RECORDS:
+      raise ValueError(f"batch_size must be between 1 and {MAX_PUT_RECORDS}, got {batch_size}")
+    self.outbox = outbox
+    self.stream = stream
+    self.stream_name = stream_name
+    self.segments = list(segments if segments is not None else range(outbox.segments))
+    self.batch_size = batch_size
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.idle_wait = idle_wait
+    self.counts = {"published": 0, "failed": 0}
+
+    self._next_segment = 0
+    self._cursors: Dict[int, Tuple[str, int]] = {}
+    self._blocked: Dict[int, Set[str]] = {}
+
+  def run(self, stop: StopEvent = None):
+    stop = stop or StopEvent()
+    failures = 0
+    while not stop.is_set():
+      try:
+        published, failed = self.relay_once()
+      except Exception:
+        log.exception("outbox relay to %s failed", self.stream_name)
+        published, failed = 0, 1
+
+      if failed:
+        failures += 1
+        # full jitter keeps relays that failed together from retrying together
+        stop.wait(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** failures)))
+      else:
+        failures = 0
+        if not published:
+          stop.wait(self.idle_wait)
+
+  def relay_once(self) -> Tuple[int, int]:
+    """
+    Publishes one batch of pending entries, returning the number of records
+    published and rejected.
+    """
+    records = self._collect()
+    published = failed = offset = 0
+    for batch in self._batches(records):
+      try:
+        response = self.stream.put_records(
+          StreamName=self.stream_name,
+          Records=[{"Data": data, "PartitionKey": user_id} for user_id, _, _, data in batch]
+        )
+      except Exception:
+        # any of these records may have been written, either way none of
+        # the users' later entries may be published before them
+        for user_id, segment, _, _ in records[offset:]:
+          self._blocked.setdefault(segment, set()).add(user_id)
+        raise
+      offset += len(batch)
+      done = []
+      for (user_id, segment, entries, _), result in zip(batch, response["Records"]):
+        if "ErrorCode" in result:
+          failed += 1
+          self._blocked.setdefault(segment, set()).add(user_id)
+          log.warning(
+            "integration record for user_id=%s rejected, %s: %s", user_id, result["ErrorCode"], result.get("ErrorMessage")
+          )
+        else:
+          published += 1
+          done.extend(entries)
+
+      if done:
+        self.outbox.delete(done)
+        now = datetime.now()
+        for entry in done:
+          metrics.OUTBOX_RELAY_LAG_SECONDS.observe((now - entry.created).total_seconds())
+
+    if failed:
+      metrics.OUTBOX_PUBLISH_FAILURES.inc(failed)
+    self.counts["published"] += published
+    self.counts["failed"] += failed
+    return published, failed
+
+  def _collect(self) -> List[Tuple[str, int, List[OutboxEntry], bytes]]:
+    """
+    Pending entries of up to batch_size users, grouped per user into the
+    data of one record each, visiting segments round robin from where the
+    previous call stopped.
+    """
+    groups: Dict[str, Tuple[int, List[OutboxEntry]]] = {}
+    for _ in range(len(self.segments)):
+      if len(groups) >= self.batch_size:
+        break
+      segment = self.segments[self._next_segment]
+      self._next_segment = (self._next_segment + 1) % len(self.segments)
+
+      limit = self.batch_size - len(groups)
+      entries = self.outbox.fetch_pending(segment, limit, after=self._cursors.get(segment))
+      if len(entries) < limit:
+        # the end of the segment was reached, next time start over at its head
+        self._cursors.pop(segment, None)
+        blocked = self._blocked.pop(segment, set())
+      else:
+        self._cursors[segment] = entries[-1].key
+        blocked = self._blocked.get(segment, set())
+
+      for entry in entries:
+        if entry.user_id not in blocked:
+          groups.setdefault(entry.user_id, (segment, []))[1].append(entry)
+
+    records = []
+    for user_id, (segment, entries) in groups.items():
+      entries.sort(key=lambda e: e.version)
+      data, sent = self._record_data(user_id, entries)
+      if len(sent) < len(entries):
+        # the rest follows once the cursor comes back round to this user
+        self._blocked.setdefault(segment, set()).add(user_id)
+      records.append((user_id, segment, sent, data))
+    return records
+
+  def _record_data(self, user_id: str, entries: List[OutboxEntry]) -> Tuple[bytes, List[OutboxEntry]]:
+    """
+    Data of the record holding the events of as many of entries, in order,
+    as fit in MAX_RECORD_BYTES, and the entries it holds.
+    """
+    head = f'{{"user_id":{to_json(user_id)},"events":['
+    size = len(head.encode("utf-8")) + len(user_id) + 2
+    events = []
+    sent = []
+    for entry in entries:
+      encoded = [to_json(integration_event(e)) for e in entry.events]
+      entry_size = sum(len(e.encode("utf-8")) + 1 for e in encoded)
+      if sent and size + entry_size > MAX_RECORD_BYTES:
+        break
+      events.extend(encoded)
+      size += entry_size
+      sent.append(entry)
+    return (head + ",".join(events) + "]}").encode("utf-8"), sent
+
+  def _batches(self, records: List[Tuple]) -> List[List[Tuple]]:
+    batches = []
+    batch, size = [], 0
+    for record in records:
+      record_size = len(record[3]) + len(record[0])
+      if batch and (len(batch) >= MAX_PUT_RECORDS or size + record_size > MAX_PUT_RECORDS_BYTES):
+        batches.append(batch)
+        batch, size = [], 0
+      batch.append(record)
+      size += record_size
+    if batch:
+      batches.append(batch)
+    return batches
@@ -0,0 +1,121 @@
+import hashlib
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Set, Tuple
+
+from availability.domain import Availability
+
+
+QueryKey = Tuple[str, datetime, datetime, int]
+
+
+@dataclass(frozen=True)
+class QueryResult:
+  start: datetime
+  end: datetime
+  availability: List[Availability]
+  etag: str
+  # version stamp of the user's read model rows the result was queried at
+  stamp: int = None
+
+
+def availability_etag(start: datetime, end: datetime, availability: List[Availability]) -> str:
+  """
+  Strong entity tag of a query result, equal across processes for equal results.
+  """
+  digest = hashlib.sha1(f"{start.isoformat()}|{end.isoformat()}\n".encode("utf-8"))
+  for a in availability:
+    digest.update(f"{a.user_id}|{a.available_at.isoformat()}|{a.appointment_id}\n".encode("utf-8"))
+  return f'"{digest.hexdigest()}"'
+
+
+class QueryCache:
+  """
+  Bounded LRU cache of availability query results keyed by
+  (user_id, start, end, limit).
+
+  Entries expire after ttl seconds and those of a user are invalidated when
+  an event of that user is projected, along with all queries across users.
+  Invalidation only reaches the cache of the process the projection runs
+  in. Other processes check a user's result against the version stamp the
+  read model keeps for the user before serving it, while ttl alone bounds
+  how stale results of queries across users can be.
+
+  A result is only cached if no invalidation happened while it was being
+  queried, callers read generation before querying and pass it to put.
+  """
+  def __init__(self, max_size: int = 4096, ttl: float = 5.0, clock=monotonic):
+    if max_size < 1:
+      raise ValueError(f"cache size must be positive, got {max_size}")
+    self.max_size = max_size
+    self.ttl = ttl
+    self.clock = clock
+
+    self._entries: Dict[QueryKey, Tuple[QueryResult, float]] = OrderedDict()
+    self._keys_by_user: Dict[str, Set[QueryKey]] = {}
+    self._lock = Lock()
+
+    self.generation = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.invalidations = 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key: QueryKey) -> QueryResult:
+    with self._lock:
+      result, expires_at = self._entries.get(key, (None, None))
+      if result is not None and expires_at <= self.clock():
+        self._remove(key)
+        result = None
+
+      if result is None:
+        self.misses += 1
+        return None
+
+      self.hits += 1
+      self._entries.move_to_end(key)
+      return result
+
+  def put(self, key: QueryKey, result: QueryResult, generation: int = None):
+    with self._lock:
+      if generation is not None and generation != self.generation:
+        return
+      self._entries[key] = (result, self.clock() + self.ttl)
+      self._entries.move_to_end(key)
+      self._keys_by_user.setdefault(key[0], set()).add(key)
+      while len(self._entries) > self.max_size:
+        self._remove(next(iter(self._entries)))
+        self.evictions += 1
+
+  def invalidate(self, user_id: str):
+    with self._lock:
+      self.generation += 1
+      for key in self._keys_by_user.get(user_id, set()) | self._keys_by_user.get(None, set()):
+        self._remove(key)
+        self.invalidations += 1
+
+  def _remove(self, key: QueryKey):
+    self._entries.pop(key, None)
+    keys = self._keys_by_user.get(key[0])
+    if keys is not None:
+      keys.discard(key)
+      if not keys:
+        del self._keys_by_user[key[0]]
+
+  def stats(self) -> Dict[str, int]:
+    with self._lock:
+      return {
+        "size": len(self._entries),
+        "max_size": self.max_size,
+        "hits": self.hits,
+        "misses": self.misses,
+        "evictions": self.evictions,
+        "invalidations": self.invalidations,
+      }
@@ -1,20 +1,89 @@
-from typing import List
+from typing import Iterator, List, Tuple
 
 from datetime import datetime, timedelta
 
 from availability.domain import Availability
-from availability.ports import AvailabilityRepo
+from availability.ports import AsyncAvailabilityRepo, AvailabilityRepo
+from availability.service.query_cache import QueryCache, QueryResult, availability_etag
 
 
 class AvailabilityQueryService:
-  def __init__(self, availability_repo: AvailabilityRepo):
+  """
+  Queries the read model through an optional QueryCache. A cached result of
+  a user's query is only served while the user's version stamp still equals
+  the one it was queried at, which costs a strongly consistent read of the
+  stamp, a single small item, on every hit in exchange for results that are
+  never staler than the read model across processes.
+  """
+  def __init__(self, availability_repo: AvailabilityRepo, query_cache: QueryCache = None):
     self.availability_repo = availability_repo
+    self.query_cache = query_cache
 
-  def fetch(self, user_id: str = None, start: datetime = None, end: datetime = None) -> List[Availability]:
-    if not start:
-      start = datetime.now() - timedelta(days=1)
+  def fetch(self, user_id: str = None, start: datetime = None, end: datetime = None, limit: int = None) -> List[Availability]:
+    return self.query(user_id=user_id, start=start, end=end, limit=limit).availability
 
-    if not end:
-      end = datetime.now() + timedelta(days=7)
+  def query(self, user_id: str = None, start: datetime = None, end: datetime = None, limit: int = None) -> QueryResult:
+    start, end = default_window(start, end)
+    key = (user_id, start, end, limit)
+    if self.query_cache is None:
+      return query_result(start, end, list(self.availability_repo.fetch(start=start, end=end, user_id=user_id, limit=limit)))
 
-    return self.availability_repo.fetch(start=start, end=end, user_id=user_id)
+    # read before the rows so a projection landing in between leaves the
+    # result stamped older than it is, never newer
+    stamp = self.availability_repo.fetch_stamp(user_id) if user_id else None
+    result = self.query_cache.get(key)
+    if result is None or result.stamp != stamp:
+      generation = self.query_cache.generation
+      availability = list(self.availability_repo.fetch(start=start, end=end, user_id=user_id, limit=limit))
+      result = query_result(start, end, availability, stamp)
+      self.query_cache.put(key, result, generation)
+    return result
+
+  def stream(self, user_id: str = None, start: datetime = None, end: datetime = None, limit: int = None) -> Iterator[Availability]:
+    start, end = default_window(start, end)
+    return self.availability_repo.fetch(start=start, end=end, user_id=user_id, limit=limit)
+
+
+class AsyncAvailabilityQueryService:
+  """
+  Asynchronous counterpart of AvailabilityQueryService, validating cached
+  results of a user's query against their version stamp the same way.
+  """
+  def __init__(self, availability_repo: AsyncAvailabilityRepo, query_cache: QueryCache = None):
+    self.availability_repo = availability_repo
+    self.query_cache = query_cache
+
+  async def fetch(self, user_id: str = None, start: datetime = None, end: datetime = None, limit: int = None) -> List[Availability]:
+    return (await self.query(user_id=user_id, start=start, end=end, limit=limit)).availability
+
+  async def query(self, user_id: str = None, start: datetime = None, end: datetime = None, limit: int = None) -> QueryResult:
+    start, end = default_window(start, end)
+    key = (user_id, start, end, limit)
+    if self.query_cache is None:
+      return query_result(start, end, await self.availability_repo.fetch(start=start, end=end, user_id=user_id, limit=limit))
+
+    stamp = await self.availability_repo.fetch_stamp(user_id) if user_id else None
+    result = self.query_cache.get(key)
+    if result is None or result.stamp != stamp:
+      generation = self.query_cache.generation
+      availability = await self.availability_repo.fetch(start=start, end=end, user_id=user_id, limit=limit)
+      result = query_result(start, end, availability, stamp)
+      self.query_cache.put(key, result, generation)
+    return result
+
+
+def query_result(start: datetime, end: datetime, availability: List[Availability], stamp: int = None) -> QueryResult:
+  return QueryResult(start, end, availability, availability_etag(start, end, availability), stamp)
+
+
+def default_window(start: datetime = None, end: datetime = None) -> Tuple[datetime, datetime]:
+  # whole minutes so default windows requested within the same minute are
+  # equal, and share cached results and their ETag
+  now = datetime.now().replace(second=0, microsecond=0)
+  if not start:
+    start = now - timedelta(days=1)
+
+  if not end:
+    end = now + timedelta(days=7)
+
+  return start, end
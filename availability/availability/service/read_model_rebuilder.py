@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
+from typing import Dict, List
+
+from availability.domain import Event, UserAvailabilityAggregate
+from availability.ports import AvailabilityRepo, AvailabilityChange, EventStoreRepo
+
+
+log = logging.getLogger(__name__)
+
+
+class RebuildCheckpoint:
+  """
+  Tracks rebuild progress per scan segment in a local JSON file so an
+  interrupted rebuild resumes after the last user whose rows were written.
+  """
+  def __init__(self, path: str, total_segments: int):
+    self.path = path
+    self.total_segments = total_segments
+    self._lock = Lock()
+    self.segments: Dict[str, Dict] = {}
+
+    if path and os.path.exists(path):
+      with open(path) as fp:
+        data = json.load(fp)
+      if data["total_segments"] != total_segments:
+        raise ValueError(f"checkpoint {path} was written for {data['total_segments']} segments, not {total_segments}")
+      self.segments = data["segments"]
+
+  def last_key(self, segment: int) -> Dict:
+    return self.segments.get(str(segment), {}).get("last_key")
+
+  def is_done(self, segment: int) -> bool:
+    return self.segments.get(str(segment), {}).get("done", False)
+
+  def advance(self, segment: int, last_key: Dict, done: bool = False):
+    with self._lock:
+      self.segments[str(segment)] = {"last_key": last_key, "done": done}
+      self._save()
+
+  def _save(self):
+    if not self.path:
+      return
+    tmp_path = f"{self.path}.tmp"
+    with open(tmp_path, "w") as fp:
+      json.dump({"total_segments": self.total_segments, "segments": self.segments}, fp)
+    os.replace(tmp_path, self.path)
+
+
+class ReadModelRebuilder:
+  """
+  Rebuilds the availability read model from the event store with a parallel
+  segmented scan. Each user's events are folded through a
+  UserAvailabilityAggregate and the resulting slots bulk written to the read
+  model without version checks, so it is meant to be run against an empty
+  read model table.
+  """
+  def __init__(
+    self,
+    events_repo: EventStoreRepo,
+    availability_repo: AvailabilityRepo,
+    segments: int = 8,
+    workers: int = None,
+    checkpoint: RebuildCheckpoint = None,
+    checkpoint_every: float = 5.0,
+    progress_every: float = 10.0,
+    page_size: int = None,
+  ):
+    self.events_repo = events_repo
+    self.availability_repo = availability_repo
+    self.segments = segments
+    self.workers = workers or segments
+    self.checkpoint = checkpoint or RebuildCheckpoint(None, segments)
+    self.checkpoint_every = checkpoint_every
+    self.progress_every = progress_every
+    self.page_size = page_size
+
+    self._lock = Lock()
+    self.events = 0
+    self.users = 0
+    self.slots = 0
+    self._started = None
+    self._last_progress = None
+
+  def run(self) -> Dict[str, float]:
+    self._started = self._last_progress = monotonic()
+    with ThreadPoolExecutor(max_workers=self.workers) as pool:
+      for _ in pool.map(self._rebuild_segment, range(self.segments)):
+        pass
+
+    elapsed = monotonic() - self._started
+    stats = {
+      "events": self.events,
+      "users": self.users,
+      "slots": self.slots,
+      "seconds": elapsed,
+      "events_per_second": self.events / elapsed if elapsed else 0.0,
+    }
+    log.info(f"rebuilt read model {stats}")
+    return stats
+
+  def _rebuild_segment(self, segment: int):
+    if self.checkpoint.is_done(segment):
+      log.info(f"segment {segment} already rebuilt, skipping")
+      return
+
+    last_key = self.checkpoint.last_key(segment)
+    last_checkpoint = monotonic()
+    user_events: List[Event] = []
+    for event in self.events_repo.scan_events(segment, self.segments, after=last_key, page_size=self.page_size):
+      if user_events and event.user_id != user_events[-1].user_id:
+        last_key = self._rebuild_user(user_events)
+        user_events = []
+
+        if monotonic() - last_checkpoint >= self.checkpoint_every:
+          self.checkpoint.advance(segment, last_key)
+          last_checkpoint = monotonic()
+
+      user_events.append(event)
+
+    if user_events:
+      last_key = self._rebuild_user(user_events)
+    self.checkpoint.advance(segment, last_key, done=True)
+
+  def _rebuild_user(self, events: List[Event]) -> Dict:
+    aggregate = UserAvailabilityAggregate(user_id=events[0].user_id, events=events)
+    availability = aggregate.availability
+
+    # rows record the version of the last event applied to their slot so
+    # projection of events redelivered after the rebuild is skipped
+    slot_versions = {event.event_payload["available_at"]: event.version for event in events}
+    self.availability_repo.project_batch(
+      [AvailabilityChange(a, slot_versions[a.available_at]) for a in availability],
+      conditional=False
+    )
+    self._record(len(events), len(availability))
+    return {"user_id": aggregate.user_id, "version": events[-1].version}
+
+  def _record(self, events: int, slots: int):
+    with self._lock:
+      self.events += events
+      self.users += 1
+      self.slots += slots
+
+      now = monotonic()
+      if now - self._last_progress >= self.progress_every:
+        self._last_progress = now
+        rate = self.events / (now - self._started)
+        log.info(f"rebuilt {self.users} users, {self.slots} slots from {self.events} events ({rate:.0f} events/s)")
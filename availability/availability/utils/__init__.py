@@ -1 +1,2 @@
 from availability.utils.common import *
+from availability.utils.codec import *
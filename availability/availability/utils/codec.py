@@ -0,0 +1,150 @@
+"""
+Schemas of the stored forms of events and availability and encoders
+generated from them.
+
+An encoder reads the fields of one class directly, in a function compiled
+once per schema, instead of copying the object with dataclasses.asdict and
+walking the copy for datetimes.
+"""
+
+import json
+
+from datetime import datetime
+from typing import Callable, Dict, Union
+
+from availability.domain.event import Event
+from availability.domain.model import Availability
+
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+
+__all__ = [
+  "STRING",
+  "OPTIONAL_STRING",
+  "NUMBER",
+  "DATETIME",
+  "SLOT_DATETIME",
+  "EVENT_SCHEMA",
+  "AVAILABILITY_SCHEMA",
+  "ENCODERS",
+  "compile_encoder",
+  "event_to_item",
+  "availability_to_item",
+  "to_item",
+  "event_from_item",
+  "to_json",
+]
+
+# attribute types of a schema, nested dicts describe map attributes which
+# are dicts in the objects as well
+STRING = "S"
+OPTIONAL_STRING = "S?"
+NUMBER = "N"
+DATETIME = "datetime"
+# a datetime shared by many events, decoders cache their parsed values
+SLOT_DATETIME = "slot_datetime"
+
+EVENT_SCHEMA = {
+  "event_id": STRING,
+  "user_id": STRING,
+  "created": DATETIME,
+  "event_type": STRING,
+  "event_payload": {
+    "user_id": STRING,
+    "available_at": SLOT_DATETIME,
+    "appointment_id": OPTIONAL_STRING,
+  },
+  "correlation_id": STRING,
+  "version": NUMBER,
+}
+
+AVAILABILITY_SCHEMA = {
+  "user_id": STRING,
+  "available_at": SLOT_DATETIME,
+  "appointment_id": OPTIONAL_STRING,
+}
+
+
+def compile_encoder(schema: Dict[str, Union[str, Dict]]) -> Callable[[object], Dict]:
+  """
+  Generates a function converting an object with the attributes of schema
+  into its stored form, a dict of plain values with datetimes as ISO 8601
+  strings, e.g. an Event into its DynamoDB item.
+  """
+  lines = ["def encode(obj):"]
+  counter = [0]
+
+  def expression(source: str, attr_type) -> str:
+    if isinstance(attr_type, dict):
+      counter[0] += 1
+      name = f"m{counter[0]}"
+      lines.append(f"  {name} = {source}")
+      fields = ", ".join(f"{key!r}: {expression(f'{name}[{key!r}]', t)}" for key, t in attr_type.items())
+      return "{" + fields + "}"
+    if attr_type in (STRING, OPTIONAL_STRING, NUMBER):
+      return source
+    if attr_type in (DATETIME, SLOT_DATETIME):
+      return f"{source}.isoformat()"
+    raise ValueError(f"unsupported attribute type {attr_type}")
+
+  fields = ", ".join(f"{key!r}: {expression(f'obj.{key}', t)}" for key, t in schema.items())
+  lines.append(f"  return {{{fields}}}")
+
+  namespace = {}
+  exec("\n".join(lines), namespace)
+  return namespace["encode"]
+
+
+event_to_item = compile_encoder(EVENT_SCHEMA)
+availability_to_item = compile_encoder(AVAILABILITY_SCHEMA)
+
+ENCODERS: Dict[type, Callable[[object], Dict]] = {
+  Event: event_to_item,
+  Availability: availability_to_item,
+}
+
+
+def to_item(obj) -> Dict:
+  """
+  Encodes an instance of any class in ENCODERS, or of a subclass of one.
+  """
+  encoder = ENCODERS.get(type(obj))
+  if encoder is None:
+    base = next((cls for cls in type(obj).__mro__ if cls in ENCODERS), None)
+    if base is None:
+      raise TypeError(f"no encoder for {type(obj).__name__}")
+    encoder = ENCODERS[type(obj)] = ENCODERS[base]
+  return encoder(obj)
+
+
+def event_from_item(item: Dict) -> Event:
+  """
+  Inverse of event_to_item.
+  """
+  payload = item["event_payload"]
+  return Event(
+    event_id=item["event_id"],
+    user_id=item["user_id"],
+    created=datetime.fromisoformat(item["created"]),
+    event_type=item["event_type"],
+    event_payload={
+      "user_id": payload["user_id"],
+      "available_at": datetime.fromisoformat(payload["available_at"]),
+      "appointment_id": payload.get("appointment_id"),
+    },
+    correlation_id=item.get("correlation_id"),
+    version=int(item["version"])
+  )
+
+
+def to_json(item) -> str:
+  """
+  Serializes an encoded item, or any plain value, to a JSON string.
+  """
+  if orjson is not None:
+    return orjson.dumps(item).decode("utf-8")
+  return json.dumps(item, separators=(",", ":"))
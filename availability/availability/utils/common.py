@@ -1,21 +1,37 @@
-
-from dataclasses import asdict
 from datetime import datetime
-from typing import Dict, List, Union
-
-
-def to_isodatetime(data: Union[dict, datetime]) -> Union[dict,str]:
-    if isinstance(data, dict):
-      item = {}
-      for k, v in data.items():
-        if isinstance(v, datetime) or isinstance(v, dict):
-          v = to_isodatetime(v)
-        elif isinstance(v, list):
-          v = [to_isodatetime(x) for x in v]
-        item[k] = v
-      return item
-    elif isinstance(data, datetime):
-      return data.isoformat()
+from decimal import Decimal
+from typing import Any
+
+
+__all__ = ["PLAIN_TYPES", "to_isodatetime", "from_isodatetime"]
+
+
+# values returned as they are, checked by exact type before anything else
+# since they are nearly all values
+PLAIN_TYPES = frozenset((str, int, float, bool, type(None), Decimal))
+
+
+def to_isodatetime(data: Any) -> Any:
+  """
+  Copies data converting every datetime in it, including those nested in
+  dicts and lists, to an ISO 8601 string. Other values are returned as
+  they are.
+
+  Objects with a known stored form are faster encoded by the schema aware
+  encoders of availability.utils.codec.
+  """
+  t = type(data)
+  if t is dict:
+    return {k: v if type(v) in PLAIN_TYPES else to_isodatetime(v) for k, v in data.items()}
+  if t is list or t is tuple:
+    return [v if type(v) in PLAIN_TYPES else to_isodatetime(v) for v in data]
+  if isinstance(data, datetime):
+    return data.isoformat()
+  if isinstance(data, dict):
+    return to_isodatetime(dict(data))
+  if isinstance(data, (list, tuple)):
+    return to_isodatetime(list(data))
+  return data
 
 
 def from_isodatetime(dt: str) -> datetime:
@@ -0,0 +1,294 @@
+"""
+In-process metrics of the hot paths, exposed in the Prometheus text format
+and written as CloudWatch embedded metric format (EMF) log lines.
+
+Metrics are declared once at import time and record nothing until the
+registry is enabled, so instrumented code pays for one attribute check
+while metrics are off.
+"""
+
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+
+log = logging.getLogger(__name__)
+
+# bucket upper bounds in seconds for latencies of a single request up to a
+# full aggregate replay
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 10000)
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+VISIBILITY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# values kept per metric and label set between EMF flushes, the most a
+# single EMF metric accepts
+EMF_MAX_VALUES = 100
+
+
+class Registry:
+  def __init__(self):
+    self.enabled = False
+    self.metrics: List["Metric"] = []
+    self._lock = threading.Lock()
+
+  def register(self, metric: "Metric") -> "Metric":
+    with self._lock:
+      self.metrics.append(metric)
+    return metric
+
+  def prometheus_text(self) -> str:
+    lines = []
+    for metric in self.metrics:
+      lines.extend(metric.prometheus_lines())
+    return "\n".join(lines) + "\n"
+
+  def emf_records(self, namespace: str, dimensions: Dict[str, str] = None) -> List[Dict]:
+    """
+    Drains what was recorded since the previous call into EMF records, one
+    per metric and label set so labels become CloudWatch dimensions.
+    """
+    timestamp = int(time.time() * 1000)
+    records = []
+    for metric in self.metrics:
+      for labels, unit, values in metric.drain_emf():
+        if not values:
+          continue
+        record_dimensions = {**(dimensions or {}), **labels}
+        records.append({
+          "_aws": {
+            "Timestamp": timestamp,
+            "CloudWatchMetrics": [{
+              "Namespace": namespace,
+              "Dimensions": [sorted(record_dimensions)],
+              "Metrics": [{"Name": metric.name, "Unit": unit}],
+            }],
+          },
+          **record_dimensions,
+          metric.name: values if len(values) > 1 else values[0],
+        })
+    return records
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+  kind = None
+
+  def __init__(self, name: str, help: str, labels: Sequence[str] = (), unit: str = "None", registry: Registry = REGISTRY):
+    self.name = name
+    self.help = help
+    self.labels = tuple(labels)
+    self.unit = unit
+    self.registry = registry
+    self._lock = threading.Lock()
+    registry.register(self)
+
+  def _label_pairs(self, label_values: Tuple) -> str:
+    if not label_values:
+      return ""
+    return ",".join(f'{name}="{value}"' for name, value in zip(self.labels, label_values))
+
+  def prometheus_lines(self) -> List[str]:
+    return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+  def drain_emf(self) -> List[Tuple[Dict[str, str], str, List[float]]]:
+    return []
+
+
+class Counter(Metric):
+  kind = "counter"
+
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self._values: Dict[Tuple, float] = {}
+    self._emitted: Dict[Tuple, float] = {}
+
+  def inc(self, amount: float = 1, *label_values):
+    if not self.registry.enabled:
+      return
+    with self._lock:
+      self._values[label_values] = self._values.get(label_values, 0) + amount
+
+  def value(self, *label_values) -> float:
+    return self._values.get(label_values, 0)
+
+  def prometheus_lines(self) -> List[str]:
+    lines = super().prometheus_lines()
+    with self._lock:
+      values = list(self._values.items())
+    for label_values, value in values:
+      pairs = self._label_pairs(label_values)
+      lines.append(f"{self.name}{{{pairs}}} {value}" if pairs else f"{self.name} {value}")
+    return lines
+
+  def drain_emf(self):
+    # EMF values are per flush so counters are reported as increments
+    drained = []
+    with self._lock:
+      for label_values, value in self._values.items():
+        increment = value - self._emitted.get(label_values, 0)
+        self._emitted[label_values] = value
+        drained.append((dict(zip(self.labels, label_values)), self.unit, [increment] if increment else []))
+    return drained
+
+
+class Histogram(Metric):
+  """
+  Cumulative bucket counts for Prometheus plus a uniform sample of up to
+  EMF_MAX_VALUES observations per EMF flush, from which CloudWatch
+  computes percentiles.
+  """
+  kind = "histogram"
+
+  def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+    super().__init__(name, help, **kwargs)
+    self.buckets = tuple(buckets)
+    self._series: Dict[Tuple, List] = {}
+
+  def observe(self, value: float, *label_values):
+    if not self.registry.enabled:
+      return
+    with self._lock:
+      series = self._series.get(label_values)
+      if series is None:
+        # bucket counts, sum, count, EMF sample, observations since flush
+        series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0, [], 0]
+      series[0][bisect_left(self.buckets, value)] += 1
+      series[1] += value
+      series[2] += 1
+
+      sample = series[3]
+      series[4] += 1
+      if len(sample) < EMF_MAX_VALUES:
+        sample.append(value)
+      else:
+        # reservoir sampling keeps every observation equally likely
+        i = random.randrange(series[4])
+        if i < EMF_MAX_VALUES:
+          sample[i] = value
+
+  def prometheus_lines(self) -> List[str]:
+    lines = super().prometheus_lines()
+    with self._lock:
+      series = [(label_values, list(s[0]), s[1], s[2]) for label_values, s in self._series.items()]
+    for label_values, counts, total, count in series:
+      pairs = self._label_pairs(label_values)
+      prefix = f"{pairs}," if pairs else ""
+      cumulative = 0
+      for bound, n in zip(self.buckets + (float("inf"),), counts):
+        cumulative += n
+        le = "+Inf" if bound == float("inf") else repr(bound)
+        lines.append(f'{self.name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+      suffix = f"{{{pairs}}}" if pairs else ""
+      lines.append(f"{self.name}_sum{suffix} {total}")
+      lines.append(f"{self.name}_count{suffix} {count}")
+    return lines
+
+  def drain_emf(self):
+    drained = []
+    with self._lock:
+      for label_values, series in self._series.items():
+        drained.append((dict(zip(self.labels, label_values)), self.unit, series[3]))
+        series[3], series[4] = [], 0
+    return drained
+
+
+class EmfExporter:
+  """
+  Writes the registry's EMF records to stream every interval seconds from
+  a daemon thread, where the CloudWatch agent or Lambda picks them up.
+  """
+  def __init__(self, registry: Registry, namespace: str, interval: float, dimensions: Dict[str, str] = None, stream=None):
+    self.registry = registry
+    self.namespace = namespace
+    self.interval = interval
+    self.dimensions = dimensions
+    self.stream = stream or sys.stdout
+    self._stop = threading.Event()
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(target=self._run, name="emf-exporter", daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    self.flush()
+
+  def flush(self):
+    lines = [json.dumps(record, separators=(",", ":")) for record in self.registry.emf_records(self.namespace, self.dimensions)]
+    if lines:
+      self.stream.write("\n".join(lines) + "\n")
+      self.stream.flush()
+
+  def _run(self):
+    while not self._stop.wait(self.interval):
+      try:
+        self.flush()
+      except Exception:
+        log.exception("failed writing EMF metrics")
+
+
+AGGREGATE_FETCH_SECONDS = Histogram(
+  "availability_aggregate_fetch_seconds", "Time to load an aggregate's snapshot and events from the store", unit="Seconds"
+)
+AGGREGATE_REPLAY_SECONDS = Histogram(
+  "availability_aggregate_replay_seconds", "Time to replay fetched events onto an aggregate", unit="Seconds"
+)
+AGGREGATE_FETCH_EVENTS = Histogram(
+  "availability_aggregate_fetch_events", "Events fetched per aggregate load", buckets=COUNT_BUCKETS, unit="Count"
+)
+COMMAND_COMMIT_SECONDS = Histogram(
+  "availability_command_commit_seconds", "Time to append a command handler's events", unit="Seconds"
+)
+COMMAND_CONFLICTS = Counter(
+  "availability_command_conflicts_total", "Appends rejected because another writer committed first", unit="Count"
+)
+PROJECTION_LAG_SECONDS = Histogram(
+  "availability_projection_lag_seconds",
+  "Time from a cdc record's arrival in the stream to its projection to the read model",
+  buckets=LAG_BUCKETS,
+  unit="Seconds"
+)
+READ_MODEL_VISIBILITY_SECONDS = Histogram(
+  "availability_read_model_visibility_seconds",
+  "Time from an event's creation until the read model reflects it, by the path that projected it",
+  labels=("path",),
+  buckets=VISIBILITY_BUCKETS,
+  unit="Seconds"
+)
+DYNAMODB_CONSUMED_CAPACITY = Counter(
+  "availability_dynamodb_consumed_capacity_units_total", "DynamoDB capacity units consumed",
+  labels=("operation", "table"), unit="Count"
+)
+DYNAMODB_THROTTLES = Counter(
+  "availability_dynamodb_throttles_total", "DynamoDB requests throttled and retried",
+  labels=("operation",), unit="Count"
+)
+OUTBOX_RELAY_LAG_SECONDS = Histogram(
+  "availability_outbox_relay_lag_seconds",
+  "Time from a commit until its outbox entry is published to the integration channel",
+  buckets=LAG_BUCKETS,
+  unit="Seconds"
+)
+OUTBOX_PUBLISH_FAILURES = Counter(
+  "availability_outbox_publish_failures_total", "Integration channel records rejected and left to retry", unit="Count"
+)
+SNAPSHOT_FAILURES = Counter(
+  "availability_snapshot_failures_total", "Snapshot saves that failed after their commit, left to the next one", unit="Count"
+)
+SNAPSHOTS_TOO_LARGE = Counter(
+  "availability_snapshots_too_large_total", "Snapshots not saved because their item would exceed the size limit", unit="Count"
+)
+APPOINTMENT_COMMANDS = Counter(
+  "availability_appointment_commands_total", "Appointment channel commands handled, by outcome",
+  labels=("outcome",), unit="Count"
+)
@@ -0,0 +1,120 @@
+"""
+Benchmark of decoding DynamoDB cdc records from Kinesis into Events, comparing
+the original per-record json decoding with CdcCodec backends.
+
+Run from the availability directory:
+
+  python -m benchmarks.cdc_decode
+
+  python -m benchmarks.cdc_decode --records 50000 --batch-size 500
+"""
+
+import json
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import Dict, List
+from uuid import uuid4
+
+from availability.domain import Event
+from availability.utils import from_isodatetime
+
+from availability.adapters.cdc_codec import CdcCodec, LOADERS
+
+
+def make_records(n: int) -> List[Dict]:
+  start = datetime(2022, 12, 13, 9)
+  records = []
+  for i in range(n):
+    user_id = f"user-{i % 100}"
+    image = {
+      "event_payload": {"M": {
+        "user_id": {"S": user_id},
+        "appointment_id": {"S": f"appt-{i}"} if i % 3 == 0 else {"NULL": True},
+        "available_at": {"S": (start + timedelta(hours=i % 500)).isoformat()},
+      }},
+      "event_type": {"S": "AvailabilityCreatedEvent"},
+      "version": {"N": str(i + 1)},
+      "user_id": {"S": user_id},
+      "correlation_id": {"S": str(uuid4())},
+      "created": {"S": (start + timedelta(microseconds=i)).isoformat()},
+      "event_id": {"S": str(uuid4())},
+    }
+    envelope = {
+      "awsRegion": "us-east-1",
+      "eventID": str(uuid4()),
+      "eventName": "INSERT",
+      "userIdentity": None,
+      "recordFormat": "application/json",
+      "tableName": "availability-event-store",
+      "dynamodb": {
+        "ApproximateCreationDateTime": 1670974381510,
+        "Keys": {"version": image["version"], "user_id": image["user_id"]},
+        "NewImage": image,
+        "SizeBytes": 283,
+      },
+      "eventSource": "aws:dynamodb",
+    }
+    records.append({
+      "SequenceNumber": str(49636080407048354368315237172905799799558406021643763714 + i),
+      "Data": json.dumps(envelope, separators=(",", ":")).encode("utf-8"),
+      "PartitionKey": "03E27A99AD41451219A4D9629E53091C",
+    })
+  return records
+
+
+def legacy_cdc_message_to_event(message) -> Event:
+  event_data = json.loads(message['Data'].decode('utf-8'))\
+    .get('dynamodb')\
+    .get('NewImage')
+
+  event_payload = event_data['event_payload']['M']
+
+  return Event(
+    event_id=event_data['event_id']['S'],
+    user_id=event_data['user_id']['S'],
+    created=from_isodatetime(event_data['created']['S']),
+    event_type=event_data['event_type']['S'],
+    event_payload={
+      'user_id': event_payload['user_id']['S'],
+      'appointment_id': event_payload['appointment_id'].get('S'),
+      'available_at': from_isodatetime(event_payload['available_at']['S'])
+    },
+    correlation_id=event_data['correlation_id']['S'],
+    version=int(event_data['version']['N'])
+  )
+
+
+def best_of(repeat: int, fn) -> float:
+  best = float("inf")
+  for _ in range(repeat):
+    t0 = perf_counter()
+    fn()
+    best = min(best, perf_counter() - t0)
+  return best
+
+
+if __name__ == '__main__':
+  parser = ArgumentParser("python -m benchmarks.cdc_decode")
+  parser.add_argument('--records', type=int, default=20_000)
+  parser.add_argument('--batch-size', type=int, default=500)
+  parser.add_argument('--repeat', type=int, default=5)
+  args = parser.parse_args()
+
+  records = make_records(args.records)
+  batches = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+
+  expected = [legacy_cdc_message_to_event(r) for r in records]
+  results = [("legacy", best_of(args.repeat, lambda: [legacy_cdc_message_to_event(r) for r in records]))]
+  for backend in sorted(LOADERS):
+    codec = CdcCodec(backend)
+    assert [codec.decode(r) for r in records] == expected
+    assert [e for b in batches for e in codec.decode_batch(b)] == expected
+    results.append((f"{backend}", best_of(args.repeat, lambda: [codec.decode(r) for r in records])))
+    results.append((f"{backend} batch", best_of(args.repeat, lambda: [codec.decode_batch(b) for b in batches])))
+
+  baseline = results[0][1]
+  print(f"{'decoder':>16} {'us/record':>10} {'speedup':>8}")
+  for name, seconds in results:
+    print(f"{name:>16} {seconds / len(records) * 1e6:>10.2f} {baseline / seconds:>7.2f}x")
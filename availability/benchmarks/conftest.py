@@ -0,0 +1,29 @@
+"""
+pytest-benchmark suite of the command, replay, projection and query paths.
+
+Run from the availability directory with the repository's requirements-dev.txt
+installed.
+Record a baseline, typically from the main branch:
+
+  python -m pytest benchmarks --benchmark-save=baseline
+
+then compare a change against it, failing on mean regressions over 15%:
+
+  python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:15%
+
+Results are kept in .benchmarks, --benchmark-compare uses the latest saved
+run so save only baselines, or pass the run number to compare against.
+"""
+
+from typing import List
+
+import pytest
+
+from availability.domain import Event
+
+from benchmarks.replay import make_events
+
+
+@pytest.fixture(scope="session")
+def events_10k() -> List[Event]:
+  return make_events(10_000)
@@ -0,0 +1,63 @@
+"""
+Memory held per event by an aggregate replayed from n events, and the cost of
+serializing an event for the event store.
+
+Run from the availability directory:
+
+  python -m benchmarks.event_memory
+
+  python -m benchmarks.event_memory --events 100000 --repeat 5
+"""
+
+import gc
+import tracemalloc
+
+from argparse import ArgumentParser
+from time import perf_counter
+
+from availability.domain import UserAvailabilityAggregate
+
+from benchmarks.replay import make_events
+
+
+def bytes_per_event(n: int) -> float:
+  gc.collect()
+  tracemalloc.start()
+  try:
+    events = make_events(n)
+    aggregate = UserAvailabilityAggregate(user_id=events[0].user_id, events=events)
+    del events
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  assert aggregate.version == n
+  return size / n
+
+
+def serialize_seconds(serialize, n: int, repeat: int) -> float:
+  events = make_events(n)
+  best = float("inf")
+  for _ in range(repeat):
+    t0 = perf_counter()
+    for event in events:
+      serialize(event)
+    best = min(best, perf_counter() - t0)
+  return best / n
+
+
+def main():
+  parser = ArgumentParser()
+  parser.add_argument("--events", type=int, nargs="+", default=[10_000, 100_000])
+  parser.add_argument("--repeat", type=int, default=3)
+  args = parser.parse_args()
+
+  from availability.utils import event_to_item
+
+  for n in args.events:
+    print(f"{n:>8} events  {bytes_per_event(n):8.0f} bytes/event")
+  print(f"event_to_item {serialize_seconds(event_to_item, 10_000, args.repeat) * 1e6:8.2f} us/event")
+
+
+if __name__ == "__main__":
+  main()
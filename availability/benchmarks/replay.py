@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of UserAvailabilityAggregate replay.
+
+Run from the availability directory:
+
+  python -m benchmarks.replay
+
+  python -m benchmarks.replay --events 10000 100000 --repeat 5
+"""
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from time import perf_counter
+from typing import List
+from uuid import uuid4
+
+from availability.domain import (
+  Event,
+  AvailabilityCreatedEvent,
+  AvailabilityDeletedEvent,
+  AppointmentAddedEvent,
+  AppointmentRemovedEvent,
+  UserAvailabilityAggregate,
+)
+
+
+def make_events(n: int, user_id: str = "bench-user") -> List[Event]:
+  """
+  Builds a realistic stream of n events: every slot is created, roughly a
+  third get an appointment booked, some of those are cancelled again and
+  a tenth of the slots are deleted, so most slots stay live.
+  """
+  start = datetime(2022, 1, 1)
+  events = []
+  slot = 0
+
+  def append(event_cls, available_at, appointment_id=None):
+    version = len(events) + 1
+    events.append(event_cls(
+      event_id=str(uuid4()),
+      user_id=user_id,
+      created=start + timedelta(microseconds=version),
+      event_type=event_cls.__name__,
+      event_payload={"user_id": user_id, "available_at": available_at, "appointment_id": appointment_id},
+      correlation_id=str(uuid4()),
+      version=version
+    ))
+
+  while len(events) < n:
+    available_at = start + timedelta(hours=slot)
+    append(AvailabilityCreatedEvent, available_at)
+    if slot % 3 == 0 and len(events) < n:
+      append(AppointmentAddedEvent, available_at, f"appt-{slot}")
+      if slot % 6 == 0 and len(events) < n:
+        append(AppointmentRemovedEvent, available_at)
+    if slot % 10 == 9 and len(events) < n:
+      append(AvailabilityDeletedEvent, available_at)
+    slot += 1
+
+  return events
+
+
+def bench_replay(events: List[Event], repeat: int) -> float:
+  best = float("inf")
+  for _ in range(repeat):
+    t0 = perf_counter()
+    UserAvailabilityAggregate(user_id=events[0].user_id, events=events)
+    best = min(best, perf_counter() - t0)
+  return best
+
+
+def bench_availability_property(events: List[Event], repeat: int) -> float:
+  aggregate = UserAvailabilityAggregate(user_id=events[0].user_id, events=events)
+  best = float("inf")
+  for _ in range(repeat):
+    t0 = perf_counter()
+    aggregate.availability
+    best = min(best, perf_counter() - t0)
+  return best
+
+
+if __name__ == '__main__':
+  parser = ArgumentParser("python -m benchmarks.replay")
+  parser.add_argument('--events', type=int, nargs='+', default=[10_000, 100_000])
+  parser.add_argument('--repeat', type=int, default=3)
+  args = parser.parse_args()
+
+  print(f"{'events':>10} {'replay s':>10} {'us/event':>10} {'.availability ms':>18}")
+  for n in args.events:
+    events = make_events(n)
+    replay = bench_replay(events, args.repeat)
+    prop = bench_availability_property(events, args.repeat)
+    print(f"{n:>10} {replay:>10.3f} {replay / n * 1e6:>10.2f} {prop * 1000:>18.3f}")
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from availability.utils import to_isodatetime
+
+
+def make_read_model_items(n: int, user_id: str = "bench-user") -> List[Dict]:
+  start = datetime(2022, 1, 1)
+  items = []
+  for i in range(n):
+    item = to_isodatetime({
+      "user_id": user_id,
+      "available_at": start + timedelta(hours=i),
+      "appointment_id": f"appt-{i}" if i % 3 == 0 else None,
+    })
+    item["time_bucket"] = item["available_at"][:10]
+    item["version"] = i + 1
+    items.append(item)
+  return items
+
+
+class PagedTable:
+  """
+  Local stand-in for a boto3 Table answering every query with the given
+  items, page by page. Key conditions and filters are not evaluated so
+  benchmarks against it measure the repository's own cost per item.
+  """
+  def __init__(self, items: List[Dict], max_page_size: int = 1000):
+    self.items = items
+    self.max_page_size = max_page_size
+
+  def query(self, **kwargs) -> Dict:
+    start = kwargs.get("ExclusiveStartKey", {}).get("offset", 0)
+    end = start + min(kwargs.get("Limit", self.max_page_size), self.max_page_size)
+    response = {"Items": self.items[start:end]}
+    if end < len(self.items):
+      response["LastEvaluatedKey"] = {"offset": end}
+    return response
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import pytest
+
+from availability.adapters.cdc_codec import CdcCodec
+from availability.adapters.dynamodb_repo import DynamoAvailabilityRepo
+from availability.adapters.event_processor import cdc_message_to_event
+
+from benchmarks.cdc_decode import make_records
+from benchmarks.stand_ins import PagedTable, make_read_model_items
+
+
+@pytest.fixture(scope="module")
+def records():
+  return make_records(500)
+
+
+def test_cdc_message_to_event(benchmark, records):
+  benchmark(lambda: [cdc_message_to_event(record) for record in records])
+
+
+def test_cdc_codec_decode(benchmark, records):
+  codec = CdcCodec()
+  benchmark(lambda: [codec.decode(record) for record in records])
+
+
+def test_cdc_codec_decode_batch(benchmark, records):
+  codec = CdcCodec()
+  benchmark(codec.decode_batch, records)
+
+
+@pytest.mark.parametrize("page_size", [100, 1000])
+def test_dynamo_availability_fetch(benchmark, page_size):
+  repo = DynamoAvailabilityRepo(PagedTable(make_read_model_items(5_000)), page_size=page_size)
+  result = benchmark(lambda: list(repo.fetch(datetime(2022, 1, 1), datetime(2023, 1, 1), user_id="bench-user")))
+  assert len(result) == 5_000
@@ -0,0 +1,46 @@
+from dataclasses import asdict
+
+import pytest
+
+from availability.domain import UserAvailabilityAggregate
+from availability.utils import event_to_item, to_isodatetime
+
+from benchmarks.replay import make_events
+
+
+@pytest.mark.parametrize("n", [100, 1_000, 10_000, 100_000])
+def test_replay(benchmark, n):
+  events = make_events(n)
+  aggregate = benchmark(UserAvailabilityAggregate, user_id=events[0].user_id, events=events)
+  assert aggregate.version == n
+
+
+@pytest.mark.parametrize("tail", [0, 10, 100])
+def test_load_from_snapshot(benchmark, events_10k, tail):
+  # loading a 10k event aggregate from a snapshot plus the events after it,
+  # against test_replay for the full replay it saves
+  split = len(events_10k) - tail
+  snapshot = UserAvailabilityAggregate(user_id=events_10k[0].user_id, events=events_10k[:split]).snapshot()
+  aggregate = benchmark(
+    lambda: UserAvailabilityAggregate(user_id=snapshot.user_id, events=events_10k[split:], snapshot=snapshot)
+  )
+  assert aggregate.version == len(events_10k)
+
+
+def test_availability_property(benchmark, events_10k):
+  aggregate = UserAvailabilityAggregate(user_id=events_10k[0].user_id, events=events_10k)
+  benchmark(lambda: aggregate.availability)
+
+
+def test_to_isodatetime_event(benchmark, events_10k):
+  data = events_10k[0].to_dict()
+  benchmark(to_isodatetime, data)
+
+
+def test_to_isodatetime_asdict_event(benchmark, events_10k):
+  # the stored form as it was built before the schema encoders
+  benchmark(lambda: to_isodatetime(asdict(events_10k[0])))
+
+
+def test_event_to_item(benchmark, events_10k):
+  benchmark(event_to_item, events_10k[0])
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from itertools import count
+
+from availability.adapters.memory_repo import InMemoryAvailabilityRepo, InMemoryEventStoreRepo
+from availability.domain import Availability, CreateAvailabilityCommand, EveryNEventsSnapshotPolicy
+from availability.service import (
+  AggregateCache,
+  AvailabilityCommandHandler,
+  AvailabilityEventHandler,
+  AvailabilityQueryService,
+)
+
+
+def create(user_id: str, hour: int) -> CreateAvailabilityCommand:
+  return CreateAvailabilityCommand(
+    correlation_id="bench",
+    user_id=user_id,
+    available_at=datetime(2022, 1, 1) + timedelta(hours=hour),
+  )
+
+
+# the event store grows with every commit so the number of rounds is fixed
+# to keep aggregates the same size from run to run
+COMMIT_ROUNDS = 5_000
+
+
+def test_command_commit_cached(benchmark):
+  repo, cache = InMemoryEventStoreRepo(EveryNEventsSnapshotPolicy(100)), AggregateCache()
+  hours = count()
+
+  def commit():
+    hour = next(hours)
+    user_id = f"user-{hour % 100}"
+    with AvailabilityCommandHandler(user_id, repo, cache) as handler:
+      handler.add_availability(create(user_id, hour))
+
+  benchmark.pedantic(commit, rounds=COMMIT_ROUNDS)
+
+
+def test_command_commit_uncached(benchmark):
+  repo = InMemoryEventStoreRepo(EveryNEventsSnapshotPolicy(100))
+  hours = count()
+
+  def commit():
+    hour = next(hours)
+    user_id = f"user-{hour % 100}"
+    with AvailabilityCommandHandler(user_id, repo) as handler:
+      handler.add_availability(create(user_id, hour))
+
+  benchmark.pedantic(commit, rounds=COMMIT_ROUNDS)
+
+
+def test_command_commit_read_your_writes(benchmark):
+  repo, cache = InMemoryEventStoreRepo(EveryNEventsSnapshotPolicy(100)), AggregateCache()
+  projector = AvailabilityEventHandler(InMemoryAvailabilityRepo())
+  hours = count()
+
+  def commit():
+    hour = next(hours)
+    user_id = f"user-{hour % 100}"
+    with AvailabilityCommandHandler(user_id, repo, cache, projector=projector) as handler:
+      handler.add_availability(create(user_id, hour))
+
+  benchmark.pedantic(commit, rounds=COMMIT_ROUNDS)
+
+
+def fresh_handler():
+  return (AvailabilityEventHandler(InMemoryAvailabilityRepo()),), {}
+
+
+def test_event_handler_handle(benchmark, events_10k):
+  def handle_all(handler):
+    for event in events_10k:
+      handler.handle(event)
+
+  benchmark.pedantic(handle_all, setup=fresh_handler, rounds=10)
+
+
+def test_event_handler_handle_batch(benchmark, events_10k):
+  batches = [events_10k[i:i + 500] for i in range(0, len(events_10k), 500)]
+
+  def handle_batches(handler):
+    for batch in batches:
+      handler.handle_batch(batch)
+
+  benchmark.pedantic(handle_batches, setup=fresh_handler, rounds=10)
+
+
+def test_query_service_fetch(benchmark):
+  repo = InMemoryAvailabilityRepo()
+  for hour in range(10_000):
+    repo.create(Availability(user_id="bench-user", available_at=datetime(2022, 1, 1) + timedelta(hours=hour), appointment_id=None))
+  svc = AvailabilityQueryService(repo)
+  result = benchmark(svc.fetch, user_id="bench-user", start=datetime(2022, 1, 1), end=datetime(2022, 1, 8))
+  assert len(result) == 7 * 24
@@ -0,0 +1,56 @@
+import pytest
+
+from tests.unit.fixtures import create_table
+
+
+@pytest.fixture
+def aws(monkeypatch):
+  """
+  AWS services mocked by moto, with fake credentials in us-east-1.
+  """
+  import moto
+
+  monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+  monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+  monkeypatch.setenv("AWS_SESSION_TOKEN", "testing")
+  monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+  if hasattr(moto, "mock_aws"):
+    mocks = [moto.mock_aws()]
+  else:
+    mocks = [moto.mock_dynamodb(), moto.mock_kinesis(), moto.mock_ssm()]
+  for mock in mocks:
+    mock.start()
+  yield
+  for mock in reversed(mocks):
+    mock.stop()
+
+
+@pytest.fixture
+def dynamodb(aws):
+  """
+  DynamoDB resource with the tables of aws/infra_stack.py created under
+  their default names.
+  """
+  import boto3
+
+  resource = boto3.resource("dynamodb", region_name="us-east-1")
+  create_table(resource, "availability-event-store", {"user_id": "S", "version": "N"})
+  create_table(resource, "availability-snapshot", {"user_id": "S"})
+  create_table(resource, "availability-consumer", {"shard": "S"})
+  create_table(resource, "availability-outbox", {"segment": "N", "entry_id": "S"})
+  create_table(
+    resource,
+    "availability-read-model",
+    {"user_id": "S", "available_at": "S"},
+    index_keys={"time_bucket": "S"},
+    GlobalSecondaryIndexes=[{
+      "IndexName": "time-bucket-index",
+      "KeySchema": [
+        {"AttributeName": "time_bucket", "KeyType": "HASH"},
+        {"AttributeName": "available_at", "KeyType": "RANGE"},
+      ],
+      "Projection": {"ProjectionType": "ALL"},
+    }]
+  )
+  return resource
@@ -0,0 +1,60 @@
+"""
+Helpers shared by the unit tests, the fixtures using them are in conftest.
+"""
+
+import json
+
+from decimal import Decimal
+from typing import Dict
+
+from availability.domain import Event
+from availability.utils import event_to_item
+
+
+def create_table(dynamodb, name: str, keys: Dict[str, str], **kwargs):
+  """
+  Creates a table keyed by keys, attribute names to types in the order of
+  partition and sort key, as declared in aws/infra_stack.py.
+  """
+  return dynamodb.create_table(
+    TableName=name,
+    KeySchema=[
+      {"AttributeName": key, "KeyType": key_type}
+      for key, key_type in zip(keys, ("HASH", "RANGE"))
+    ],
+    AttributeDefinitions=[
+      {"AttributeName": key, "AttributeType": attr_type}
+      for key, attr_type in {**keys, **kwargs.pop("index_keys", {})}.items()
+    ],
+    BillingMode="PAY_PER_REQUEST",
+    **kwargs
+  )
+
+
+def ddb_attribute(value) -> Dict:
+  if value is None:
+    return {"NULL": True}
+  if isinstance(value, dict):
+    return {"M": {k: ddb_attribute(v) for k, v in value.items()}}
+  if isinstance(value, (int, float, Decimal)):
+    return {"N": str(value)}
+  return {"S": value}
+
+
+def cdc_data(event: Event) -> bytes:
+  """
+  Data of the Kinesis record DynamoDB change data capture writes for the
+  insert of event into the event store.
+  """
+  image = {k: ddb_attribute(v) for k, v in event_to_item(event).items()}
+  return json.dumps({
+    "awsRegion": "us-east-1",
+    "eventName": "INSERT",
+    "tableName": "availability-event-store",
+    "dynamodb": {
+      "ApproximateCreationDateTime": 1670974381510,
+      "Keys": {"user_id": image["user_id"], "version": image["version"]},
+      "NewImage": image,
+    },
+    "eventSource": "aws:dynamodb",
+  }).encode("utf-8")
@@ -0,0 +1,135 @@
+import asyncio
+
+from datetime import datetime, timedelta
+
+from availability.domain import CreateAvailabilityCommand
+from availability.adapters.memory_repo import AsyncInMemoryEventStoreRepo, InMemoryEventStoreRepo
+from availability.service import AggregateCache, AvailabilityCommandHandler
+
+
+START = datetime(2030, 1, 1)
+
+
+class Clock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+def create(user_id, hour):
+  return CreateAvailabilityCommand(correlation_id="c", user_id=user_id, available_at=START + timedelta(hours=hour))
+
+
+def commit(repo, cache, user_id, *hours):
+  with AvailabilityCommandHandler(user_id=user_id, events_repo=repo, aggregate_cache=cache) as handler:
+    for hour in hours:
+      handler.add_availability(create(user_id, hour))
+  return handler.aggregate
+
+
+def hours(aggregate):
+  return [a.available_at.hour for a in aggregate.availability]
+
+
+def test_checked_out_aggregates_are_not_shared_until_checked_in():
+  repo, cache = InMemoryEventStoreRepo(), AggregateCache()
+  aggregate = commit(repo, cache, "u1", 1)
+
+  first = cache.checkout("u1", repo)
+  second = cache.checkout("u1", repo)
+  assert first is aggregate and second is not first
+
+  second.add_availability(create("u1", 2))
+  cache.checkin(second)
+  assert len(cache) == 0
+  assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_cached_aggregate_catches_up_with_events_appended_by_another_writer():
+  repo, cache = InMemoryEventStoreRepo(), AggregateCache()
+  commit(repo, cache, "u1", 1)
+  commit(repo, None, "u1", 2, 3)
+
+  aggregate = cache.checkout("u1", repo)
+
+  assert (aggregate.version, hours(aggregate)) == (3, [1, 2, 3])
+  assert [e.version for e in aggregate.events] == [2, 3]
+
+
+def test_catch_up_events_are_applied_in_version_order_whatever_their_creation_time():
+  repo, cache = InMemoryEventStoreRepo(), AggregateCache()
+  commit(repo, cache, "u1", 1)
+  commit(repo, None, "u1", 2)
+  commit(repo, None, "u1", 3)
+  # clocks of different writers can put a later commit's events earlier
+  later, earlier = repo.fetch_events("u1", after_version=1)
+  later.created, earlier.created = earlier.created, later.created
+
+  aggregate = cache.checkout("u1", repo)
+
+  assert [e.version for e in aggregate.events] == [2, 3]
+  assert (aggregate.version, hours(aggregate)) == (3, [1, 2, 3])
+
+
+class GappedRepo(InMemoryEventStoreRepo):
+  """
+  Returns the catch-up events of a user without the first of them.
+  """
+  def fetch_events(self, user_id, after_version: int = 0):
+    events = super().fetch_events(user_id, after_version)
+    return events[1:] if after_version else events
+
+
+def test_a_gap_in_the_catch_up_events_reloads_the_aggregate():
+  repo, cache = GappedRepo(), AggregateCache()
+  commit(repo, cache, "u1", 1)
+  commit(repo, None, "u1", 2, 3)
+
+  aggregate = cache.checkout("u1", repo)
+
+  assert (aggregate.version, hours(aggregate)) == (3, [1, 2, 3])
+  assert [e.version for e in aggregate.events] == [1, 2, 3]
+
+
+def test_committed_events_are_dropped_on_checkin():
+  repo, cache = InMemoryEventStoreRepo(), AggregateCache()
+  for hour in range(10):
+    aggregate = commit(repo, cache, "u1", hour)
+
+  assert aggregate.events == [] and aggregate.version == 10
+  assert hours(cache.checkout("u1", repo)) == list(range(10))
+
+
+def test_least_recently_used_aggregates_are_evicted():
+  repo, cache = InMemoryEventStoreRepo(), AggregateCache(max_size=2)
+  for user_id in ("u1", "u2"):
+    commit(repo, cache, user_id, 1)
+  cache.checkin(cache.checkout("u1", repo))
+  commit(repo, cache, "u3", 1)
+
+  assert cache.stats()["evictions"] == 1
+  assert cache.checkout("u2", repo) is not None and cache.misses == 4
+  assert cache.checkout("u1", repo).version == 1 and cache.hits == 2
+
+
+def test_expired_aggregates_are_fetched_again():
+  repo, clock = InMemoryEventStoreRepo(), Clock()
+  cache = AggregateCache(ttl=10.0, clock=clock)
+  commit(repo, cache, "u1", 1)
+  clock.now = 10.0
+
+  cache.checkout("u1", repo)
+
+  assert cache.stats()["expirations"] == 1 and cache.hits == 0
+
+
+def test_async_checkout_catches_up_from_the_async_repo():
+  repo, cache = InMemoryEventStoreRepo(), AggregateCache()
+  commit(repo, cache, "u1", 1)
+  commit(repo, None, "u1", 2)
+
+  aggregate = asyncio.run(cache.acheckout("u1", AsyncInMemoryEventStoreRepo(repo)))
+
+  assert (aggregate.version, hours(aggregate), cache.hits) == (2, [1, 2], 1)
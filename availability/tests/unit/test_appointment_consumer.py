@@ -0,0 +1,42 @@
+import json
+
+from availability.config import AppContext
+from availability.adapters.appointment_consumer import AppointmentShardWorker
+
+from tests.unit.test_appointment_handlers import appointments, slots
+
+
+def record(sequence_number: int, data) -> dict:
+  if not isinstance(data, (bytes, str)):
+    data = json.dumps(data)
+  return {"SequenceNumber": str(sequence_number), "Data": data, "PartitionKey": "u1"}
+
+
+def booked(walker_id: str, available_at: str, appointment_id: str) -> dict:
+  return {
+    "event_type": "AppointmentBookedEvent",
+    "event_id": f"e-{appointment_id}",
+    "walker_id": walker_id,
+    "available_at": available_at,
+    "appointment_id": appointment_id,
+  }
+
+
+def test_malformed_records_are_skipped_without_holding_back_the_shard(aws):
+  ctx = AppContext(repo_backend="memory", aws_region="us-east-1")
+  worker = AppointmentShardWorker(ctx, 0, 1)
+  slots(ctx.event_store_repo, "u1", [1, 2])
+
+  missing_walker = booked("u1", "2030-01-01T01:00:00", "a0")
+  del missing_walker["walker_id"]
+  worker.process_records([
+    record(1, b"{not json"),
+    record(2, missing_walker),
+    record(3, booked("u1", "tomorrow", "a0")),
+    record(4, json.dumps([1, 2])),
+    record(5, booked("u1", "2030-01-01T01:00:00", "a1")),
+    record(6, {"event_type": "WalkerRatedEvent"}),
+    record(7, booked("u1", "2030-01-01T02:00:00", "a2")),
+  ])
+
+  assert appointments(ctx.event_store_repo, "u1") == ["a1", "a2"]
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from availability.domain import AddAppointmentCommand, CreateAvailabilityCommand, Event, RemoveAppointmentCommand
+from availability.adapters.memory_repo import InMemoryEventStoreRepo
+from availability.service import AppointmentBatchHandler, AvailabilityCommandHandler
+from availability.service.appointment_handlers import (
+  APPOINTMENT_APPLIED,
+  APPOINTMENT_FAILED,
+  APPOINTMENT_REJECTED,
+  APPOINTMENT_SKIPPED,
+)
+
+
+START = datetime(2030, 1, 1)
+
+
+class CountingEventStoreRepo(InMemoryEventStoreRepo):
+  def __init__(self):
+    super().__init__()
+    self.fetches = 0
+    self.appends = 0
+    self.interfere = False
+
+  def fetch(self, user_id):
+    self.fetches += 1
+    return super().fetch(user_id)
+
+  def append(self, events: List[Event]):
+    self.appends += 1
+    if self.interfere:
+      # another writer books u1's first slot just before this append
+      self.interfere = False
+      with AvailabilityCommandHandler(user_id="u1", events_repo=self) as other:
+        other.add_appointment(book("u1", 1, "other"))
+    super().append(events)
+
+
+def slots(repo, user_id, hours):
+  handler = AvailabilityCommandHandler(user_id=user_id, events_repo=repo)
+  with handler:
+    for hour in hours:
+      handler.add_availability(CreateAvailabilityCommand(
+        correlation_id="c", user_id=user_id, available_at=START + timedelta(hours=hour)
+      ))
+
+
+def book(user_id, hour, appointment_id):
+  return AddAppointmentCommand(
+    correlation_id=appointment_id, user_id=user_id, available_at=START + timedelta(hours=hour), appointment_id=appointment_id
+  )
+
+
+def cancel(user_id, hour, appointment_id=None):
+  return RemoveAppointmentCommand(
+    correlation_id="x", user_id=user_id, available_at=START + timedelta(hours=hour), appointment_id=appointment_id
+  )
+
+
+def appointments(repo, user_id):
+  return [a.appointment_id for a in repo.fetch(user_id).availability]
+
+
+def test_each_walker_is_loaded_and_committed_once_per_batch():
+  repo = CountingEventStoreRepo()
+  slots(repo, "u1", [1, 2, 3])
+  slots(repo, "u2", [1])
+  repo.fetches = repo.appends = 0
+
+  counts = AppointmentBatchHandler(repo).handle_batch([
+    book("u1", 1, "a1"),
+    book("u2", 1, "a2"),
+    book("u1", 2, "a3"),
+    book("u1", 1, "a1"),
+    cancel("u1", 2, "a3"),
+    book("u1", 9, "a4"),
+  ])
+
+  assert counts == {APPOINTMENT_APPLIED: 4, APPOINTMENT_SKIPPED: 1, APPOINTMENT_REJECTED: 1, APPOINTMENT_FAILED: 0}
+  assert (repo.fetches, repo.appends) == (2, 2)
+  assert appointments(repo, "u1") == ["a1", None, None]
+  assert appointments(repo, "u2") == ["a2"]
+
+
+def test_redelivery_and_stale_cancellations_leave_bookings_as_they_are():
+  repo = CountingEventStoreRepo()
+  slots(repo, "u1", [1, 2])
+  handler = AppointmentBatchHandler(repo)
+  batch = [book("u1", 1, "a1"), book("u1", 2, "a2")]
+  handler.handle_batch(batch)
+
+  assert handler.handle_batch(batch)[APPOINTMENT_SKIPPED] == 2
+  handler.handle_batch([cancel("u1", 2, "a2"), book("u1", 2, "a3"), cancel("u1", 2, "a2")])
+  assert appointments(repo, "u1") == ["a1", "a3"]
+
+
+def test_commands_are_decided_again_after_a_concurrent_write():
+  repo = CountingEventStoreRepo()
+  slots(repo, "u1", [1, 2])
+  repo.interfere = True
+
+  counts = AppointmentBatchHandler(repo, retries=1).handle_batch([book("u1", 1, "a1"), book("u1", 2, "a2")])
+
+  assert counts == {APPOINTMENT_APPLIED: 1, APPOINTMENT_SKIPPED: 0, APPOINTMENT_REJECTED: 1, APPOINTMENT_FAILED: 0}
+  assert appointments(repo, "u1") == ["other", "a2"]
+
+
+def test_commands_still_conflicting_after_the_retries_fail_without_holding_back_others():
+  repo = CountingEventStoreRepo()
+  slots(repo, "u1", [1, 2])
+  slots(repo, "u2", [1])
+  repo.interfere = True
+
+  counts = AppointmentBatchHandler(repo, retries=0).handle_batch([
+    book("u1", 2, "a1"),
+    book("u2", 1, "a2"),
+  ])
+
+  assert counts[APPOINTMENT_FAILED] == 1 and counts[APPOINTMENT_APPLIED] == 1
+  assert appointments(repo, "u1") == ["other", None]
+  assert appointments(repo, "u2") == ["a2"]
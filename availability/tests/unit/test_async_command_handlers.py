@@ -0,0 +1,104 @@
+import asyncio
+
+from datetime import datetime
+from typing import List
+
+import pytest
+
+from availability.domain import (
+  ConcurrencyException,
+  CreateAvailabilityCommand,
+  Event,
+  UserAvailabilityAggregate,
+)
+from availability.adapters.memory_repo import AsyncInMemoryAvailabilityRepo
+from availability.ports import AsyncEventStoreRepo
+from availability.service import (
+  AggregateCache,
+  AsyncAvailabilityCommandHandler,
+  AsyncAvailabilityEventHandler,
+  QueryCache,
+)
+
+
+class FakeAsyncEventStoreRepo(AsyncEventStoreRepo):
+  def __init__(self):
+    self.events: List[Event] = []
+    self.fetches = 0
+
+  async def fetch(self, user_id) -> UserAvailabilityAggregate:
+    self.fetches += 1
+    return UserAvailabilityAggregate(user_id=user_id, events=await self.fetch_events(user_id))
+
+  async def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    await asyncio.sleep(0)
+    return [e for e in self.events if e.user_id == user_id and e.version > after_version]
+
+  async def append(self, events: List[Event]):
+    await asyncio.sleep(0)
+    stored = {(e.user_id, e.version) for e in self.events}
+    if any((e.user_id, e.version) in stored for e in events):
+      raise ConcurrencyException("version exists")
+    self.events.extend(events)
+
+
+def create(user_id, hour):
+  return CreateAvailabilityCommand(
+    correlation_id="c1",
+    user_id=user_id,
+    available_at=datetime(2022, 12, 13, hour),
+  )
+
+
+async def add(repo, hour, retries=0, cache=None, projector=None):
+  async with AsyncAvailabilityCommandHandler(
+    "abc123", repo, aggregate_cache=cache, retries=retries, projector=projector
+  ) as handler:
+    await asyncio.sleep(0)
+    handler.add_availability(create("abc123", hour))
+  return handler
+
+
+def test_commit_appends_events_and_caches_aggregate():
+  repo = FakeAsyncEventStoreRepo()
+  cache = AggregateCache(max_size=4)
+
+  asyncio.run(add(repo, 9, cache=cache))
+  handler = asyncio.run(add(repo, 10, cache=cache))
+
+  assert [e.version for e in repo.events] == [1, 2]
+  assert handler.aggregate.version == 2
+  assert repo.fetches == 1
+  assert cache.stats()["hits"] == 1
+
+
+def test_concurrent_commands_conflict_and_retry():
+  async def run(retries):
+    repo = FakeAsyncEventStoreRepo()
+    await asyncio.gather(add(repo, 9, retries), add(repo, 10, retries))
+    return repo
+
+  with pytest.raises(ConcurrencyException):
+    asyncio.run(run(retries=0))
+
+  repo = asyncio.run(run(retries=1))
+  assert [e.version for e in repo.events] == [1, 2]
+  assert sorted(e.event_payload["available_at"].hour for e in repo.events) == [9, 10]
+
+
+def test_must_be_used_with_async_with():
+  with pytest.raises(TypeError):
+    with AsyncAvailabilityCommandHandler("abc123", FakeAsyncEventStoreRepo()):
+      pass
+
+
+def test_projector_updates_read_model_and_invalidates_queries():
+  repo, read_model, query_cache = FakeAsyncEventStoreRepo(), AsyncInMemoryAvailabilityRepo(), QueryCache()
+  projector = AsyncAvailabilityEventHandler(read_model, query_cache)
+  generation = query_cache.generation
+
+  asyncio.run(add(repo, 9, projector=projector))
+
+  availability = asyncio.run(read_model.fetch(datetime(2022, 12, 13), user_id="abc123"))
+  assert [a.available_at.hour for a in availability] == [9]
+  assert query_cache.generation == generation + 1
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from datetime import datetime
+from threading import Lock
+
+from availability.domain import Event, AvailabilityCreatedEvent
+from availability.service import AsyncProjector
+
+
+class RecordingHandler:
+  def __init__(self):
+    self.handled = []
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self._lock = Lock()
+
+  def handle(self, event: Event):
+    with self._lock:
+      self.in_flight += 1
+      self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    time.sleep(0.005)
+    with self._lock:
+      self.in_flight -= 1
+      self.handled.append((event.user_id, event.version))
+
+
+def event(user_id, version):
+  return AvailabilityCreatedEvent(
+    event_id=f"{user_id}-{version}",
+    user_id=user_id,
+    created=datetime(2022, 12, 13, 8),
+    event_type=AvailabilityCreatedEvent.__name__,
+    event_payload={"user_id": user_id, "available_at": datetime(2022, 12, 13, version), "appointment_id": None},
+    correlation_id="c1",
+    version=version
+  )
+
+
+async def source(events):
+  for e in events:
+    yield e
+
+
+def test_projects_users_concurrently_and_in_order():
+  handler = RecordingHandler()
+  projector = AsyncProjector(handler, max_in_flight=4)
+  events = [event(f"user-{u}", v) for v in range(1, 6) for u in range(8)]
+
+  asyncio.run(projector.run(source(events)))
+
+  assert len(handler.handled) == len(events)
+  assert 1 < handler.max_in_flight <= 4
+  for u in range(8):
+    versions = [v for user_id, v in handler.handled if user_id == f"user-{u}"]
+    assert versions == [1, 2, 3, 4, 5]
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+
+from availability.domain import AppointmentAddedEvent
+from availability.adapters.cdc_codec import LOADERS, CdcCodec, compile_unmarshaller
+
+from benchmarks.cdc_decode import legacy_cdc_message_to_event, make_records
+from tests.unit.fixtures import cdc_data
+
+
+@pytest.mark.parametrize("backend", sorted(LOADERS))
+def test_generated_decoder_matches_the_legacy_decoder(backend):
+  records = make_records(300)
+
+  codec = CdcCodec(backend)
+  decoded = [codec.decode(record) for record in records]
+
+  assert decoded == [legacy_cdc_message_to_event(record) for record in records]
+  assert codec.decode_batch(records) == decoded
+  assert any(e.event_payload["appointment_id"] is None for e in decoded)
+
+
+def test_decoded_event_equals_the_event_written():
+  event = AppointmentAddedEvent(
+    event_id="e1",
+    user_id="abc123",
+    created=datetime(2022, 12, 13, 17, 33, 1, 310159),
+    event_type=AppointmentAddedEvent.__name__,
+    event_payload={"user_id": "abc123", "available_at": datetime(2022, 12, 13, 18), "appointment_id": "a1"},
+    correlation_id="c1",
+    version=7
+  )
+
+  decoded = CdcCodec().decode({"Data": cdc_data(event)})
+
+  assert decoded == legacy_cdc_message_to_event({"Data": cdc_data(event)})
+  assert (decoded.event_payload, decoded.version, decoded.created) == (event.event_payload, 7, event.created)
+
+
+def test_unknown_attribute_types_are_rejected():
+  with pytest.raises(ValueError):
+    compile_unmarshaller({"version": "BOOL"})
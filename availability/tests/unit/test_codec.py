@@ -0,0 +1,58 @@
+from datetime import datetime
+
+import pytest
+
+from availability.domain import Availability, AppointmentAddedEvent
+from availability.utils import compile_encoder, to_isodatetime, to_item, to_json, DATETIME, STRING
+
+
+def test_to_isodatetime_converts_nested_datetimes_and_keeps_scalars():
+  dt = datetime(2022, 12, 13, 9)
+
+  assert to_isodatetime(dt) == "2022-12-13T09:00:00"
+  assert to_isodatetime(5) == 5
+  assert to_isodatetime([1, "a", None]) == [1, "a", None]
+  assert to_isodatetime({"a": [dt, {"b": dt}], "c": (1, dt)}) == {
+    "a": ["2022-12-13T09:00:00", {"b": "2022-12-13T09:00:00"}],
+    "c": [1, "2022-12-13T09:00:00"],
+  }
+
+
+def test_to_item_encodes_subclasses_with_the_base_encoder():
+  available_at = datetime(2022, 12, 13, 9)
+  event = AppointmentAddedEvent(
+    event_id="e1",
+    user_id="abc123",
+    created=datetime(2022, 12, 1, 8, 30),
+    event_type=AppointmentAddedEvent.__name__,
+    event_payload={"user_id": "abc123", "available_at": available_at, "appointment_id": "appt1"},
+    correlation_id="c1",
+    version=3
+  )
+
+  assert to_item(event)["event_payload"] == {
+    "user_id": "abc123",
+    "available_at": "2022-12-13T09:00:00",
+    "appointment_id": "appt1",
+  }
+  assert to_item(Availability(user_id="abc123", available_at=available_at, appointment_id=None)) == {
+    "user_id": "abc123",
+    "available_at": "2022-12-13T09:00:00",
+    "appointment_id": None,
+  }
+  assert to_json(to_item(event)).startswith('{"event_id":"e1"')
+  with pytest.raises(TypeError):
+    to_item(object())
+
+
+def test_compile_encoder_rejects_unknown_types():
+  assert compile_encoder({"user_id": STRING, "available_at": DATETIME})
+  with pytest.raises(ValueError):
+    compile_encoder({"user_id": "bytes"})
+
+
+def test_utils_reexports_only_the_public_names_of_its_modules():
+  import availability.utils as utils
+
+  assert {"event_to_item", "event_from_item", "to_json", "to_isodatetime"} <= set(dir(utils))
+  assert not {"datetime", "Decimal", "json", "orjson", "Event", "Availability"} & set(dir(utils))
@@ -0,0 +1,173 @@
+from datetime import datetime, timedelta
+from typing import List
+
+import pytest
+
+from availability.domain import (
+  AddAppointmentCommand,
+  AvailabilityExistsException,
+  ConcurrencyException,
+  CreateAvailabilityCommand,
+  DeleteAvailabilityCommand,
+  Event,
+  TooManyEventsException,
+  UserAvailabilityAggregate,
+)
+from availability.adapters.memory_repo import InMemoryAvailabilityRepo
+from availability.ports import EventStoreRepo, APPLIED, SKIPPED_DUPLICATE
+from availability.service import AggregateCache, AvailabilityCommandHandler, AvailabilityEventHandler
+from availability.utils import metrics
+
+
+class FakeEventStoreRepo(EventStoreRepo):
+  def __init__(self):
+    self.events: List[Event] = []
+    self.appends = 0
+
+  def fetch(self, user_id) -> UserAvailabilityAggregate:
+    return UserAvailabilityAggregate(user_id=user_id, events=self.fetch_events(user_id))
+
+  def fetch_events(self, user_id, after_version: int = 0) -> List[Event]:
+    return [e for e in self.events if e.user_id == user_id and e.version > after_version]
+
+  def append(self, events: List[Event]):
+    self.appends += 1
+    stored = {(e.user_id, e.version) for e in self.events}
+    if any((e.user_id, e.version) in stored for e in events):
+      raise ConcurrencyException("version exists")
+    self.events.extend(events)
+
+  def scan_events(self, segment: int, total_segments: int, after=None, page_size: int = None):
+    raise NotImplementedError
+
+
+def create(user_id, hour, appointment_id=None):
+  return CreateAvailabilityCommand(
+    correlation_id="c1",
+    user_id=user_id,
+    available_at=datetime(2022, 12, 13, hour),
+    appointment_id=appointment_id
+  )
+
+
+def test_commit_appends_all_events_in_one_batch():
+  repo = FakeEventStoreRepo()
+  handler = AvailabilityCommandHandler("abc123", repo)
+  with handler:
+    handler.add_availability(create("abc123", 9, appointment_id="appt-1"))
+
+  assert repo.appends == 1
+  assert [e.version for e in repo.events] == [1, 2]
+  assert handler.aggregate.version == 2
+
+
+def test_conflict_raises_without_retries():
+  repo = FakeEventStoreRepo()
+  handler = AvailabilityCommandHandler("abc123", repo)
+  with AvailabilityCommandHandler("abc123", repo) as other:
+    other.add_availability(create("abc123", 10))
+
+  with pytest.raises(ConcurrencyException):
+    with handler:
+      handler.add_availability(create("abc123", 9))
+
+
+def test_conflict_reloads_and_reapplies_with_retries():
+  repo = FakeEventStoreRepo()
+  handler = AvailabilityCommandHandler("abc123", repo, retries=1)
+  with AvailabilityCommandHandler("abc123", repo) as other:
+    other.add_availability(create("abc123", 10))
+
+  with handler:
+    handler.add_availability(create("abc123", 9))
+
+  assert [e.version for e in repo.events] == [1, 2]
+  assert [a.available_at.hour for a in handler.aggregate.availability] == [9, 10]
+
+
+def test_handle_all_appends_every_command_in_one_batch():
+  repo = FakeEventStoreRepo()
+  with AvailabilityCommandHandler("abc123", repo) as handler:
+    handler.handle_all([
+      create("abc123", 9),
+      create("abc123", 10),
+      AddAppointmentCommand(correlation_id="c1", user_id="abc123", available_at=datetime(2022, 12, 13, 9), appointment_id="appt-1"),
+      DeleteAvailabilityCommand(correlation_id="c1", user_id="abc123", available_at=datetime(2022, 12, 13, 10)),
+    ])
+
+  assert repo.appends == 1
+  assert [e.version for e in repo.events] == [1, 2, 3, 4]
+  assert [(a.available_at.hour, a.appointment_id) for a in handler.aggregate.availability] == [(9, "appt-1")]
+
+
+def test_handle_all_appends_nothing_when_a_command_is_rejected():
+  repo = FakeEventStoreRepo()
+  with pytest.raises(AvailabilityExistsException):
+    with AvailabilityCommandHandler("abc123", repo) as handler:
+      handler.handle_all([create("abc123", 9), create("abc123", 10), create("abc123", 9)])
+
+  assert repo.appends == 0
+  assert repo.events == []
+
+
+def test_handle_all_rejects_more_events_than_one_append_takes():
+  repo = FakeEventStoreRepo()
+  with pytest.raises(TooManyEventsException):
+    with AvailabilityCommandHandler("abc123", repo) as handler:
+      # each slot created with an appointment raises two events
+      handler.handle_all([
+        CreateAvailabilityCommand(
+          correlation_id="c1",
+          user_id="abc123",
+          available_at=datetime(2022, 12, 13) + timedelta(hours=h),
+          appointment_id=f"appt-{h}"
+        )
+        for h in range(51)
+      ])
+
+  assert repo.appends == 0
+
+
+def test_projector_makes_commits_readable_before_cdc_delivers_them():
+  repo, read_model = FakeEventStoreRepo(), InMemoryAvailabilityRepo()
+  projector = AvailabilityEventHandler(read_model)
+  with AvailabilityCommandHandler("abc123", repo, projector=projector) as handler:
+    handler.add_availability(create("abc123", 9, appointment_id="appt-1"))
+
+  assert [a.appointment_id for a in read_model.fetch(datetime(2022, 12, 13), user_id="abc123")] == ["appt-1"]
+  assert projector.stats()[APPLIED] == 1
+
+  cdc = AvailabilityEventHandler(read_model)
+  cdc.handle_batch(repo.events)
+  assert cdc.stats()[APPLIED] == 0
+  assert cdc.stats()[SKIPPED_DUPLICATE] == 1
+
+
+def test_projection_failure_does_not_fail_the_command():
+  class FailingProjector:
+    def handle_committed(self, events):
+      raise RuntimeError("read model unavailable")
+
+  repo = FakeEventStoreRepo()
+  with AvailabilityCommandHandler("abc123", repo, projector=FailingProjector()) as handler:
+    handler.add_availability(create("abc123", 9))
+
+  assert [e.version for e in repo.events] == [1]
+
+
+def test_snapshot_failure_does_not_fail_the_command(monkeypatch):
+  class FailingSnapshotRepo(FakeEventStoreRepo):
+    def save_snapshot(self, aggregate: UserAvailabilityAggregate):
+      raise RuntimeError("throttled")
+
+  monkeypatch.setattr(metrics.REGISTRY, "enabled", True)
+  failures = metrics.SNAPSHOT_FAILURES.value()
+  repo, read_model, cache = FailingSnapshotRepo(), InMemoryAvailabilityRepo(), AggregateCache()
+  projector = AvailabilityEventHandler(read_model)
+  with AvailabilityCommandHandler("abc123", repo, aggregate_cache=cache, projector=projector) as handler:
+    handler.add_availability(create("abc123", 9))
+
+  assert [e.version for e in repo.events] == [1]
+  assert metrics.SNAPSHOT_FAILURES.value() == failures + 1
+  assert cache.checkout("abc123", repo).version == 1 and cache.stats()["hits"] == 1
+  assert projector.stats()[APPLIED] == 1
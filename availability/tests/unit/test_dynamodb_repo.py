@@ -0,0 +1,194 @@
+from dataclasses import asdict
+from datetime import datetime, timedelta
+
+import pytest
+
+from boto3.dynamodb.conditions import Attr, Key
+
+from availability.domain import ConcurrencyException, CreateAvailabilityCommand, UserAvailabilityAggregate
+from availability.domain.model import Availability
+from availability.adapters.dynamodb_repo import (
+  DynamoAvailabilityRepo,
+  DynamoEventStoreRepo,
+  DynamoOutboxRepo,
+  query_items,
+  time_bucket,
+)
+from availability.ports import AvailabilityChange, APPLIED, SKIPPED_DUPLICATE, SKIPPED_STALE
+
+
+START = datetime(2030, 1, 1)
+
+
+class CountingTable:
+  def __init__(self, table):
+    self.table = table
+    self.requests = []
+
+  def query(self, **kwargs):
+    self.requests.append(dict(kwargs))
+    return self.table.query(**kwargs)
+
+
+def slot(user_id, hour):
+  return Availability(user_id=user_id, available_at=START + timedelta(hours=hour), appointment_id=None)
+
+
+@pytest.fixture
+def read_model(dynamodb):
+  return DynamoAvailabilityRepo(dynamodb.Table("availability-read-model"))
+
+
+def test_query_follows_every_page(read_model):
+  for hour in range(10):
+    read_model.create(slot("u1", hour))
+  table = CountingTable(read_model.table)
+
+  items = list(query_items(table, page_size=3, KeyConditionExpression=Key("user_id").eq("u1")))
+
+  assert [item["available_at"] for item in items] == [(START + timedelta(hours=h)).isoformat() for h in range(10)]
+  assert len(table.requests) == 4
+  assert [r.get("ExclusiveStartKey", {}).get("available_at") for r in table.requests][1:] == [
+    items[2]["available_at"], items[5]["available_at"], items[8]["available_at"]
+  ]
+
+
+def test_filtered_query_pages_until_the_limit_is_reached(read_model):
+  for hour in range(12):
+    read_model.project(AvailabilityChange(slot("u1", hour), 1, deleted=hour % 3 != 2))
+  table = CountingTable(read_model.table)
+
+  items = list(query_items(
+    table,
+    page_size=2,
+    limit=3,
+    KeyConditionExpression=Key("user_id").eq("u1"),
+    FilterExpression=Attr("deleted").not_exists()
+  ))
+
+  assert [item["available_at"][11:13] for item in items] == ["02", "05", "08"]
+  assert all(r["Limit"] == 2 for r in table.requests)
+  assert len(table.requests) == 5
+
+
+def test_fetch_of_a_user_skips_tombstones_across_pages(read_model):
+  for hour in range(8):
+    read_model.project(AvailabilityChange(slot("u1", hour), 1, deleted=hour < 5))
+
+  fetched = list(read_model.fetch(START, user_id="u1", page_size=2, limit=2))
+
+  assert [a.available_at.hour for a in fetched] == [5, 6]
+
+
+def test_availability_of_all_users_is_gathered_across_time_buckets_in_order(dynamodb):
+  read_model = DynamoAvailabilityRepo(dynamodb.Table("availability-read-model"), page_size=1, bucket_granularity="hour")
+  for user_id, hour in (("u2", 1), ("u1", 1), ("u1", 3), ("u3", 4), ("u2", 6), ("u1", 9)):
+    read_model.create(slot(user_id, hour))
+  read_model.project(AvailabilityChange(slot("u3", 4), 2, deleted=True))
+
+  fetched = list(read_model.fetch(START + timedelta(hours=1), end=START + timedelta(hours=9)))
+
+  # slots of the same time are in no particular order across users
+  assert [a.available_at.hour for a in fetched] == [1, 1, 3, 6]
+  assert sorted((a.available_at.hour, a.user_id) for a in fetched) == [(1, "u1"), (1, "u2"), (3, "u1"), (6, "u2")]
+  items = read_model.table.query(
+    IndexName="time-bucket-index", KeyConditionExpression=Key("time_bucket").eq(time_bucket(START + timedelta(hours=1), "hour"))
+  )["Items"]
+  assert sorted(item["user_id"] for item in items) == ["u1", "u2"]
+
+
+def test_availability_of_all_users_requires_an_end(read_model):
+  with pytest.raises(ValueError):
+    list(read_model.fetch(START))
+
+
+def test_stamps_only_ever_rise_and_are_not_fetched_as_availability(read_model):
+  read_model.create(slot("u1", 1))
+  assert read_model.fetch_stamp("u1") is None
+
+  read_model.stamp("u1", 3)
+  read_model.stamp("u1", 2)
+
+  assert read_model.fetch_stamp("u1") == 3
+  assert [a.user_id for a in read_model.fetch(START, user_id="u1")] == ["u1"]
+  assert [a.user_id for a in read_model.fetch(START, end=START + timedelta(days=1))] == ["u1"]
+
+
+def uncommitted(user_id, hours, version=0):
+  aggregate = UserAvailabilityAggregate(user_id=user_id, events=[])
+  for hour in hours:
+    aggregate.add_availability(CreateAvailabilityCommand(correlation_id="c", user_id=user_id, available_at=START + timedelta(hours=hour)))
+  events = aggregate.uncommitted_events
+  for i, event in enumerate(events, start=version + 1):
+    event.version = i
+  return events
+
+
+@pytest.mark.parametrize("hours", [[1], [1, 2]])
+def test_appends_conflicting_with_another_writer_raise_and_write_nothing(dynamodb, hours):
+  repo = DynamoEventStoreRepo(dynamodb.Table("availability-event-store"))
+  repo.append(uncommitted("u1", [0]))
+
+  with pytest.raises(ConcurrencyException):
+    repo.append(uncommitted("u1", hours))
+
+  assert [e.version for e in repo.fetch_events("u1")] == [1]
+
+
+def test_appends_write_the_commits_outbox_entry(dynamodb):
+  outbox = DynamoOutboxRepo(dynamodb.Table("availability-outbox"), segments=1)
+  repo = DynamoEventStoreRepo(dynamodb.Table("availability-event-store"), outbox=outbox)
+
+  repo.append(uncommitted("u1", [1, 2]))
+  repo.append(uncommitted("u1", [3], version=2))
+
+  entries = outbox.fetch_pending(0, limit=10)
+  assert [(e.version, [event.version for event in e.events]) for e in entries] == [(1, [1, 2]), (3, [3])]
+  assert [e.version for e in repo.fetch_events("u1")] == [1, 2, 3]
+
+
+def test_stored_events_are_decoded_by_the_shared_codec_as_they_were_appended(dynamodb):
+  repo = DynamoEventStoreRepo(dynamodb.Table("availability-event-store"))
+  events = uncommitted("u1", [1, 2])
+  repo.append(events)
+
+  # the store decodes the base Event, with every field as appended
+  appended = [asdict(e) for e in events]
+  assert [asdict(e) for e in repo.fetch_events("u1")] == appended
+  assert [asdict(e) for e in repo.scan_events(0, 1)] == appended
+
+
+def test_batches_never_regress_rows_written_after_their_versions_were_read(read_model, monkeypatch):
+  read_model.project(AvailabilityChange(slot("u1", 1), 3))
+  read_model.project(AvailabilityChange(slot("u1", 2), 2))
+  # as if another owner of the shard wrote both rows after this batch read them
+  monkeypatch.setattr("availability.adapters.dynamodb_repo.batch_get", lambda *args, **kwargs: [])
+
+  outcomes = read_model.project_batch([
+    AvailabilityChange(slot("u1", 1), 2, deleted=True),
+    AvailabilityChange(slot("u1", 2), 2),
+    AvailabilityChange(slot("u1", 3), 1),
+  ])
+
+  assert outcomes == [SKIPPED_STALE, SKIPPED_DUPLICATE, APPLIED]
+  assert [a.available_at.hour for a in read_model.fetch(START, user_id="u1")] == [1, 2, 3]
+
+
+def test_async_client_of_the_api_is_configured_like_the_sync_clients():
+  import asyncio
+  from availability.config import AppContext
+
+  ctx = AppContext(aws_region="eu-west-1", aws_max_attempts=7, aws_tcp_keepalive=False, dynamodb_max_pool_connections=12)
+
+  async def configs():
+    await ctx.open_async_repos()
+    try:
+      return ctx.cache["async_dynamodb"]._resource.meta.client.meta, ctx.aws_client("dynamodb").meta
+    finally:
+      await ctx.close_async_repos()
+
+  async_meta, sync_meta = asyncio.run(configs())
+  for option in ("retries", "tcp_keepalive", "max_pool_connections"):
+    assert getattr(async_meta.config, option) == getattr(sync_meta.config, option)
+  assert async_meta.region_name == sync_meta.region_name == "eu-west-1"
+  assert async_meta.config.tcp_keepalive is False
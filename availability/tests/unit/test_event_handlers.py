@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from availability.domain import (
+  Availability,
+  Event,
+  AvailabilityCreatedEvent,
+  AvailabilityDeletedEvent,
+  AppointmentAddedEvent,
+)
+from availability.ports import AvailabilityRepo, AvailabilityChange, APPLIED, SKIPPED_DUPLICATE, SKIPPED_STALE
+from availability.service import AvailabilityEventHandler
+
+
+class FakeAvailabilityRepo(AvailabilityRepo):
+  def __init__(self):
+    self.rows = {}
+    self.batches = []
+
+  def fetch(self, start, end=None, user_id=None, page_size=None, limit=None):
+    return iter([])
+
+  def create(self, availability: Availability):
+    pass
+
+  def update(self, availability: Availability):
+    pass
+
+  def delete(self, availability: Availability):
+    pass
+
+  def project(self, change: AvailabilityChange) -> str:
+    key = (change.availability.user_id, change.availability.available_at)
+    stored = self.rows.get(key)
+    if stored is not None and stored.version == change.version:
+      return SKIPPED_DUPLICATE
+    if stored is not None and stored.version > change.version:
+      return SKIPPED_STALE
+    self.rows[key] = change
+    return APPLIED
+
+  def project_batch(self, changes, conditional=True):
+    self.batches.append(changes)
+    return super().project_batch(changes, conditional)
+
+
+def event(event_cls, version, hour, appointment_id=None):
+  return event_cls(
+    event_id=f"e{version}",
+    user_id="abc123",
+    created=datetime(2022, 12, 13, 8),
+    event_type=event_cls.__name__,
+    event_payload={"user_id": "abc123", "available_at": datetime(2022, 12, 13, hour), "appointment_id": appointment_id},
+    correlation_id="c1",
+    version=version
+  )
+
+
+def test_handle_batch_writes_latest_state_per_slot():
+  repo = FakeAvailabilityRepo()
+  handler = AvailabilityEventHandler(repo)
+
+  handler.handle_batch([
+    event(AvailabilityCreatedEvent, 1, 9),
+    event(AvailabilityCreatedEvent, 2, 10),
+    event(AppointmentAddedEvent, 4, 9, "appt-1"),
+    event(AvailabilityDeletedEvent, 3, 10),
+    event(AvailabilityCreatedEvent, 2, 10),
+  ])
+
+  assert repo.batches == [[
+    AvailabilityChange(Availability("abc123", datetime(2022, 12, 13, 9), "appt-1"), version=4),
+    AvailabilityChange(Availability("abc123", datetime(2022, 12, 13, 10), None), version=3, deleted=True),
+  ]]
+  assert handler.stats()["coalesced"] == 3
+
+
+def test_redelivered_and_stale_events_are_skipped():
+  repo = FakeAvailabilityRepo()
+  handler = AvailabilityEventHandler(repo)
+
+  handler.handle(event(AvailabilityCreatedEvent, 1, 9))
+  handler.handle(event(AppointmentAddedEvent, 2, 9, "appt-1"))
+  handler.handle(event(AppointmentAddedEvent, 2, 9, "appt-1"))
+  handler.handle(event(AvailabilityCreatedEvent, 1, 9))
+
+  assert repo.rows[("abc123", datetime(2022, 12, 13, 9))].availability.appointment_id == "appt-1"
+  assert handler.stats() == {APPLIED: 2, SKIPPED_DUPLICATE: 1, SKIPPED_STALE: 1, "coalesced": 0}
@@ -0,0 +1,55 @@
+import io
+import json
+
+from availability.utils.metrics import Counter, EmfExporter, Histogram, Registry, EMF_MAX_VALUES
+
+
+def test_nothing_is_recorded_while_disabled():
+  registry = Registry()
+  latency = Histogram("latency_seconds", "latency", registry=registry)
+  latency.observe(0.5)
+
+  assert "latency_seconds_count" not in registry.prometheus_text()
+  assert registry.emf_records("Test") == []
+
+
+def test_prometheus_text_has_cumulative_buckets():
+  registry = Registry()
+  registry.enabled = True
+  latency = Histogram("latency_seconds", "latency", buckets=(0.1, 1.0), registry=registry)
+  throttles = Counter("throttles_total", "throttles", labels=("operation",), registry=registry)
+
+  for value in (0.05, 0.5, 5.0):
+    latency.observe(value)
+  throttles.inc(1, "Query")
+  throttles.inc(2, "Query")
+
+  text = registry.prometheus_text()
+  assert 'latency_seconds_bucket{le="0.1"} 1' in text
+  assert 'latency_seconds_bucket{le="1.0"} 2' in text
+  assert 'latency_seconds_bucket{le="+Inf"} 3' in text
+  assert "latency_seconds_count 3" in text
+  assert 'throttles_total{operation="Query"} 3' in text
+
+
+def test_emf_flushes_samples_and_counter_increments():
+  registry = Registry()
+  registry.enabled = True
+  latency = Histogram("latency_seconds", "latency", unit="Seconds", registry=registry)
+  throttles = Counter("throttles_total", "throttles", labels=("operation",), registry=registry)
+  stream = io.StringIO()
+  exporter = EmfExporter(registry, "Test", interval=60, dimensions={"env": "test"}, stream=stream)
+
+  for i in range(EMF_MAX_VALUES * 3):
+    latency.observe(i / 1000)
+  throttles.inc(2, "Query")
+  exporter.flush()
+  throttles.inc(1, "Query")
+  exporter.flush()
+
+  records = [json.loads(line) for line in stream.getvalue().splitlines()]
+  assert len(records[0]["latency_seconds"]) == EMF_MAX_VALUES
+  assert records[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"] == [{"Name": "latency_seconds", "Unit": "Seconds"}]
+  assert records[1]["throttles_total"] == 2
+  assert records[1]["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["env", "operation"]]
+  assert [r["throttles_total"] for r in records[2:]] == [1]
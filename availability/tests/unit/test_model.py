@@ -0,0 +1,64 @@
+from dataclasses import asdict
+from datetime import datetime, timedelta
+
+from availability.domain import (
+  CreateAvailabilityCommand,
+  DeleteAvailabilityCommand,
+  AddAppointmentCommand,
+  RemoveAppointmentCommand,
+  UserAvailabilityAggregate,
+)
+from availability.utils import event_to_item, to_isodatetime
+
+
+def committed(aggregate: UserAvailabilityAggregate):
+  for version, event in enumerate(aggregate.uncommitted_events, start=aggregate.version + 1):
+    event.version = version
+    aggregate.events.append(event)
+    aggregate.version = version
+  aggregate.uncommitted_events.clear()
+  return aggregate
+
+
+def test_replay_matches_command_path():
+  user_id = "abc123"
+  start = datetime(2022, 12, 13, 9)
+  aggregate = UserAvailabilityAggregate(user_id=user_id)
+
+  for hours in (5, 1, 3, 8, 2):
+    aggregate.add_availability(CreateAvailabilityCommand(
+      correlation_id="c1",
+      user_id=user_id,
+      available_at=start + timedelta(hours=hours),
+      appointment_id="appt-8" if hours == 8 else None
+    ))
+  aggregate.add_appointment(AddAppointmentCommand("c2", user_id, start + timedelta(hours=1), "appt-1"))
+  aggregate.add_appointment(AddAppointmentCommand("c3", user_id, start + timedelta(hours=3), "appt-3"))
+  aggregate.remove_appointment(RemoveAppointmentCommand("c4", user_id, start + timedelta(hours=3)))
+  aggregate.delete_availability(DeleteAvailabilityCommand("c5", user_id, start + timedelta(hours=5)))
+  committed(aggregate)
+
+  replayed = UserAvailabilityAggregate(user_id=user_id, events=aggregate.events)
+
+  assert replayed.availability == aggregate.availability
+  assert replayed.start == aggregate.start
+  assert replayed.version == aggregate.version == 10
+  assert not replayed.uncommitted_events
+  assert [a.available_at for a in replayed.availability] == sorted(a.available_at for a in aggregate.availability)
+
+
+def test_serializers_match_asdict():
+  user_id = "abc123"
+  aggregate = UserAvailabilityAggregate(user_id=user_id)
+  aggregate.add_availability(CreateAvailabilityCommand(
+    correlation_id="c1",
+    user_id=user_id,
+    available_at=datetime(2022, 12, 13, 9),
+    appointment_id="appt1"
+  ))
+
+  for event in aggregate.uncommitted_events:
+    assert not hasattr(event, "__dict__")
+    assert event.to_dict() == asdict(event)
+    assert event_to_item(event) == to_isodatetime(asdict(event))
+  assert [a.to_dict() for a in aggregate.availability] == [asdict(a) for a in aggregate.availability]
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from availability.domain import CreateAvailabilityCommand, UserAvailabilityAggregate
+from availability.adapters.memory_repo import InMemoryEventStoreRepo, InMemoryOutboxRepo
+from availability.adapters.memory_stream import InMemoryStream
+from availability.adapters.sqlite_repo import SqliteDatabase, SqliteEventStoreRepo, SqliteOutboxRepo
+from availability.service import AvailabilityCommandHandler, OutboxRelay
+
+
+class RejectingStream(InMemoryStream):
+  """
+  Rejects the records of the users in reject as a throttled shard would.
+  """
+  def __init__(self, reject=()):
+    super().__init__()
+    self.reject = set(reject)
+    self.calls = 0
+
+  def put_records(self, StreamName: str, Records: List[Dict]) -> Dict:
+    self.calls += 1
+    accepted = [r for r in Records if r["PartitionKey"] not in self.reject]
+    results = iter(super().put_records(StreamName, accepted)["Records"])
+    return {
+      "FailedRecordCount": len(Records) - len(accepted),
+      "Records": [
+        {"ErrorCode": "ProvisionedThroughputExceededException", "ErrorMessage": "slow down"}
+        if r["PartitionKey"] in self.reject else next(results)
+        for r in Records
+      ]
+    }
+
+
+def commit(events_repo, user_id, hours):
+  handler = AvailabilityCommandHandler(user_id=user_id, events_repo=events_repo)
+  start = datetime(2030, 1, 1)
+  with handler:
+    for hour in hours:
+      handler.add_availability(CreateAvailabilityCommand(
+        correlation_id="c", user_id=user_id, available_at=start + timedelta(hours=hour)
+      ))
+
+
+def published(stream: InMemoryStream) -> List[Dict]:
+  records = []
+  while not stream.queue.empty():
+    records.append(json.loads(stream.queue.get_nowait()["Data"]))
+  return records
+
+
+def test_relay_publishes_each_users_commits_as_one_ordered_record():
+  outbox = InMemoryOutboxRepo(segments=4)
+  events_repo = InMemoryEventStoreRepo(outbox=outbox)
+  commit(events_repo, "u1", [1, 2])
+  commit(events_repo, "u1", [3])
+  commit(events_repo, "u2", [1])
+  stream = RejectingStream()
+
+  relay = OutboxRelay(outbox, stream, "availability")
+  assert relay.relay_once() == (2, 0)
+
+  records = {r["user_id"]: r for r in published(stream)}
+  assert [e["version"] for e in records["u1"]["events"]] == [1, 2, 3]
+  assert [e["version"] for e in records["u2"]["events"]] == [1]
+  assert records["u1"]["events"][0]["available_at"] == "2030-01-01T01:00:00"
+  assert stream.calls == 1
+  assert all(not outbox.fetch_pending(segment, 10) for segment in range(4))
+  assert relay.relay_once() == (0, 0)
+
+
+def test_rejected_user_is_retried_without_later_commits_overtaking():
+  outbox = InMemoryOutboxRepo()
+  events_repo = InMemoryEventStoreRepo(outbox=outbox)
+  commit(events_repo, "u1", [1])
+  commit(events_repo, "u2", [1])
+  stream = RejectingStream(reject={"u1"})
+  relay = OutboxRelay(outbox, stream, "availability", batch_size=1)
+
+  # while u1 is rejected its later commit is passed over with it, u2 is not
+  relay.relay_once()
+  commit(events_repo, "u1", [2])
+  for _ in range(4):
+    relay.relay_once()
+  assert [r["user_id"] for r in published(stream)] == ["u2"]
+
+  stream.reject.clear()
+  for _ in range(4):
+    relay.relay_once()
+  assert [e["version"] for r in published(stream) for e in r["events"]] == [1, 2]
+  assert not outbox.fetch_pending(0, 10)
+  assert relay.counts["failed"] > 0
+
+
+def test_sqlite_append_writes_outbox_entry_in_same_transaction(tmp_path):
+  db = SqliteDatabase(str(tmp_path / "availability.db"))
+  outbox = SqliteOutboxRepo(db, segments=2)
+  events_repo = SqliteEventStoreRepo(db, outbox=outbox)
+  commit(events_repo, "u1", [1, 2])
+
+  entries = [e for segment in range(2) for e in outbox.fetch_pending(segment, 10)]
+  assert [(e.user_id, e.version, len(e.events)) for e in entries] == [("u1", 1, 2)]
+  assert entries[0].events == events_repo.fetch_events("u1")
+
+  outbox.delete(entries)
+  assert not [e for segment in range(2) for e in outbox.fetch_pending(segment, 10)]
+
+
+def test_api_commits_of_the_memory_backend_reach_the_relays_outbox():
+  from availability.config import AppContext
+
+  ctx = AppContext(repo_backend="memory", api_repo_backend="memory", outbox_enabled=True, outbox_segments=1)
+  asyncio.run(ctx.open_async_repos())
+  aggregate = UserAvailabilityAggregate(user_id="u1", events=[])
+  aggregate.add_availability(CreateAvailabilityCommand(correlation_id="c", user_id="u1", available_at=datetime(2030, 1, 1)))
+  aggregate.uncommitted_events[0].version = 1
+
+  asyncio.run(ctx.cache["async_event_store_repo"].append(aggregate.uncommitted_events))
+
+  assert [e.user_id for e in ctx.outbox_repo.fetch_pending(0, limit=10)] == ["u1"]
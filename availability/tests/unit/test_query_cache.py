@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+from availability.domain import Availability, AvailabilityCreatedEvent
+from availability.ports import AvailabilityRepo, AvailabilityChange, APPLIED
+from availability.service import AvailabilityEventHandler, AvailabilityQueryService, QueryCache
+from availability.service.query_service import default_window
+
+
+class CountingAvailabilityRepo(AvailabilityRepo):
+  def __init__(self):
+    self.rows = {}
+    self.stamps = {}
+    self.fetches = 0
+
+  def fetch(self, start, end=None, user_id=None, page_size=None, limit=None):
+    self.fetches += 1
+    return iter(sorted(
+      (a for a in self.rows.values() if user_id in (None, a.user_id)),
+      key=lambda a: a.available_at
+    ))
+
+  def create(self, availability: Availability):
+    self.rows[(availability.user_id, availability.available_at)] = availability
+
+  def update(self, availability: Availability):
+    self.create(availability)
+
+  def delete(self, availability: Availability):
+    self.rows.pop((availability.user_id, availability.available_at), None)
+
+  def project(self, change: AvailabilityChange) -> str:
+    self.update(change.availability)
+    return APPLIED
+
+  def stamp(self, user_id: str, version: int):
+    self.stamps[user_id] = max(version, self.stamps.get(user_id, 0))
+
+  def fetch_stamp(self, user_id: str) -> int:
+    return self.stamps.get(user_id)
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+START, END = datetime(2022, 12, 13), datetime(2022, 12, 14)
+
+
+def created(user_id, hour, version):
+  return AvailabilityCreatedEvent(
+    event_id=f"{user_id}-{version}",
+    user_id=user_id,
+    created=datetime(2022, 12, 13, 8),
+    event_type=AvailabilityCreatedEvent.__name__,
+    event_payload={"user_id": user_id, "available_at": datetime(2022, 12, 13, hour), "appointment_id": None},
+    correlation_id="c1",
+    version=version
+  )
+
+
+def test_results_are_cached_until_ttl():
+  repo, clock = CountingAvailabilityRepo(), FakeClock()
+  svc = AvailabilityQueryService(repo, QueryCache(ttl=5, clock=clock))
+
+  first = svc.query(user_id="abc123", start=START, end=END)
+  assert svc.query(user_id="abc123", start=START, end=END) is first
+  assert repo.fetches == 1
+
+  clock.now = 5
+  svc.query(user_id="abc123", start=START, end=END)
+  assert repo.fetches == 2
+
+
+def test_projecting_an_event_invalidates_the_users_and_cross_user_queries():
+  repo, cache = CountingAvailabilityRepo(), QueryCache()
+  svc = AvailabilityQueryService(repo, cache)
+  handler = AvailabilityEventHandler(repo, query_cache=cache)
+
+  before = svc.query(user_id="abc123", start=START, end=END)
+  svc.query(start=START, end=END)
+  svc.query(user_id="other", start=START, end=END)
+
+  handler.handle(created("abc123", 9, 1))
+
+  after = svc.query(user_id="abc123", start=START, end=END)
+  assert [a.available_at.hour for a in after.availability] == [9]
+  assert after.etag != before.etag
+  assert [a.user_id for a in svc.fetch(start=START, end=END)] == ["abc123"]
+  assert cache.stats()["invalidations"] == 2
+  assert repo.fetches == 5
+
+
+def test_results_queried_across_an_invalidation_are_not_cached():
+  cache = QueryCache()
+  generation = cache.generation
+  cache.invalidate("abc123")
+
+  cache.put(("abc123", START, END, None), object(), generation)
+
+  assert len(cache) == 0
+
+
+def test_results_cached_by_another_process_are_refreshed_once_the_user_is_stamped():
+  repo = CountingAvailabilityRepo()
+  projecting = AvailabilityEventHandler(repo, query_cache=QueryCache())
+  replica = AvailabilityQueryService(repo, QueryCache())
+
+  before = replica.query(user_id="abc123", start=START, end=END)
+  projecting.handle(created("abc123", 9, 1))
+
+  after = replica.query(user_id="abc123", start=START, end=END)
+  assert [a.available_at.hour for a in after.availability] == [9]
+  assert (after.stamp, repo.stamps) == (1, {"abc123": 1})
+  assert replica.query(user_id="abc123", start=START, end=END) is after
+  assert repo.fetches == 2
+  assert after.etag != before.etag
+
+
+def test_default_window_spans_a_day_back_and_a_week_ahead_in_whole_minutes(monkeypatch):
+  class FixedDatetime(datetime):
+    @classmethod
+    def now(cls, tz=None):
+      return datetime(2030, 1, 1, 12, 34, 56, 789)
+  monkeypatch.setattr("availability.service.query_service.datetime", FixedDatetime)
+
+  assert default_window() == (datetime(2029, 12, 31, 12, 34), datetime(2030, 1, 8, 12, 34))
+  assert default_window(start=START) == (START, datetime(2030, 1, 8, 12, 34))
@@ -0,0 +1,88 @@
+import json
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from availability.domain import AddAppointmentCommand, CreateAvailabilityCommand, DeleteAvailabilityCommand
+from availability.adapters.memory_repo import InMemoryAvailabilityRepo, InMemoryEventStoreRepo
+from availability.service import AvailabilityCommandHandler, ReadModelRebuilder, RebuildCheckpoint
+
+
+START = datetime(2030, 1, 1)
+USERS = [f"u{i}" for i in range(12)]
+
+
+def at(hour):
+  return START + timedelta(hours=hour)
+
+
+def seeded_repo() -> InMemoryEventStoreRepo:
+  repo = InMemoryEventStoreRepo()
+  for user_id in USERS:
+    with AvailabilityCommandHandler(user_id=user_id, events_repo=repo) as handler:
+      for hour in (1, 2, 3):
+        handler.add_availability(CreateAvailabilityCommand(correlation_id="c", user_id=user_id, available_at=at(hour)))
+      handler.add_appointment(AddAppointmentCommand(
+        correlation_id="c", user_id=user_id, available_at=at(2), appointment_id=f"{user_id}-a"
+      ))
+      handler.delete_availability(DeleteAvailabilityCommand(correlation_id="c", user_id=user_id, available_at=at(3)))
+  return repo
+
+
+def rows(availability_repo):
+  return sorted(
+    (a.user_id, a.available_at.hour, a.appointment_id)
+    for a in availability_repo.fetch(START, end=at(24))
+  )
+
+
+def expected_rows(users=USERS):
+  return sorted(row for u in users for row in ((u, 1, None), (u, 2, f"{u}-a")))
+
+
+def test_rebuild_folds_every_segment_into_the_read_model():
+  availability_repo = InMemoryAvailabilityRepo()
+
+  stats = ReadModelRebuilder(seeded_repo(), availability_repo, segments=4, page_size=2).run()
+
+  assert rows(availability_repo) == expected_rows()
+  assert (stats["events"], stats["users"], stats["slots"]) == (5 * len(USERS), len(USERS), 2 * len(USERS))
+
+
+def test_interrupted_rebuild_resumes_after_the_last_checkpointed_user(tmp_path):
+  path = str(tmp_path / "rebuild.json")
+  events_repo = seeded_repo()
+  first = sorted({e.user_id for e in events_repo.scan_events(0, 2)})
+  checkpoint = RebuildCheckpoint(path, 2)
+  checkpoint.advance(0, {"user_id": first[0], "version": 5})
+  checkpoint.advance(1, None, done=True)
+
+  availability_repo = InMemoryAvailabilityRepo()
+  stats = ReadModelRebuilder(events_repo, availability_repo, segments=2, checkpoint=RebuildCheckpoint(path, 2)).run()
+
+  assert rows(availability_repo) == expected_rows(first[1:])
+  assert stats["users"] == len(first) - 1
+  assert json.load(open(path))["segments"]["0"]["done"]
+
+
+def test_checkpoint_written_for_another_segment_count_is_refused(tmp_path):
+  path = str(tmp_path / "rebuild.json")
+  RebuildCheckpoint(path, 2).advance(0, None)
+
+  with pytest.raises(ValueError):
+    RebuildCheckpoint(path, 4)
+
+
+def test_cli_rebuilds_the_read_model_of_the_configured_repos(tmp_path, capsys):
+  from availability.config import AppContext
+  from availability.adapters.cli import rebuild_read_model
+
+  ctx = AppContext(repo_backend="sqlite", sqlite_path=str(tmp_path / "availability.db"))
+  for event in seeded_repo().scan_events(0, 1):
+    ctx.event_store_repo.append([event])
+
+  rebuild_read_model(ctx, segments=3, workers=2, checkpoint_file=str(tmp_path / "rebuild.json"), page_size=4)
+
+  assert json.loads(capsys.readouterr().out)["users"] == len(USERS)
+  assert rows(ctx.availability_repo) == expected_rows()
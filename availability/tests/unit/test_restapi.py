@@ -0,0 +1,53 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def client(monkeypatch):
+  from fastapi.testclient import TestClient
+
+  # the api configures its context when imported, keep it in memory
+  monkeypatch.setenv("REPO_BACKEND", "memory")
+  monkeypatch.setenv("API_REPO_BACKEND", "memory")
+  restapi = importlib.import_module("availability.adapters.restapi")
+  with TestClient(restapi.app) as client:
+    yield client
+
+
+def test_updating_a_slot_that_does_not_exist_is_not_found(client):
+  response = client.put(
+    "/api/v1/walker/u-missing/availability",
+    json={"available_at": "2030-01-01T09:00:00", "appointment_id": "a1"},
+    headers={"x-correlation-id": "c1"}
+  )
+
+  assert response.status_code == 404
+
+
+def test_availability_of_all_users_defaults_to_the_default_window(client):
+  response = client.get("/api/v1/availability")
+
+  assert response.status_code == 200
+  assert response.json()["start"] < response.json()["end"]
+
+
+def test_availability_window_must_end_after_it_starts(client):
+  response = client.get(
+    "/api/v1/availability",
+    params={"user_id": "u1", "start": "2030-01-02T00:00:00", "end": "2030-01-01T00:00:00"}
+  )
+
+  assert response.status_code == 400
+
+
+def test_availability_of_all_users_within_a_window(client):
+  client.post(
+    "/api/v1/walker/u1/availability",
+    json={"available_at": "2030-01-01T09:00:00"},
+    headers={"x-correlation-id": "c1"}
+  )
+
+  response = client.get("/api/v1/availability", params={"start": "2030-01-01T00:00:00", "end": "2030-01-02T00:00:00"})
+
+  assert response.status_code == 200
@@ -0,0 +1,294 @@
+from datetime import datetime
+from typing import List
+
+import pytest
+
+from botocore.exceptions import ClientError
+
+from availability.config import AppContext
+from availability.domain import AvailabilityCreatedEvent, Event
+from availability.adapters.shard_consumer import (
+  CdcShardWorker,
+  ShardCheckpointer,
+  ShardReader,
+  ShardWorker,
+  owned_shards,
+  run_supervisor,
+)
+
+from tests.unit.fixtures import cdc_data
+
+
+STREAM = "availability-cdc"
+
+
+def created(user_id: str, version: int) -> Event:
+  available_at = datetime(2030, 1, 1, version)
+  return AvailabilityCreatedEvent(
+    event_id=f"{user_id}-{version}",
+    user_id=user_id,
+    created=datetime(2030, 1, 1),
+    event_type=AvailabilityCreatedEvent.__name__,
+    event_payload={"user_id": user_id, "available_at": available_at, "appointment_id": None},
+    correlation_id="c",
+    version=version
+  )
+
+
+def make_context(shards: int = 1, **settings) -> AppContext:
+  ctx = AppContext(repo_backend="memory", aws_region="us-east-1", **settings)
+  ctx.aws_client("kinesis").create_stream(StreamName=STREAM, ShardCount=shards)
+  return ctx
+
+
+def put_events(ctx: AppContext, events: List[Event]) -> List[str]:
+  kinesis = ctx.aws_client("kinesis")
+  return [
+    kinesis.put_record(StreamName=STREAM, Data=cdc_data(e), PartitionKey=e.user_id)["SequenceNumber"]
+    for e in events
+  ]
+
+
+class RecordingHandler:
+  """
+  Records what the worker has checkpointed at the time each batch is written.
+  """
+  def __init__(self, worker: CdcShardWorker, shard_id: str, fail_user: str = None):
+    self.worker = worker
+    self.shard_id = shard_id
+    self.fail_user = fail_user
+    self.batches = []
+    self.handled = []
+
+  def _checkpointed(self):
+    return self.worker.checkpointer.get(self.shard_id).get("seq")
+
+  def handle(self, event: Event):
+    if event.user_id == self.fail_user:
+      raise RuntimeError("read model unavailable")
+    self.handled.append((event.user_id, self._checkpointed()))
+
+  def handle_batch(self, events: List[Event]):
+    self.batches.append(([e.version for e in events], self._checkpointed()))
+
+
+def test_records_are_checkpointed_only_after_their_batch_is_written(dynamodb):
+  ctx = make_context(projection_batch_size=2, checkpoint_every_records=1)
+  sequence_numbers = put_events(ctx, [created("u1", v) for v in (1, 2, 3)])
+
+  worker = CdcShardWorker(ctx, 0, 1)
+  worker._assign_shards()
+  (shard_id, reader), = worker.readers.items()
+  worker.handler = handler = RecordingHandler(worker, shard_id)
+  worker._poll(reader)
+
+  assert handler.batches == [([1, 2], None), ([3], None)]
+  assert worker.checkpointer.get(shard_id)["seq"] == sequence_numbers[-1]
+
+
+def test_concurrently_projected_records_are_checkpointed_once_all_are_written(dynamodb):
+  ctx = make_context(projection_mode="async", checkpoint_every_records=1)
+  sequence_numbers = put_events(ctx, [created(u, 1) for u in ("u1", "u2", "u3")])
+
+  worker = CdcShardWorker(ctx, 0, 1)
+  worker._assign_shards()
+  (shard_id, reader), = worker.readers.items()
+  worker.projector.handler = handler = RecordingHandler(worker, shard_id)
+  worker._poll(reader)
+
+  assert sorted(handler.handled) == [("u1", None), ("u2", None), ("u3", None)]
+  assert worker.checkpointer.get(shard_id)["seq"] == sequence_numbers[-1]
+
+
+def test_a_failed_concurrent_write_leaves_the_records_uncheckpointed(dynamodb):
+  ctx = make_context(projection_mode="async", checkpoint_every_records=1)
+  put_events(ctx, [created(u, 1) for u in ("u1", "u2")])
+
+  worker = CdcShardWorker(ctx, 0, 1)
+  worker._assign_shards()
+  (shard_id, reader), = worker.readers.items()
+  worker.projector.handler = RecordingHandler(worker, shard_id, fail_user="u2")
+
+  with pytest.raises(RuntimeError):
+    worker._poll(reader)
+  assert worker.checkpointer.get(shard_id) == {}
+
+
+class RecordingWorker(ShardWorker):
+  def __init__(self, ctx: AppContext, worker_index: int = 0, worker_count: int = 1):
+    super().__init__(ctx, worker_index, worker_count)
+    self.read = []
+
+  def process_records(self, records):
+    self.read.extend(r["SequenceNumber"] for r in records)
+
+
+def test_workers_must_process_records(dynamodb):
+  class IncompleteWorker(ShardWorker):
+    pass
+
+  with pytest.raises(TypeError):
+    IncompleteWorker(make_context(), 0, 1)
+
+
+def shard(shard_id: str, closed: bool = False) -> dict:
+  sequence_range = {"StartingSequenceNumber": "1"}
+  if closed:
+    sequence_range["EndingSequenceNumber"] = "2"
+  return {"ShardId": shard_id, "SequenceNumberRange": sequence_range}
+
+
+def test_checkpointer_keeps_a_position_and_whether_the_shard_is_finished(dynamodb):
+  checkpointer = ShardCheckpointer(dynamodb.Table("availability-consumer"), STREAM)
+
+  assert checkpointer.get("shardId-0") == {}
+  checkpointer.checkpoint("shardId-0", "10")
+  assert checkpointer.get("shardId-0")["seq"] == "10"
+  assert not checkpointer.is_finished("shardId-0")
+
+  checkpointer.checkpoint("shardId-0", "12", finished=True)
+  assert checkpointer.is_finished("shardId-0")
+  assert dynamodb.Table("availability-consumer").get_item(Key={"shard": f"{STREAM}:shardId-0"})["Item"]["seq"] == "12"
+
+
+def test_reader_checkpoints_the_records_it_advanced_past_and_resumes_after_them(dynamodb):
+  ctx = make_context()
+  sequence_numbers = put_events(ctx, [created("u1", v) for v in (1, 2, 3)])
+  kinesis = ctx.aws_client("kinesis")
+  shard_id = kinesis.list_shards(StreamName=STREAM)["Shards"][0]["ShardId"]
+  checkpointer = ShardCheckpointer(dynamodb.Table("availability-consumer"), STREAM)
+
+  reader = ShardReader(kinesis, STREAM, shard_id, checkpointer)
+  reader.checkpoint()
+  assert checkpointer.get(shard_id) == {}
+
+  reader.advance(reader.read(2))
+  assert reader.uncheckpointed == 2
+  reader.checkpoint()
+  assert (reader.uncheckpointed, checkpointer.get(shard_id)["seq"]) == (0, sequence_numbers[1])
+
+  resumed = ShardReader(kinesis, STREAM, shard_id, checkpointer)
+  assert [r["SequenceNumber"] for r in resumed.read(10)] == sequence_numbers[2:]
+
+
+def test_shards_are_dealt_evenly_with_open_and_closed_shards_dealt_separately():
+  shards = [shard(f"shardId-{i}") for i in range(5)] + [shard("shardId-9", closed=True)]
+
+  owned = [[s["ShardId"] for s in owned_shards(shards, i, 2)] for i in range(2)]
+
+  assert owned == [["shardId-0", "shardId-2", "shardId-4", "shardId-9"], ["shardId-1", "shardId-3"]]
+  assert owned_shards(shards[:1], 1, 2) == []
+
+
+def test_worker_hands_over_shards_dealt_to_another_worker(dynamodb):
+  ctx = make_context(shards=2)
+  worker = RecordingWorker(ctx)
+  worker._assign_shards()
+  assert len(worker.readers) == 2
+
+  worker.worker_count = 2
+  worker._assign_shards()
+  assert list(worker.readers) == [owned_shards(list_stream_shards(ctx), 0, 2)[0]["ShardId"]]
+
+
+def list_stream_shards(ctx: AppContext):
+  return ctx.aws_client("kinesis").list_shards(StreamName=STREAM)["Shards"]
+
+
+class FakeKinesis:
+  """
+  Shards of numbered records, whose iterators end once a closed shard has
+  been read, as Kinesis does after resharding.
+  """
+  def __init__(self, shards: List[dict], records: dict):
+    self.shards = shards
+    self.records = records
+    self.throttle = 0
+
+  def list_shards(self, **kwargs):
+    return {"Shards": self.shards}
+
+  def get_shard_iterator(self, ShardId, ShardIteratorType, StartingSequenceNumber=None, **kwargs):
+    position = 0
+    if ShardIteratorType == "AFTER_SEQUENCE_NUMBER":
+      position = self.records[ShardId].index(StartingSequenceNumber) + 1
+    return {"ShardIterator": f"{ShardId}/{position}"}
+
+  def get_records(self, ShardIterator, Limit):
+    if self.throttle:
+      self.throttle -= 1
+      error = {"Error": {"Code": "ProvisionedThroughputExceededException", "Message": "slow down"}}
+      raise ClientError(error, "GetRecords")
+
+    shard_id, position = ShardIterator.split("/")
+    records = self.records[shard_id][int(position):int(position) + Limit]
+    position = int(position) + len(records)
+    closed = any(s["ShardId"] == shard_id and "EndingSequenceNumber" in s["SequenceNumberRange"] for s in self.shards)
+    next_iterator = None if closed and position == len(self.records[shard_id]) else f"{shard_id}/{position}"
+    return {"Records": [{"SequenceNumber": seq} for seq in records], "NextShardIterator": next_iterator}
+
+
+def fake_worker(dynamodb, shards: List[dict], records: dict) -> RecordingWorker:
+  worker = RecordingWorker(AppContext(repo_backend="memory", aws_region="us-east-1"))
+  worker.kinesis = FakeKinesis(shards, records)
+  return worker
+
+
+def test_children_are_read_only_after_their_parent_is_finished(dynamodb):
+  shards = [
+    shard("shardId-0", closed=True),
+    {**shard("shardId-1"), "ParentShardId": "shardId-0"},
+    {**shard("shardId-2"), "ParentShardId": "shardId-0"},
+  ]
+  worker = fake_worker(dynamodb, shards, {"shardId-0": ["1", "2"], "shardId-1": ["3"], "shardId-2": ["4"]})
+
+  worker._assign_shards()
+  assert list(worker.readers) == ["shardId-0"]
+
+  worker._poll(worker.readers["shardId-0"])
+  assert worker.read == ["1", "2"]
+  assert worker.readers == {} and worker.checkpointer.is_finished("shardId-0")
+
+  worker._assign_shards()
+  assert sorted(worker.readers) == ["shardId-1", "shardId-2"]
+  for reader in list(worker.readers.values()):
+    worker._poll(reader)
+  assert worker.read == ["1", "2", "3", "4"]
+
+
+def test_throttled_reads_back_off_and_are_retried(dynamodb, monkeypatch):
+  worker = fake_worker(dynamodb, [shard("shardId-0")], {"shardId-0": ["1"]})
+  worker.kinesis.throttle = 1
+  worker._assign_shards()
+  (reader,) = worker.readers.values()
+  monkeypatch.setattr("availability.adapters.shard_consumer.monotonic", lambda: 100.0)
+
+  worker._poll(reader)
+  assert (worker.read, reader.next_poll) == ([], 101.0)
+
+  worker._poll(reader)
+  assert worker.read == ["1"]
+
+
+class StartedProcess:
+  started = []
+
+  def __init__(self, target, args, name, daemon):
+    self.name = name
+
+  def start(self):
+    StartedProcess.started.append(self.name)
+
+
+def test_supervisor_starts_no_more_workers_than_open_shards(dynamodb, monkeypatch):
+  ctx = make_context(shards=2)
+  StartedProcess.started = []
+  monkeypatch.setattr("availability.adapters.shard_consumer.multiprocessing.Process", StartedProcess)
+
+  def stop(seconds):
+    raise KeyboardInterrupt
+  monkeypatch.setattr("availability.adapters.shard_consumer.sleep", stop)
+
+  with pytest.raises(KeyboardInterrupt):
+    run_supervisor(ctx, worker_count=8)
+  assert StartedProcess.started == ["shard-worker-0", "shard-worker-1"]
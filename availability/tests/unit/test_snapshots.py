@@ -0,0 +1,137 @@
+from datetime import datetime, timedelta
+
+from availability.domain import (
+  AddAppointmentCommand,
+  CreateAvailabilityCommand,
+  DeleteAvailabilityCommand,
+  UserAvailabilityAggregate,
+)
+from availability.domain.snapshot import EveryNEventsSnapshotPolicy
+from availability.adapters.dynamodb_repo import (
+  DynamoEventStoreRepo,
+  snapshot_from_ddb_item,
+  snapshot_request,
+  snapshot_to_ddb_item,
+)
+from availability.service import AvailabilityCommandHandler
+
+
+START = datetime(2030, 1, 1)
+
+
+def at(hour):
+  return START + timedelta(hours=hour)
+
+
+def make_repo(dynamodb, snapshot_every: int = None) -> DynamoEventStoreRepo:
+  return DynamoEventStoreRepo(
+    dynamodb.Table("availability-event-store"),
+    snapshot_table=dynamodb.Table("availability-snapshot") if snapshot_every else None,
+    snapshot_policy=EveryNEventsSnapshotPolicy(snapshot_every) if snapshot_every else None
+  )
+
+
+def commit(repo, *commands):
+  with AvailabilityCommandHandler(user_id="u1", events_repo=repo) as handler:
+    for cmd in commands:
+      if isinstance(cmd, CreateAvailabilityCommand):
+        handler.add_availability(cmd)
+      elif isinstance(cmd, AddAppointmentCommand):
+        handler.add_appointment(cmd)
+      else:
+        handler.delete_availability(cmd)
+
+
+def create(hour):
+  return CreateAvailabilityCommand(correlation_id="c", user_id="u1", available_at=at(hour))
+
+
+def book(hour, appointment_id):
+  return AddAppointmentCommand(correlation_id="c", user_id="u1", available_at=at(hour), appointment_id=appointment_id)
+
+
+def delete(hour):
+  return DeleteAvailabilityCommand(correlation_id="c", user_id="u1", available_at=at(hour))
+
+
+def state(aggregate):
+  return aggregate.version, [(a.available_at, a.appointment_id) for a in aggregate.availability]
+
+
+def full_replay(repo):
+  return UserAvailabilityAggregate(user_id="u1", events=repo.fetch_events("u1"))
+
+
+def test_snapshot_round_trips_through_its_item():
+  aggregate = UserAvailabilityAggregate(user_id="u1", start=START)
+  aggregate.add_availability(create(1))
+  aggregate.add_availability(create(2))
+  aggregate.add_appointment(book(2, "a1"))
+  aggregate.version = 3
+
+  snapshot = snapshot_from_ddb_item(snapshot_to_ddb_item(aggregate.snapshot()))
+
+  assert snapshot == aggregate.snapshot()
+
+
+def test_fetch_replays_only_the_events_after_the_snapshot(dynamodb):
+  repo = make_repo(dynamodb, snapshot_every=3)
+  commit(repo, create(1), create(2), book(2, "a1"))
+  commit(repo, create(3), delete(1))
+
+  aggregate = repo.fetch("u1")
+
+  assert (aggregate.snapshot_version, [e.version for e in aggregate.events]) == (3, [4, 5])
+  assert state(aggregate) == state(full_replay(repo))
+
+
+def test_missing_snapshot_falls_back_to_a_full_replay(dynamodb):
+  repo = make_repo(dynamodb, snapshot_every=10)
+  commit(repo, create(1), create(2), book(2, "a1"))
+
+  aggregate = repo.fetch("u1")
+
+  assert (aggregate.snapshot_version, len(aggregate.events)) == (0, 3)
+  assert state(aggregate) == state(full_replay(repo))
+
+
+def test_stale_snapshot_is_caught_up_and_never_replaces_a_newer_one(dynamodb):
+  repo = make_repo(dynamodb, snapshot_every=2)
+  commit(repo, create(1), create(2))
+  stale = repo.fetch("u1")
+  commit(repo, book(1, "a1"), create(3))
+  stale.snapshot_version = 0
+  repo.save_snapshot(stale)
+
+  aggregate = repo.fetch("u1")
+
+  assert aggregate.snapshot_version == 4 and aggregate.events == []
+  assert state(aggregate) == state(full_replay(repo))
+
+
+def test_without_a_snapshot_table_every_fetch_is_a_full_replay(dynamodb):
+  repo = make_repo(dynamodb)
+  commit(repo, create(1), create(2), book(2, "a1"))
+
+  aggregate = repo.fetch("u1")
+
+  assert (aggregate.snapshot_version, len(aggregate.events)) == (0, 3)
+
+
+def test_snapshots_too_large_for_an_item_are_not_saved_until_the_next_one_is_due(dynamodb, monkeypatch):
+  monkeypatch.setattr("availability.adapters.dynamodb_repo.MAX_SNAPSHOT_ITEM_BYTES", 200)
+  repo = make_repo(dynamodb, snapshot_every=2)
+  commit(repo, create(1), create(2), create(3))
+  assert snapshot_request(repo.fetch("u1").snapshot()) is None
+
+  aggregate = repo.fetch("u1")
+  assert (aggregate.snapshot_version, len(aggregate.events)) == (0, 3)
+  assert state(aggregate) == state(full_replay(repo))
+
+
+def test_snapshots_of_many_slots_stay_within_the_item_limit():
+  aggregate = UserAvailabilityAggregate(user_id="u1", start=START)
+  for hour in range(2000):
+    aggregate.add_availability(create(hour))
+
+  assert snapshot_request(aggregate.snapshot()) is not None
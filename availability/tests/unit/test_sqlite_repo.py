@@ -0,0 +1,181 @@
+import sqlite3
+import threading
+import time
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from availability.domain import ConcurrencyException, CreateAvailabilityCommand, UserAvailabilityAggregate
+from availability.domain.model import Availability
+from availability.domain.snapshot import EveryNEventsSnapshotPolicy
+from availability.adapters.memory_repo import InMemoryEventStoreRepo
+from availability.adapters.sqlite_repo import SqliteAvailabilityRepo, SqliteDatabase, SqliteEventStoreRepo
+from availability.ports import AvailabilityChange, APPLIED, SKIPPED_DUPLICATE, SKIPPED_STALE
+from availability.service import AvailabilityCommandHandler
+
+
+START = datetime(2030, 1, 1)
+
+
+@pytest.fixture
+def db(tmp_path):
+  return SqliteDatabase(str(tmp_path / "availability.db"), busy_timeout_ms=2000)
+
+
+def slots(repo, user_id, hours):
+  with AvailabilityCommandHandler(user_id=user_id, events_repo=repo) as handler:
+    for hour in hours:
+      handler.add_availability(CreateAvailabilityCommand(
+        correlation_id="c", user_id=user_id, available_at=START + timedelta(hours=hour)
+      ))
+
+
+def slot(user_id, hour, appointment_id=None):
+  return Availability(user_id=user_id, available_at=START + timedelta(hours=hour), appointment_id=appointment_id)
+
+
+def test_appending_a_version_written_concurrently_raises_and_writes_nothing(db):
+  repo = SqliteEventStoreRepo(db)
+  stale = repo.fetch("u1")
+  slots(repo, "u1", [1])
+  for hour in (2, 3):
+    stale.add_availability(CreateAvailabilityCommand(
+      correlation_id="c", user_id="u1", available_at=START + timedelta(hours=hour)
+    ))
+  events = stale.uncommitted_events
+  for version, event in enumerate(events, start=1):
+    event.version = version
+
+  with pytest.raises(ConcurrencyException):
+    repo.append(events)
+  assert [e.available_at.hour for e in repo.fetch("u1").availability] == [1]
+
+
+def test_fetch_replays_only_the_events_after_the_snapshot(db):
+  repo = SqliteEventStoreRepo(db, EveryNEventsSnapshotPolicy(2))
+  slots(repo, "u1", [1, 2])
+  repo.save_snapshot(repo.fetch("u1"))
+  slots(repo, "u1", [3])
+
+  snapshot = repo.fetch_snapshot("u1")
+  aggregate = repo.fetch("u1")
+
+  assert snapshot.version == 2
+  assert [a.available_at for a in snapshot.availability] == [START + timedelta(hours=h) for h in (1, 2)]
+  assert [e.version for e in aggregate.events] == [3]
+  assert [a.available_at.hour for a in aggregate.availability] == [1, 2, 3]
+
+
+def test_an_older_snapshot_never_replaces_a_newer_one(db):
+  repo = SqliteEventStoreRepo(db, EveryNEventsSnapshotPolicy(1))
+  slots(repo, "u1", [1])
+  old = repo.fetch("u1")
+  slots(repo, "u1", [2])
+  repo.save_snapshot(repo.fetch("u1"))
+  old.snapshot_version = 0
+  repo.save_snapshot(old)
+
+  assert repo.fetch_snapshot("u1").version == 2
+
+
+def test_scan_segments_partition_the_events_and_resume_after_a_key(db):
+  repo = SqliteEventStoreRepo(db)
+  for user_id in ("u1", "u2", "u3", "u4", "u5"):
+    slots(repo, user_id, [1, 2])
+
+  segments = [list(repo.scan_events(segment, 3, page_size=2)) for segment in range(3)]
+  scanned = sorted((e.user_id, e.version) for events in segments for e in events)
+  resumed = list(repo.scan_events(0, 1, after={"user_id": "u2", "version": 1}))
+
+  assert scanned == [(u, v) for u in ("u1", "u2", "u3", "u4", "u5") for v in (1, 2)]
+  # each user's events are all in one segment
+  users = [{e.user_id for e in events} for events in segments]
+  assert sum(len(u) for u in users) == 5
+  assert [(e.user_id, e.version) for e in resumed][:2] == [("u2", 2), ("u3", 1)]
+
+
+def test_users_fall_in_the_same_scan_segment_as_in_the_other_stores(db):
+  repo, memory = SqliteEventStoreRepo(db), InMemoryEventStoreRepo()
+  for user_id in ("u1", "u2", "u3", "u4", "u5"):
+    slots(repo, user_id, [1])
+    slots(memory, user_id, [1])
+
+  for segment in range(4):
+    assert [e.user_id for e in repo.scan_events(segment, 4)] == [e.user_id for e in memory.scan_events(segment, 4)]
+
+
+def test_connections_use_wal_and_wait_for_a_concurrent_writer(db):
+  repo = SqliteEventStoreRepo(db)
+  assert db.connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+  locked = threading.Event()
+
+  def hold_write_lock():
+    conn = db.connect()
+    conn.execute("BEGIN IMMEDIATE")
+    locked.set()
+    time.sleep(0.3)
+    conn.rollback()
+    conn.close()
+
+  writer = threading.Thread(target=hold_write_lock)
+  writer.start()
+  locked.wait()
+  started = time.monotonic()
+  slots(repo, "u1", [1])
+  writer.join()
+
+  assert time.monotonic() - started >= 0.2
+  assert len(repo.fetch_events("u1")) == 1
+
+
+def test_busy_database_raises_once_the_timeout_is_exceeded(tmp_path):
+  db = SqliteDatabase(str(tmp_path / "availability.db"), busy_timeout_ms=50)
+  conn = db.connect()
+  conn.execute("BEGIN IMMEDIATE")
+  try:
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+      slots(SqliteEventStoreRepo(db), "u1", [1])
+  finally:
+    conn.rollback()
+
+
+def test_read_model_queries_by_user_and_across_users(db):
+  repo = SqliteAvailabilityRepo(db, page_size=1)
+  for availability in (slot("u2", 1), slot("u1", 1), slot("u1", 2, "a1"), slot("u1", 5), slot("u3", 9)):
+    repo.create(availability)
+  repo.delete(slot("u1", 5))
+
+  def fetched(**kwargs):
+    return [(a.user_id, a.available_at.hour, a.appointment_id) for a in repo.fetch(START, **kwargs)]
+
+  assert fetched(user_id="u1") == [("u1", 1, None), ("u1", 2, "a1")]
+  assert fetched(end=START + timedelta(hours=3)) == [("u1", 1, None), ("u2", 1, None), ("u1", 2, "a1")]
+  assert fetched(end=START + timedelta(hours=10), limit=2) == [("u1", 1, None), ("u2", 1, None)]
+  with pytest.raises(ValueError):
+    fetched()
+
+
+def test_projection_is_gated_by_version_and_keeps_tombstones(db):
+  repo = SqliteAvailabilityRepo(db)
+
+  assert repo.project(AvailabilityChange(slot("u1", 1), 1)) == APPLIED
+  assert repo.project(AvailabilityChange(slot("u1", 1, "a1"), 3)) == APPLIED
+  assert repo.project_batch([
+    AvailabilityChange(slot("u1", 1), 2),
+    AvailabilityChange(slot("u1", 1, "a1"), 3),
+    AvailabilityChange(slot("u1", 1), 4, deleted=True),
+  ]) == [SKIPPED_STALE, SKIPPED_DUPLICATE, APPLIED]
+  assert list(repo.fetch(START, user_id="u1")) == []
+  assert repo.project(AvailabilityChange(slot("u1", 1), 4)) == SKIPPED_DUPLICATE
+
+
+def test_stamps_only_ever_rise_and_are_not_fetched_as_availability(db):
+  repo = SqliteAvailabilityRepo(db)
+  assert repo.fetch_stamp("u1") is None
+
+  repo.stamp("u1", 3)
+  repo.stamp("u1", 2)
+  assert repo.fetch_stamp("u1") == 3
+  assert list(repo.fetch(START, user_id="u1")) == []
@@ -0,0 +1,59 @@
+import pytest
+
+from availability.config.ssm import SSM_BATCH_SIZE, SSM_CACHE_TTL, clear_ssm_cache, fetch_ssm_parameters
+
+
+class FakeSsm:
+  def __init__(self, parameters):
+    self.parameters = parameters
+    self.requests = []
+
+  def get_parameters(self, Names):
+    self.requests.append(Names)
+    return {
+      "Parameters": [{"Name": name, "Value": self.parameters[name]} for name in Names if name in self.parameters],
+      "InvalidParameters": [name for name in Names if name not in self.parameters],
+    }
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+  clear_ssm_cache()
+  yield
+  clear_ssm_cache()
+
+
+def test_fetches_in_batches_and_caches():
+  parameters = {f"/availability/param{i}": str(i) for i in range(SSM_BATCH_SIZE * 2 + 3)}
+  ssm = FakeSsm(parameters)
+  now = [0.0]
+
+  assert fetch_ssm_parameters(parameters, ssm, clock=lambda: now[0]) == parameters
+  assert [len(names) for names in ssm.requests] == [SSM_BATCH_SIZE, SSM_BATCH_SIZE, 3]
+
+  assert fetch_ssm_parameters(parameters, ssm, clock=lambda: now[0]) == parameters
+  assert len(ssm.requests) == 3
+
+  now[0] = SSM_CACHE_TTL
+  fetch_ssm_parameters(["/availability/param0"], ssm, clock=lambda: now[0])
+  assert ssm.requests[-1] == ["/availability/param0"]
+
+
+def test_missing_parameters_raise():
+  ssm = FakeSsm({"/availability/port": "8000"})
+  with pytest.raises(ValueError, match="/availability/nope"):
+    fetch_ssm_parameters(["/availability/port", "/availability/nope"], ssm)
+
+
+def test_configure_fetches_parameters_through_the_contexts_session(aws):
+  import boto3
+  from availability.config import configure
+
+  boto3.client("ssm", region_name="us-east-1").put_parameter(Name="/availability/ttl", Value="7", Type="String")
+
+  ctx = configure(aws_region="us-east-1", aws_ssm_query_cache_ttl="/availability/ttl")
+
+  # the client and session that fetched the parameters are the context's own
+  assert ctx.query_cache_ttl == 7
+  assert {"ssm_client", "boto3_session"} <= set(ctx.cache)
+  assert ctx.aws_client("ssm").meta.region_name == "us-east-1"
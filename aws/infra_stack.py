@@ -17,8 +17,11 @@ class InfraStack(Stack):
   fargate: ecs.Cluster
   cdc_stream: kinesis.Stream
   availability_eventstore: ddb.Table
+  availability_snapshot_tbl: ddb.Table
   availability_consumer_tbl: ddb.Table
   availability_tbl: ddb.Table
+  availability_outbox_tbl: ddb.Table
+  integration_stream: kinesis.Stream
 
   def __init__(self, scope: Construct, construct_id: str, *args, **kwargs):
     super().__init__(scope, construct_id, *args, **kwargs)
@@ -26,7 +29,7 @@ class InfraStack(Stack):
     self.vpc = ec2.Vpc(self, 'vpc', max_azs=2)
     self.fargate = ecs.Cluster(self, 'fargate')
 
-    self.cdc_stream = kinesis.Stream(self, 'cdc-stream', stream_name='availability-cdc', shard_count=1)
+    self.cdc_stream = kinesis.Stream(self, 'cdc-stream', stream_name='availability-cdc', shard_count=4)
     self.availability_eventstore = ddb.Table(self, 'availability-eventstore',
       table_name='availability-event-store',
       partition_key=ddb.Attribute(name='user_id', type=ddb.AttributeType.STRING),
@@ -36,6 +39,12 @@ class InfraStack(Stack):
       stream=ddb.StreamViewType.NEW_IMAGE,
       kinesis_stream=self.cdc_stream
     )
+    self.availability_snapshot_tbl = ddb.Table(self, 'availability-snapshot-tbl',
+      table_name='availability-snapshot',
+      partition_key=ddb.Attribute(name='user_id', type=ddb.AttributeType.STRING),
+      read_capacity=2,
+      write_capacity=2
+    )
     self.availability_consumer_tbl = ddb.Table(self, 'availability-consumer-tbl',
       table_name='availability-consumer',
       partition_key=ddb.Attribute(name='shard', type=ddb.AttributeType.STRING),
@@ -45,12 +54,36 @@ class InfraStack(Stack):
     self.availability_tbl = ddb.Table(self, "availability-read-model",
       table_name='availability-read-model',
       partition_key=ddb.Attribute(name='user_id', type=ddb.AttributeType.STRING),
-      sort_key=ddb.Attribute(name='time_slot', type=ddb.AttributeType.STRING),
+      sort_key=ddb.Attribute(name='available_at', type=ddb.AttributeType.STRING),
+      read_capacity=2,
+      write_capacity=2,
+      time_to_live_attribute='expires_at'
+    )
+    # events of each commit written with it for the outbox relay to publish
+    # to the integration stream, partitioned by segment so relays can divide
+    # the segments between them
+    self.availability_outbox_tbl = ddb.Table(self, 'availability-outbox-tbl',
+      table_name='availability-outbox',
+      partition_key=ddb.Attribute(name='segment', type=ddb.AttributeType.NUMBER),
+      sort_key=ddb.Attribute(name='entry_id', type=ddb.AttributeType.STRING),
+      read_capacity=2,
+      write_capacity=2
+    )
+    self.integration_stream = kinesis.Stream(self, 'integration-stream', stream_name='availability', shard_count=2)
+    # supports availability queries across all users by time range, items are
+    # given a day (or hour) time_bucket attribute by the read model projection
+    self.availability_tbl.add_global_secondary_index(
+      index_name='time-bucket-index',
+      partition_key=ddb.Attribute(name='time_bucket', type=ddb.AttributeType.STRING),
+      sort_key=ddb.Attribute(name='available_at', type=ddb.AttributeType.STRING),
       read_capacity=2,
       write_capacity=2
     )
 
     CfnOutput(self, 'event-store-tbl-name', value=self.availability_eventstore.table_name)
+    CfnOutput(self, 'snapshot-tbl-name', value=self.availability_snapshot_tbl.table_name)
     CfnOutput(self, 'cdc-stream-name', value=self.cdc_stream.stream_name)
     CfnOutput(self, 'availability-consumer-tbl-name', value=self.availability_consumer_tbl.table_name)
     CfnOutput(self, 'availability-readmodel-tbl-name', value=self.availability_tbl.table_name)
+    CfnOutput(self, 'availability-outbox-tbl-name', value=self.availability_outbox_tbl.table_name)
+    CfnOutput(self, 'integration-stream-name', value=self.integration_stream.stream_name)